@@ -0,0 +1,17 @@
+import pytest
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "bench: timing budgets, only run when selected with -m bench"
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    # Budgets depend on the machine, so a plain pytest run skips them
+    if "bench" in config.getoption("markexpr"):
+        return
+    skip = pytest.mark.skip(reason="benchmark; select with -m bench")
+    for item in items:
+        if "bench" in item.keywords:
+            item.add_marker(skip)
@@ -0,0 +1,250 @@
+"""Drive the whole pipeline from a replayed sensor, without any hardware.
+
+python benchmarks/replay.py [--hz 80] [--speed 10] [--seconds 60] [--poll 1]
+                            [--flush 1] [--rows 200000]
+
+source/replay.py feeds --seconds of a synthetic --hz trace through the
+sensor loop into a fresh weights.db, in its own process, --speed times
+faster than real time. The provider serves that DB over HTTP, and a consumer runs catchup
+every --poll seconds, as poll.py would. The replay then runs again pushing
+each sample to the consumer's /ingest as it is read, with the sensor
+committing every --flush seconds, and a final catchup checks that nothing
+pushed is pulled again.
+End-to-end latency is measured for every row: from its ts to when the
+consumer had committed it.
+
+Then each stage is run alone as fast as it goes, on --rows rows, for its
+most sustainable sample rate: the sensor loop writing to SQLite, the
+provider serving pages, consumer catchup, and consumer /ingest taking
+batches of 500 rows.
+"""
+
+import argparse
+import configparser
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "consumer"))
+sys.path.append(os.path.join(ROOT, "common"))
+
+INGEST_BATCH = 500
+
+
+def replay(datadir, *args):
+    """Start source/replay.py writing into datadir; return the process."""
+    return subprocess.Popen(
+        [sys.executable, "replay.py", "synthetic", *args],
+        cwd=os.path.join(ROOT, "source"),
+        env=dict(os.environ, DATA_DIR=datadir),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+
+def finish(process):
+    stdout, _ = process.communicate()
+    if process.returncode != 0:
+        sys.exit("replay failed")
+    return json.loads(stdout.splitlines()[-1])
+
+
+def percentiles(values):
+    values = sorted(values)
+    return {
+        "p50": values[len(values) // 2],
+        "p99": values[int(len(values) * 0.99)],
+        "max": values[-1],
+    }
+
+
+def serve_consumer(store):
+    """Serve the consumer app for `store`; return its URL and the server."""
+    from werkzeug.serving import make_server
+
+    from consumer import server
+
+    config = configparser.ConfigParser()
+    config["SERVER"] = {"debug": "false"}
+    app, _, _ = server([store], config["SERVER"])
+    http = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{http.server_port}", http
+
+
+def new_latencies(store, seen):
+    """Latencies in seconds of the rows committed to store after id seen,
+    and the last id."""
+    from consumer import epoch_ms
+
+    now = epoch_ms(datetime.now())
+    rows = store.con.execute(
+        "SELECT id, ts_ms FROM measurements WHERE id > ? ORDER BY id", (seen,)
+    ).fetchall()
+    return [(now - ts_ms) / 1000 for _, ts_ms in rows], rows[-1][0] if rows else seen
+
+
+def end_to_end(host, datadir, hz, speed, seconds, poll_s):
+    """Replay in real time (times speed) while catchup polls; return the
+    replay's stats and the latency percentiles in seconds."""
+    from consumer import SQLiteStore
+
+    store = SQLiteStore(tempfile.mkdtemp(), "e2e.db", "measurements", host)
+    source = replay(
+        datadir, "--hz", str(hz), "--speed", str(speed), "--seconds", str(seconds)
+    )
+    latencies = []
+    seen = 0
+    while True:
+        running = source.poll() is None
+        store.catchup()
+        new, seen = new_latencies(store, seen)
+        latencies += new
+        if not running:
+            break
+        time.sleep(poll_s)
+    return finish(source), percentiles(latencies)
+
+
+def end_to_end_push(host, datadir, hz, speed, seconds, flush_s):
+    """Replay in real time (times speed) pushing to /ingest; return the
+    replay's stats, the latency percentiles in seconds and how many rows a
+    catchup afterwards still had to pull."""
+    from consumer import SQLiteStore
+
+    store = SQLiteStore(tempfile.mkdtemp(), "push.db", "measurements", host)
+    # Start where the sensor DB is now, as a consumer already in sync would
+    store.catchup()
+    (start_count,) = store.con.execute("SELECT count(*) FROM measurements").fetchone()
+    url, http = serve_consumer(store)
+    source = replay(
+        datadir,
+        *("--hz", str(hz), "--speed", str(speed), "--seconds", str(seconds)),
+        *("--ingest", f"{url}/ingest/0", "--flush-seconds", str(flush_s)),
+    )
+    latencies = []
+    seen = store.sync_after_id()
+    while source.poll() is None:
+        new, seen = new_latencies(store, seen)
+        latencies += new
+        time.sleep(0.02)
+    stats = finish(source)
+    new, seen = new_latencies(store, seen)
+    latencies += new
+    http.shutdown()
+    (pushed,) = store.con.execute("SELECT count(*) FROM measurements").fetchone()
+    store.catchup()
+    (total,) = store.con.execute("SELECT count(*) FROM measurements").fetchone()
+    stats["pulled_after_push"] = total - pushed
+    stats["pushed"] = pushed - start_count
+    return stats, percentiles(latencies)
+
+
+def stages(host, datadir, rows):
+    """Run each stage alone on `rows` rows; return {stage: rows per second}."""
+    import requests
+
+    import wire
+    from consumer import SQLiteStore
+
+    rates = {}
+    source = finish(
+        replay(datadir, "--hz", "80", "--seconds", str(rows / 80), "--speed", "0")
+    )
+    rates["sensor"] = source["rate"]
+
+    session = requests.Session()
+    start = time.perf_counter()
+    served = 0
+    after_id = 0
+    while after_id is not None:
+        response = session.get(
+            host,
+            params={"after_id": after_id, "limit": 10_000, "compress": "zlib"},
+            headers={"Accept": wire.MIMETYPE},
+        )
+        columns, after_id = wire.decode(response.content)
+        served += len(columns["id"])
+    rates["provider"] = served / (time.perf_counter() - start)
+
+    store = SQLiteStore(tempfile.mkdtemp(), "catchup.db", "measurements", host)
+    start = time.perf_counter()
+    store.catchup()
+    (caught_up,) = store.con.execute("SELECT count(*) FROM measurements").fetchone()
+    rates["catchup"] = caught_up / (time.perf_counter() - start)
+
+    ingest_store = SQLiteStore(tempfile.mkdtemp(), "ingest.db", "measurements", None)
+    url, http = serve_consumer(ingest_store)
+    data = store.con.execute(
+        "SELECT id, ts, raw, config_id FROM measurements ORDER BY id"
+    ).fetchall()
+    start = time.perf_counter()
+    for i in range(0, len(data), INGEST_BATCH):
+        response = session.post(
+            f"{url}/ingest/0",
+            json={
+                "batch_time": str(datetime.now()),
+                "data": data[i : i + INGEST_BATCH],
+            },
+        )
+        response.raise_for_status()
+    rates["ingest"] = len(data) / (time.perf_counter() - start)
+    http.shutdown()
+    return rates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hz", type=float, default=80)
+    parser.add_argument("--speed", type=float, default=10)
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--poll", type=float, default=1)
+    parser.add_argument("--flush", type=float, default=1)
+    parser.add_argument("--rows", type=int, default=200_000)
+    args = parser.parse_args()
+
+    from bench import serve_provider
+
+    datadir = tempfile.mkdtemp()
+    # The provider opens weights.db when imported; let the sensor create it
+    finish(replay(datadir, "--seconds", "0"))
+    host, http = serve_provider(datadir)
+
+    rate = args.hz * args.speed
+    print(f"End to end at {rate:,.0f} samples/s, catchup every {args.poll}s...")
+    source, latency = end_to_end(
+        host, datadir, args.hz, args.speed, args.seconds, args.poll
+    )
+    print(
+        f"  {source['samples']:,} samples, sensor lagged at most"
+        f" {source['max_lag_s'] * 1000:.1f}ms, {source['visits']} visits"
+    )
+    print(
+        f"  latency p50 {latency['p50']:.2f}s, p99 {latency['p99']:.2f}s,"
+        f" max {latency['max']:.2f}s"
+    )
+
+    print(f"End to end at {rate:,.0f} samples/s, pushed to /ingest...")
+    source, latency = end_to_end_push(
+        host, datadir, args.hz, args.speed, args.seconds, args.flush
+    )
+    print(
+        f"  {source['samples']:,} samples, {source['pushed']:,} pushed in"
+        f" {source['uploader']['requests']:,} requests,"
+        f" {source['pulled_after_push']:,} pulled by catchup afterwards"
+    )
+    print(
+        f"  latency p50 {latency['p50']:.2f}s, p99 {latency['p99']:.2f}s,"
+        f" max {latency['max']:.2f}s"
+    )
+
+    print(f"Stages alone on {args.rows:,} rows...")
+    for stage, rows_per_s in stages(host, datadir, args.rows).items():
+        print(f"  {stage:<10} {rows_per_s:12,.0f} samples/s")
+    http.shutdown()
@@ -0,0 +1,117 @@
+"""Run every component's benchmark suite and compare with a saved baseline.
+
+python benchmarks/run.py [--rows N] [--save] [--tolerance 0.2]
+
+Each of source/, provider/, consumer/ and camera/ has a bench.py whose
+`suite` mode times that component's hot paths on synthetic data of --rows
+measurements (10^5 by default, up to 10^8; the camera suite times frames
+and ignores it) and writes {metric: seconds} as JSON. The suites run in
+their own processes, from their own directories, since the components are
+separate apps with their own sibling imports.
+
+Results are compared with benchmarks/baselines/<rows>.json when it exists;
+metrics more than --tolerance slower are reported as regressions and make
+the run exit with status 1. --save replaces the baseline with this run.
+Baselines are only comparable on the machine that recorded them.
+
+benchmarks/test_bench_suites.py runs the same suites under pytest with
+-m bench, holding each metric to an absolute budget.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPONENTS = ["source", "provider", "consumer", "camera"]
+
+
+def run_suite(component, rows):
+    """Run one component's suite in its own process; return its results."""
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "results.json")
+        env = dict(os.environ, DATA_DIR=tmp)
+        suite = subprocess.run(
+            [sys.executable, "bench.py", "suite", str(rows), out],
+            cwd=os.path.join(ROOT, component),
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if suite.returncode != 0:
+            raise RuntimeError(f"{component} suite failed:\n{suite.stderr}")
+        with open(out) as f:
+            return json.load(f)
+
+
+def run_suites(rows):
+    results = {}
+    for component in COMPONENTS:
+        print(f"Running {component} suite on {rows:,} rows...")
+        try:
+            results.update(run_suite(component, rows))
+        except RuntimeError as e:
+            sys.exit(str(e))
+    return results
+
+
+def baseline(rows):
+    """The saved baseline for `rows` rows, or None."""
+    path = os.path.join(ROOT, "benchmarks", "baselines", f"{rows}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, results, tolerance):
+    """Print each metric against the baseline; return the regressed names."""
+    regressions = []
+    print(f"{'metric':<40} {'baseline':>14} {'current':>14} {'change':>8}")
+    for name in sorted(set(baseline) | set(results)):
+        if name not in results or name not in baseline:
+            side = "baseline" if name not in results else "current"
+            value = baseline.get(name, results.get(name))
+            print(f"{name:<40} {value * 1e6:12,.1f}us only in {side}")
+            continue
+        change = results[name] / baseline[name] - 1
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -tolerance:
+            flag = "  improved"
+        print(
+            f"{name:<40} {baseline[name] * 1e6:12,.1f}us {results[name] * 1e6:12,.1f}us"
+            f" {change:+7.1%}{flag}"
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--save", action="store_true")
+    args = parser.parse_args()
+
+    results = run_suites(args.rows)
+    path = os.path.join(ROOT, "benchmarks", "baselines", f"{args.rows}.json")
+    saved = baseline(args.rows)
+    regressions = []
+    if saved is not None:
+        regressions = compare(saved, results, args.tolerance)
+    else:
+        for name, seconds in sorted(results.items()):
+            print(f"{name:<40} {seconds * 1e6:12,.1f}us")
+    if args.save:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print(f"Saved baseline {path}")
+    if regressions:
+        print(f"{len(regressions)} regressions beyond {args.tolerance:.0%}")
+        sys.exit(1)
@@ -0,0 +1,63 @@
+"""Run each component's benchmark suite under pytest.
+
+python -m pytest -m bench benchmarks/test_bench_suites.py
+
+The tests are marked bench and skipped unless selected with -m bench, as
+timings depend on the machine. Every metric must stay within its budget below: a fixed allowance derived
+from what the component has to keep up with (an 80 Hz sensor, 30 fps
+video, a 1 s poll), plus a per-row allowance for metrics that scale with
+the data. Budgets leave room for a Raspberry Pi, so exceeding one is a real
+problem rather than noise. Comparing with a saved baseline is left to
+run.py.
+
+BENCH_ROWS sets the synthetic data size (10^4 by default).
+"""
+
+import os
+
+import pytest
+
+from run import COMPONENTS, run_suite
+
+ROWS = int(os.environ.get("BENCH_ROWS", 10_000))
+
+SAMPLE_S = 1 / 80
+FRAME_S = 1 / 30
+POLL_S = 1
+
+# metric: (seconds, seconds per row)
+BUDGETS = {
+    "source.rolling_3": (SAMPLE_S / 20, 0),
+    "source.rolling_100": (SAMPLE_S / 20, 0),
+    "source.rolling_5000": (SAMPLE_S / 20, 0),
+    "source.write_buffer": (SAMPLE_S / 20, 0),
+    "provider.get_data_head_100": (POLL_S / 10, 0),
+    "provider.get_data_page_10k_ndjson": (POLL_S, 0),
+    "provider.get_data_page_10k_columnar": (POLL_S / 2, 0),
+    "provider.clips_after": (POLL_S / 10, 0),
+    "provider.clips_manifest_100": (POLL_S / 10, 0),
+    "consumer.catchup": (POLL_S, 100e-6),
+    "consumer.writeall_1k_rows": (POLL_S / 5, 0),
+    "consumer.todf": (POLL_S / 2, 50e-6),
+    "consumer.filter_df": (POLL_S / 2, 10e-6),
+    "consumer.ingest_p50": (POLL_S / 4, 0),
+    "consumer.ingest_p99": (POLL_S, 0),
+    "camera.timestamp_put_text": (FRAME_S / 10, 0),
+    "camera.timestamp_overlay": (FRAME_S / 10, 0),
+}
+
+
+@pytest.mark.bench
+@pytest.mark.parametrize("component", COMPONENTS)
+def test_suite(component):
+    results = run_suite(component, ROWS)
+    assert results, f"{component} suite reported no metrics"
+
+    over = {}
+    for name, seconds in results.items():
+        assert name in BUDGETS, f"{name} has no budget"
+        fixed_s, per_row_s = BUDGETS[name]
+        budget = fixed_s + per_row_s * ROWS
+        if seconds > budget:
+            over[name] = f"{seconds * 1e6:,.1f}us > {budget * 1e6:,.1f}us"
+    assert not over, f"over budget: {over}"
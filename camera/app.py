@@ -1,21 +1,54 @@
+import os
+import sys
+import time
+
 from flask import Flask, request, jsonify
 from camera import Camera
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../common"))
+from metrics import DURATION_BUCKETS, REGISTRY, instrument
+
 app = Flask(__name__)
+instrument(app)
 
 cam = Camera()
 cam.start()
 cam.circular(10)
 
+CLIPS_RECORDED = REGISTRY.counter("pitl_clips_recorded_total", "Clips recorded")
+RECORDING_SECONDS = REGISTRY.histogram(
+    "pitl_recording_seconds", "Length of each recorded clip", buckets=DURATION_BUCKETS
+)
+REGISTRY.gauge(
+    "pitl_recording",
+    "1 while a clip is being recorded",
+    fn=lambda: int(bool(cam.cur_file)),
+)
+recording_started = None
+# Record in segments of this many seconds; 0 records one clip per visit
+SEGMENT_S = float(os.environ.get("SEGMENT_S", 0))
+
 
 @app.route("/start")
 def web_start():
-    return f'{cam.record()}<br/><a href="/stop">stop</a>'
+    global recording_started
+    try:
+        segment_s = float(request.args.get("segment_s", SEGMENT_S))
+    except ValueError:
+        return "Invalid segment_s: expected number", 400
+    recording_started = time.monotonic()
+    return f'{cam.record(segment_s or None)}<br/><a href="/stop">stop</a>'
 
 
 @app.route("/stop")
 def web_stop():
-    return f'{cam.stop()}<br /><a href="/start">start</a>'
+    global recording_started
+    result = cam.stop()
+    if recording_started is not None:
+        RECORDING_SECONDS.observe(time.monotonic() - recording_started)
+        CLIPS_RECORDED.inc()
+        recording_started = None
+    return f'{result}<br /><a href="/start">start</a>'
 
 
 @app.route("/gain/<gain>")
@@ -0,0 +1,89 @@
+"""Benchmarks for the camera's per-frame work, on plain NumPy frames so they
+run without a camera.
+
+python bench.py [frames]
+python bench.py suite ROWS OUT.json    (see benchmarks/run.py)
+"""
+
+import json
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from overlay import FORMAT, TimestampOverlay
+
+# The recording configuration's main stream, XBGR8888
+FRAME_SHAPE = (1296, 2304, 4)
+origin = (0, 100)
+colour = (0, 255, 0)
+
+
+def put_text(frame, clock):
+    """What Camera.apply_timestamp used to do for every frame."""
+    timestamp = time.strftime(FORMAT, time.localtime(clock()))
+    cv2.putText(frame, timestamp, origin, cv2.FONT_HERSHEY_SIMPLEX, 1, colour, 2)
+
+
+def frames_clock(fps, start=1_700_000_000):
+    """A clock advancing 1/fps per call, so a run crosses second boundaries
+    as often as it would at that frame rate."""
+    t = [start - 1 / fps]
+
+    def clock():
+        t[0] += 1 / fps
+        return t[0]
+
+    return clock
+
+
+def per_frame(draw, frames, fps):
+    frame = np.random.default_rng(0).integers(0, 256, FRAME_SHAPE, np.uint8)
+    clock = frames_clock(fps)
+    draw = draw(clock)
+    start = time.perf_counter()
+    for _ in range(frames):
+        draw(frame)
+    return (time.perf_counter() - start) / frames
+
+
+def check(seconds=20):
+    """The overlay draws exactly what putText draws."""
+    frame = np.random.default_rng(1).integers(0, 256, FRAME_SHAPE, np.uint8)
+    for second in range(1_700_000_000, 1_700_000_000 + seconds):
+        expected = frame.copy()
+        put_text(expected, lambda: second)
+        actual = frame.copy()
+        TimestampOverlay(origin, colour=colour, clock=lambda: second).draw(actual)
+        assert np.array_equal(actual, expected), f"overlay differs at {second}"
+
+
+def suite(frames=300, fps=30):
+    return {
+        "camera.timestamp_put_text": per_frame(
+            lambda clock: lambda frame: put_text(frame, clock), frames, fps
+        ),
+        "camera.timestamp_overlay": per_frame(
+            lambda clock: TimestampOverlay(origin, colour=colour, clock=clock).draw,
+            frames,
+            fps,
+        ),
+    }
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["suite"]:
+        with open(sys.argv[3], "w") as f:
+            json.dump(suite(), f, indent=1)
+        sys.exit()
+    check()
+    frames = int(sys.argv[1]) if sys.argv[1:] else 300
+    for fps in [3, 30]:
+        results = suite(frames, fps)
+        before = results["camera.timestamp_put_text"]
+        after = results["camera.timestamp_overlay"]
+        print(
+            f"timestamp at {fps:>2} fps: putText {before * 1e6:8.1f}us/frame,"
+            f" overlay {after * 1e6:8.1f}us/frame, {before / after:6.1f}x"
+        )
@@ -10,8 +10,14 @@ import subprocess
 import os
 import atexit
 
+from overlay import TimestampOverlay
+from segments import SegmentWriter
+
 fps = 3
 frame_length = int(1_000_000 / fps)
+# A keyframe, with headers, every 2s, so recordings can be cut into
+# segments that decode on their own
+iperiod = 2 * fps
 
 tmp_dir = "/home/casey/data/tmp/clips/"
 clip_dir = "/home/casey/data/clips/"
@@ -47,6 +53,7 @@ class Camera:
         self.cam = Picamera2()
         self.sensor_modes = self.cam.sensor_modes
         print(self.sensor_modes)
+        self.overlay = TimestampOverlay(origin, font, scale, colour, thickness)
 
     def start(self):
         print("Starting camera")
@@ -57,7 +64,7 @@ class Camera:
         )
 
         self.cam.configure(self.config)
-        self.encoder = H264Encoder()
+        self.encoder = H264Encoder(repeat=True, iperiod=iperiod)
         self.cam.pre_callback = self.apply_timestamp
         self.cam.start()
 
@@ -72,11 +79,9 @@ class Camera:
     def metadata(self):
         return self.cam.capture_metadata()
 
-    @staticmethod
-    def apply_timestamp(request):
-        timestamp = time.strftime("%Y-%m-%d %X")
+    def apply_timestamp(self, request):
         with MappedArray(request, "main") as m:
-            cv2.putText(m.array, timestamp, origin, font, scale, colour, thickness)
+            self.overlay.draw(m.array)
 
     def snapshot(self):
         filename = gen_filename("jpg")
@@ -119,18 +124,31 @@ class Camera:
         return outfile
 
     cur_file = None
+    segments = None
 
-    def record(
-        self,
-    ):
+    def record(self, segment_s=None):
+        """Start writing the circular buffer and everything after it to a
+        clip, or with segment_s to clip_dir/<name>/ in segments of about
+        segment_s that the provider serves as each completes."""
         outfile = gen_filename("h264")
         self.cur_file = outfile
-        self.encoder.output.fileoutput = outfile
+        if segment_s:
+            name = os.path.basename(outfile)[: -len(".h264")]
+            self.segments = SegmentWriter(name, clip_dir, tmp_dir, segment_s)
+            self.encoder.output.fileoutput = self.segments
+        else:
+            self.encoder.output.fileoutput = outfile
         self.encoder.output.start()
         return f"{strftime()} Capturing {outfile}"
 
     def stop(self):
         self.encoder.output.stop()
+        if self.segments is not None:
+            # Moves the last segment and marks the index complete
+            self.segments.close()
+            self.segments = None
+            self.cur_file = None
+            return f"{strftime()} Done outputting"
         h264 = mv(self.cur_file, clip_dir)
         # try:
         #     mp4path = self.convert_h264_mp4(h264, tmp_dir)
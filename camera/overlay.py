@@ -0,0 +1,116 @@
+"""Timestamp overlay for camera frames.
+
+cv2.putText rasterizes the text on every call, and the pre_callback runs for
+every frame. TimestampOverlay rasterizes it once per second into a small
+mask and keeps the coordinates of the pixels it covers; each frame then only
+has those pixels written, one whole pixel per element, and the rest of the
+buffer is never touched. Antialiased edge pixels, if the line type has any,
+are alpha blended. With the default line type the result is pixel for pixel
+what putText would have drawn.
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+FORMAT = "%Y-%m-%d %X"
+
+
+class TimestampOverlay:
+    def __init__(
+        self,
+        origin=(0, 100),
+        font=cv2.FONT_HERSHEY_SIMPLEX,
+        scale=1,
+        colour=(0, 255, 0),
+        thickness=2,
+        line_type=cv2.LINE_8,
+        format=FORMAT,
+        clock=time.time,
+    ):
+        self.origin = origin
+        self.font = font
+        self.scale = scale
+        self.colour = colour
+        self.thickness = thickness
+        self.line_type = line_type
+        self.format = format
+        self.clock = clock
+
+        # Size the region for the widest text the format can produce: the
+        # font is proportional, so try every digit in every position
+        sample = time.strftime(format, time.localtime(0))
+        width, height, baseline = 0, 0, 0
+        for digit in "0123456789":
+            text = "".join(digit if c.isdigit() else c for c in sample)
+            (w, h), b = cv2.getTextSize(text, font, scale, thickness)
+            width, height, baseline = max(width, w), max(height, h), max(baseline, b)
+        pad = thickness + 1
+        x, y = origin
+        self.top = y - height - pad
+        self.left = x - pad
+        self.bottom = y + baseline + pad
+        self.right = x + width + pad
+
+        self.key = None
+        self.text = None
+
+    def render(self, second, shape, dtype):
+        """Rasterize the text for `second` once, and keep the coordinates of
+        the pixels it covers in a frame of `shape`."""
+        self.text = time.strftime(self.format, time.localtime(second))
+        mask = np.zeros((self.bottom - self.top, self.right - self.left), np.uint8)
+        cv2.putText(
+            mask,
+            self.text,
+            (self.origin[0] - self.left, self.origin[1] - self.top),
+            self.font,
+            self.scale,
+            255,
+            self.thickness,
+            self.line_type,
+        )
+        rows, cols = np.nonzero(mask)
+        alpha = mask[rows, cols]
+        rows, cols = rows + self.top, cols + self.left
+        inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+        rows, cols, alpha = rows[inside], cols[inside], alpha[inside]
+
+        # Opaque pixels are overwritten; only antialiased edges need blending
+        opaque = alpha == 255
+        self.opaque = (rows[opaque], cols[opaque])
+        self.edge = (rows[~opaque], cols[~opaque])
+        self.edge_alpha = alpha[~opaque].astype(np.uint16)
+
+        channels = shape[2] if len(shape) == 3 else 1
+        # cv2 pads a short colour with zeros, e.g. for XBGR frames
+        colour = (tuple(self.colour) + (0,) * channels)[:channels]
+        self.colour_array = np.array(colour, dtype)
+        if len(shape) == 3:
+            self.edge_alpha = self.edge_alpha[:, None]
+            self.fill = self.colour_array.view(
+                np.dtype((np.void, channels * dtype.itemsize))
+            )[0]
+        else:
+            self.fill = self.colour_array[0]
+        self.key = (second, shape, dtype)
+
+    def draw(self, frame):
+        """Draw the current timestamp onto `frame` in place."""
+        key = (int(self.clock()), frame.shape, frame.dtype)
+        if key != self.key:
+            self.render(*key)
+        pixels = frame
+        if frame.ndim == 3:
+            # One element per pixel, so each write copies all its channels
+            pixels = frame.view(self.fill.dtype)[..., 0]
+        pixels[self.opaque] = self.fill
+        if len(self.edge_alpha):
+            alpha = self.edge_alpha
+            colour = self.colour_array.astype(np.uint16)
+            if frame.ndim == 2:
+                colour = colour[0]
+            blended = (frame[self.edge] * (255 - alpha) + colour * alpha + 127) // 255
+            frame[self.edge] = blended
+        return frame
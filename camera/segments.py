@@ -0,0 +1,222 @@
+"""Segmented recording of an H.264 stream.
+
+SegmentWriter is a file object for picamera2's CircularOutput (which writes
+one encoded frame per write() call to any io.BufferedIOBase). It cuts the
+stream at the first keyframe after each segment_s, so every segment decodes
+on its own as long as the encoder repeats its headers, and moves each
+completed segment from tmp_dir into clip_dir/<recording>/ at once. Next to
+the segments it keeps <recording>.index.json, rewritten atomically after
+every segment:
+
+    {"name": ..., "segment_s": ..., "complete": false,
+     "segments": [{"name": ..., "size": ..., "start_s": ..., "duration_s": ...}]}
+
+The provider lists segments in its clip manifest as soon as they land, so
+the consumer's catchup_clips pulls a visit while it is still being
+recorded.
+
+FakeEncoder stands in for the camera's encoder output, so this runs without
+a camera: python segments.py
+"""
+
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+INDEX_SUFFIX = ".index.json"
+
+NAL_SLICE = 1
+NAL_IDR = 5
+NAL_SPS = 7
+NAL_PPS = 8
+
+
+def is_keyframe(frame):
+    """Whether an Annex B access unit's first slice is an IDR slice. Only
+    the NAL units before that slice are read, so this stays cheap for large
+    frames."""
+    i = frame.find(b"\x00\x00\x01")
+    while 0 <= i < len(frame) - 3:
+        nal_type = frame[i + 3] & 0x1F
+        if nal_type in (NAL_SLICE, NAL_IDR):
+            return nal_type == NAL_IDR
+        i = frame.find(b"\x00\x00\x01", i + 3)
+    return False
+
+
+class SegmentWriter(io.BufferedIOBase):
+    def __init__(self, name, clip_dir, tmp_dir, segment_s=10, clock=time.monotonic):
+        super().__init__()
+        self.name = name
+        self.dir = os.path.join(clip_dir, name)
+        self.tmp_dir = tmp_dir
+        self.segment_s = segment_s
+        self.clock = clock
+        os.makedirs(self.dir, exist_ok=True)
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        self.segments = []
+        self.file = None
+        self.path = None
+        self.started = None
+        self.segment_started = None
+        self.write_index(complete=False)
+
+    def writable(self):
+        return True
+
+    def write(self, frame):
+        now = self.clock()
+        if self.file is None:
+            self.started = now
+            self.open_segment(now)
+        elif now - self.segment_started >= self.segment_s and is_keyframe(frame):
+            self.finish_segment(now)
+            self.open_segment(now)
+        self.file.write(frame)
+        return len(frame)
+
+    def open_segment(self, now):
+        name = f"{self.name}-{len(self.segments):05d}.h264"
+        self.path = os.path.join(self.tmp_dir, name)
+        self.file = open(self.path, "wb")
+        self.segment_started = now
+
+    def finish_segment(self, now):
+        self.file.close()
+        name = os.path.basename(self.path)
+        size = os.path.getsize(self.path)
+        os.replace(self.path, os.path.join(self.dir, name))
+        self.segments.append(
+            {
+                "name": name,
+                "size": size,
+                "start_s": round(self.segment_started - self.started, 3),
+                "duration_s": round(now - self.segment_started, 3),
+            }
+        )
+        self.file = None
+        self.path = None
+        self.write_index(complete=False)
+
+    def write_index(self, complete):
+        index = {
+            "name": self.name,
+            "segment_s": self.segment_s,
+            "complete": complete,
+            "segments": self.segments,
+        }
+        # Written beside the segment in progress, outside clip_dir, so the
+        # provider only ever sees a whole index
+        tmp = os.path.join(self.tmp_dir, f"{self.name}{INDEX_SUFFIX}")
+        with open(tmp, "w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp, os.path.join(self.dir, f"{self.name}{INDEX_SUFFIX}"))
+
+    def close(self):
+        if self.closed:
+            return
+        if self.file is not None:
+            self.finish_segment(self.clock())
+        self.write_index(complete=True)
+        super().close()
+
+
+class FakeEncoder:
+    """Stands in for the camera's H264Encoder and its CircularOutput.
+
+    Like the CircularOutput, it writes to `fileoutput` between start() and
+    stop(); encode() produces `frames` H.264-shaped access units at `fps`,
+    headers and an IDR slice every `iperiod` frames and P slices otherwise,
+    advancing its own clock by a frame interval each.
+    """
+
+    def __init__(self, fps=3, iperiod=6, frame_bytes=4096):
+        self.fps = fps
+        self.iperiod = iperiod
+        self.frame_bytes = frame_bytes
+        self.fileoutput = None
+        self.recording = False
+        self.frame = 0
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def start(self):
+        self.recording = True
+
+    def stop(self):
+        self.recording = False
+
+    def access_unit(self, keyframe):
+        def nal(nal_type, size):
+            return b"\x00\x00\x00\x01" + bytes([0x60 | nal_type]) + b"\xab" * size
+
+        if keyframe:
+            return nal(NAL_SPS, 10) + nal(NAL_PPS, 4) + nal(NAL_IDR, self.frame_bytes)
+        return nal(NAL_SLICE, self.frame_bytes // 8)
+
+    def encode(self, frames):
+        for _ in range(frames):
+            frame = self.access_unit(self.frame % self.iperiod == 0)
+            if self.recording and self.fileoutput is not None:
+                self.fileoutput.write(frame)
+            self.frame += 1
+            self.now = self.frame / self.fps
+
+
+def check(seconds=95, segment_s=10, fps=3, iperiod=6):
+    """Record through a FakeEncoder and check the segments and index."""
+    root = tempfile.mkdtemp()
+    clip_dir, tmp_dir = os.path.join(root, "clips"), os.path.join(root, "tmp")
+    encoder = FakeEncoder(fps, iperiod)
+    stream = io.BytesIO()
+    encoder.fileoutput = stream
+    encoder.start()
+    encoder.encode(seconds * fps)
+    encoder.stop()
+
+    encoder.frame, encoder.now = 0, 0.0
+    writer = SegmentWriter("visit", clip_dir, tmp_dir, segment_s, encoder.clock)
+    encoder.fileoutput = writer
+    encoder.start()
+    completed = []
+    for _ in range(seconds):
+        encoder.encode(fps)
+        # Completed segments are in clip_dir while recording goes on
+        with open(os.path.join(clip_dir, "visit", f"visit{INDEX_SUFFIX}")) as f:
+            completed.append(len(json.load(f)["segments"]))
+    encoder.stop()
+    writer.close()
+
+    with open(os.path.join(clip_dir, "visit", f"visit{INDEX_SUFFIX}")) as f:
+        index = json.load(f)
+    assert index["complete"]
+    segments = index["segments"]
+    assert completed[segment_s + iperiod // fps] >= 1, completed
+    # A segment runs on to the next keyframe after segment_s
+    assert all(s["duration_s"] <= segment_s + iperiod / fps + 0.01 for s in segments)
+    joined = b""
+    for s in segments:
+        with open(os.path.join(clip_dir, "visit", s["name"]), "rb") as f:
+            data = f.read()
+        assert len(data) == s["size"] and is_keyframe(data)
+        joined += data
+    assert joined == stream.getvalue(), "segments do not add up to the stream"
+    assert os.listdir(tmp_dir) == []
+    shutil.rmtree(root)
+    return segments
+
+
+if __name__ == "__main__":
+    segments = check()
+    print(f"{len(segments)} segments:")
+    for s in segments:
+        print(
+            f"  {s['name']} {s['size']:>8,} bytes"
+            f" at {s['start_s']:6.1f}s for {s['duration_s']:.1f}s"
+        )
@@ -0,0 +1,224 @@
+"""Minimal Prometheus-style metrics for the Flask apps.
+
+Counters, gauges and histograms keep their samples in memory, keyed by
+label values, and render() writes them in the Prometheus text exposition
+format. instrument(app) times every request by route and serves /metrics.
+Recording a sample takes one lock and a few dict lookups, so it is cheap
+enough for every request.
+
+Shared by the provider, consumer and camera apps, which add common/ to
+sys.path to import it.
+"""
+
+from bisect import bisect_left
+import threading
+import time
+
+# Seconds; spans an indexed lookup up to a slow page or commit
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+LATENCY_BUCKETS += (0.5, 1, 2.5, 5, 10)
+# Seconds; clip downloads and transcodes
+DURATION_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        with self.lock:
+            return [
+                (self.name, format_labels(self.labels, key), value)
+                for key, value in self.values.items()
+            ]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {value}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A gauge set directly, or read from `fn` at scrape time. fn returns a
+    number, or a dict of label value tuples to numbers."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def samples(self):
+        if self.fn is not None:
+            try:
+                values = self.fn()
+            except Exception as e:
+                print(f"WARNING: Failed to read gauge {self.name}: {e}")
+                return []
+            if not isinstance(values, dict):
+                values = {(): values}
+            with self.lock:
+                self.values = dict(values)
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # Per-bucket counts, then the sum of observed values
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        samples = []
+        for key, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = format_labels(self.labels, key, [("le", bound)])
+                samples.append((f"{self.name}_bucket", labels, cumulative))
+            labels = format_labels(self.labels, key)
+            samples.append((f"{self.name}_sum", labels, counts[-1]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Timer:
+    """Context manager observing the time spent in its block."""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self.register(Gauge(name, help, labels, fn))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "pitl_http_request_duration_seconds",
+    "Time to handle a request, by route",
+    ["route", "method", "status"],
+)
+
+
+def instrument(app, registry=REGISTRY):
+    """Time every request of a Flask app by route, and serve /metrics."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                route=request.url_rule.rule if request.url_rule else "unmatched",
+                method=request.method,
+                status=response.status_code,
+            )
+        return response
+
+    @app.route("/metrics")
+    def metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    return app
+
+
+def serve(port, host="127.0.0.1", registry=REGISTRY):
+    """Serve /metrics from a background thread, for processes without a
+    Flask app of their own."""
+    from flask import Flask
+    from werkzeug.serving import make_server
+
+    app = Flask(__name__)
+
+    @app.route("/metrics")
+    def metrics():
+        return registry.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+    http = make_server(host, port, app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    return http
@@ -0,0 +1,138 @@
+from collections import Counter, deque
+from heapq import heapify, heappop, heappush
+from math import fsum
+from statistics import StatisticsError
+
+
+class Rolling:
+    """Rolling window with O(log n) append/evict and O(1) median and mean.
+
+    The window is split between a max-heap of the lower half (stored negated)
+    and a min-heap of the upper half. Evicted values are only counted in
+    `delayed` and popped once they surface at the top of their heap. Those
+    that never surface are cleared by rebuilding both heaps from the window
+    once stale entries outnumber live ones, so memory stays O(window) and
+    append O(log window) amortized over a stream of any length.
+
+    The running total behind mean() is recomputed exactly every `window`
+    appends, so float rounding cannot build up over a long stream.
+
+    Shared by source/sampler.py and consumer/events.py from common/.
+    """
+
+    def __init__(self, window=1):
+        self.window = window
+        self.data = deque()
+        self.low = []
+        self.high = []
+        self.low_size = 0
+        self.high_size = 0
+        self.delayed = Counter()
+        self.total = 0
+        self.since_sum = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, datapoint):
+        if len(self.data) == self.window:
+            self.evict(self.data.popleft())
+        self.data.append(datapoint)
+        self.since_sum += 1
+        if self.since_sum >= self.window:
+            self.total = fsum(self.data)
+            self.since_sum = 0
+        else:
+            self.total += datapoint
+        if not self.low or datapoint <= -self.low[0]:
+            heappush(self.low, -datapoint)
+            self.low_size += 1
+        else:
+            heappush(self.high, datapoint)
+            self.high_size += 1
+        self.rebalance()
+        if len(self.low) + len(self.high) > 2 * len(self.data):
+            self.rebuild()
+
+    def rebuild(self):
+        """Rebuild both heaps from the window, dropping every stale entry."""
+        values = sorted(self.data)
+        self.low_size = (len(values) + 1) // 2
+        self.high_size = len(values) - self.low_size
+        self.low = [-v for v in values[: self.low_size]]
+        heapify(self.low)
+        # A sorted list is already a min-heap
+        self.high = values[self.low_size :]
+        self.delayed.clear()
+
+    def evict(self, datapoint):
+        self.total -= datapoint
+        self.delayed[datapoint] += 1
+        if datapoint <= -self.low[0]:
+            self.low_size -= 1
+            if datapoint == -self.low[0]:
+                self.prune(self.low, -1)
+        else:
+            self.high_size -= 1
+            if datapoint == self.high[0]:
+                self.prune(self.high, 1)
+        self.rebalance()
+
+    def prune(self, heap, sign):
+        while heap and self.delayed[sign * heap[0]]:
+            value = sign * heappop(heap)
+            self.delayed[value] -= 1
+            if not self.delayed[value]:
+                del self.delayed[value]
+
+    def rebalance(self):
+        if self.low_size > self.high_size + 1:
+            heappush(self.high, -heappop(self.low))
+            self.low_size -= 1
+            self.high_size += 1
+            self.prune(self.low, -1)
+        elif self.low_size < self.high_size:
+            heappush(self.low, -heappop(self.high))
+            self.low_size += 1
+            self.high_size -= 1
+            self.prune(self.high, 1)
+
+    def median(self):
+        if not self.data:
+            raise StatisticsError("no median for empty data")
+        if self.low_size > self.high_size:
+            return -self.low[0]
+        return (-self.low[0] + self.high[0]) / 2
+
+    def mean(self):
+        if not self.data:
+            raise StatisticsError("mean requires at least one data point")
+        return self.total / len(self.data)
+
+
+if __name__ == "__main__":
+    import random
+    import time
+    from statistics import median
+
+    # Correctness is covered by test_rolling.py; this compares speed.
+    values = [random.gauss(0, 1) for _ in range(200_000)]
+    for window in [3, 100, 5000]:
+        start = time.perf_counter()
+        rolling = Rolling(window)
+        for value in values:
+            rolling.append(value)
+            rolling.median()
+        heaps = time.perf_counter() - start
+
+        sample = values[:20_000]
+        start = time.perf_counter()
+        window_data = deque(maxlen=window)
+        for value in sample:
+            window_data.append(value)
+            median(window_data)
+        sort = (time.perf_counter() - start) * len(values) / len(sample)
+        print(
+            f"window {window:>5}: heaps {len(values) / heaps:10,.0f}/s,"
+            f" statistics.median {len(values) / sort:10,.0f}/s"
+        )
@@ -0,0 +1,68 @@
+import random
+from statistics import StatisticsError, mean, median
+
+import pytest
+
+from rolling import Rolling
+
+WINDOWS = [1, 2, 3, 4, 5, 100, 1000]
+
+
+def streams():
+    rng = random.Random(0)
+    return {
+        "gauss": [rng.gauss(0, 1) for _ in range(2_000)],
+        "duplicates": [rng.randint(0, 5) for _ in range(2_000)],
+        "hx711": [rng.randint(-(2**23), 2**23 - 1) for _ in range(2_000)],
+    }
+
+
+@pytest.mark.parametrize("name", ["gauss", "duplicates", "hx711"])
+@pytest.mark.parametrize("window", WINDOWS)
+def test_matches_statistics(window, name):
+    # Including windows that are not yet full
+    values = streams()[name]
+    rolling = Rolling(window)
+    for i, value in enumerate(values):
+        rolling.append(value)
+        expected = values[max(0, i - window + 1) : i + 1]
+        assert len(rolling) == len(expected)
+        assert rolling.median() == median(expected), i
+        assert rolling.mean() == pytest.approx(mean(expected), rel=1e-9, abs=1e-9), i
+
+
+@pytest.mark.parametrize("window", WINDOWS)
+def test_mean_does_not_drift(window):
+    # A huge value absorbs the small ones added while it is in the window;
+    # subtracting it once it leaves would strand that rounding error
+    rolling = Rolling(window)
+    rolling.append(1e16)
+    for _ in range(2 * window + 1):
+        rolling.append(1.0)
+    assert rolling.mean() == 1.0
+
+
+def test_empty():
+    rolling = Rolling(3)
+    with pytest.raises(StatisticsError):
+        rolling.median()
+    with pytest.raises(StatisticsError):
+        rolling.mean()
+
+
+@pytest.mark.parametrize(
+    "window,values",
+    [
+        (100, [random.Random(1).gauss(0, 1) for _ in range(200_000)]),
+        (3, list(range(200_000))),
+        (3, list(range(200_000, 0, -1))),
+    ],
+)
+def test_memory_is_bounded_by_window(window, values):
+    # Evicted values deep in a heap never surface on their own
+    rolling = Rolling(window)
+    for value in values:
+        rolling.append(value)
+        assert len(rolling.low) + len(rolling.high) <= 2 * window + 1
+        assert len(rolling.delayed) <= window
+    assert rolling.median() == median(values[-window:])
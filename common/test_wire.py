@@ -0,0 +1,25 @@
+from datetime import datetime
+
+import wire
+
+ROWS = [
+    (1, datetime(2024, 1, 1, 0, 0, 0), 8_388_607, 1),
+    (2, datetime(2024, 1, 1, 0, 0, 0, 12_500), -8_388_608, 1),
+    (5, datetime(2024, 1, 1, 0, 0, 1, 25_000), None, None),
+]
+
+
+def test_round_trip():
+    for compress in [False, True]:
+        columns, next = wire.decode(wire.encode(ROWS, next=5, compress=compress))
+        assert next == 5
+        assert list(wire.rows(columns)) == [(id, str(ts), r, c) for id, ts, r, c in ROWS]
+
+
+def test_empty_page():
+    # The last page of a catchup whose row count is a multiple of the page
+    # size comes back empty
+    columns, next = wire.decode(wire.encode([], compress=True))
+    assert next is None
+    assert wire.timestamps(columns["ts_us"]).tolist() == []
+    assert list(wire.rows(columns)) == []
@@ -0,0 +1,111 @@
+"""Columnar binary encoding for measurement rows.
+
+A payload is a fixed header followed by a body of packed little-endian
+columns, optionally zlib-compressed as a whole:
+
+    header  magic b"PITL", version u8, flags u8, rows u32, next i64
+    body    id deltas i64[rows], ts deltas i64[rows] (microseconds),
+            raw i32[rows], config_id i32[rows]
+
+Deltas start from zero, so a cumulative sum restores the column. Missing
+raw/config_id values are sent as NULL_INT32. next is the keyset cursor for
+the following page, or -1 once caught up.
+
+The provider encodes and the consumer decodes with this one module, which
+both import from common/.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+MIMETYPE = "application/x-pitl-columnar"
+MAGIC = b"PITL"
+VERSION = 1
+FLAG_ZLIB = 1
+HEADER = struct.Struct("<4sBBIq")
+NULL_INT32 = np.iinfo(np.int32).min
+
+
+def column(values, dtype):
+    return np.array([NULL_INT32 if v is None else v for v in values], dtype=dtype)
+
+
+def encode(rows, next=None, compress=False):
+    """Encode (id, ts, raw, config_id) rows into a columnar payload."""
+    if len(rows):
+        ids, ts, raw, config_id = zip(*rows)
+    else:
+        ids, ts, raw, config_id = (), (), (), ()
+    ids = np.array(ids, dtype=np.int64)
+    ts = np.array(ts, dtype="datetime64[us]").astype(np.int64)
+    body = b"".join(
+        [
+            np.diff(ids, prepend=0).astype("<i8").tobytes(),
+            np.diff(ts, prepend=0).astype("<i8").tobytes(),
+            column(raw, "<i4").tobytes(),
+            column(config_id, "<i4").tobytes(),
+        ]
+    )
+    flags = 0
+    if compress:
+        body = zlib.compress(body)
+        flags |= FLAG_ZLIB
+    next = -1 if next is None else next
+    return HEADER.pack(MAGIC, VERSION, flags, len(rows), next) + body
+
+
+def decode(payload):
+    """Decode a payload into (columns, next) where columns maps id, ts_us,
+    raw and config_id to NumPy arrays and next is the page cursor or None."""
+    magic, version, flags, rows, next = HEADER.unpack_from(payload)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"wire: Unsupported payload {magic} v{version}")
+    body = memoryview(payload)[HEADER.size :]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+
+    offset = 0
+    columns = {}
+    for name, dtype in [
+        ("id", "<i8"),
+        ("ts_us", "<i8"),
+        ("raw", "<i4"),
+        ("config_id", "<i4"),
+    ]:
+        columns[name] = np.frombuffer(body, dtype=dtype, count=rows, offset=offset)
+        offset += rows * np.dtype(dtype).itemsize
+    columns["id"] = np.cumsum(columns["id"])
+    columns["ts_us"] = np.cumsum(columns["ts_us"])
+    return columns, None if next == -1 else next
+
+
+def timestamps(ts_us):
+    """Format microsecond timestamps the way str(datetime) does."""
+    if not len(ts_us):
+        return np.array([], dtype=str)
+    ts = ts_us.astype("datetime64[us]")
+    text = np.where(
+        ts_us % 1_000_000 == 0,
+        np.datetime_as_string(ts, unit="s"),
+        np.datetime_as_string(ts, unit="us"),
+    )
+    return np.char.replace(text, "T", " ")
+
+
+def nullable(values):
+    return [None if v == NULL_INT32 else v for v in values.tolist()]
+
+
+def rows(columns):
+    """Iterate decoded columns as (id, ts, raw, config_id) parameters for
+    executemany, converting each column to Python values once."""
+    raw = columns["raw"]
+    config_id = columns["config_id"]
+    return zip(
+        columns["id"].tolist(),
+        timestamps(columns["ts_us"]).tolist(),
+        nullable(raw) if (raw == NULL_INT32).any() else raw.tolist(),
+        nullable(config_id) if (config_id == NULL_INT32).any() else config_id.tolist(),
+    )
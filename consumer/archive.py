@@ -0,0 +1,166 @@
+"""Columnar archive of measurement partitions.
+
+Each partition is a directory of .npy files, one per column, sorted by
+ts_ms then id:
+
+    id i8, ts_us i8, ts_ms i8, raw i8, config_id i8, upload_id i8
+
+Missing raw/config_id/upload_id values are stored as NULL_INT64. index.json
+lists every partition with its ts_ms range, row count and largest id, so
+reads only open the partitions overlapping the range asked for. Columns are
+opened memory-mapped and sliced by binary search on ts_ms, so a read only
+pages in the rows it returns. The index is reloaded whenever another
+process has replaced it, so a server sees the days poll.py archives.
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["id", "ts_us", "ts_ms", "raw", "config_id", "upload_id"]
+NULL_INT64 = np.iinfo(np.int64).min
+
+
+def column(values):
+    return np.array([NULL_INT64 if v is None else v for v in values], dtype="<i8")
+
+
+class Archive:
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        self.index_version = None
+        self.partitions = []
+        self.refresh()
+
+    def version(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def refresh(self):
+        """Reload index.json if it was replaced since it was last read."""
+        version = self.version()
+        if version == self.index_version:
+            return
+        self.index_version = version
+        try:
+            with open(self.index_path) as f:
+                self.partitions = json.load(f)
+        except FileNotFoundError:
+            self.partitions = []
+
+    def save_index(self):
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.partitions, f, indent=1)
+        os.replace(tmp, self.index_path)
+        self.index_version = self.version()
+
+    def max_id(self):
+        self.refresh()
+        return max((p["max_id"] for p in self.partitions), default=None)
+
+    def horizon(self):
+        """The end of the newest archived day, or None before any is."""
+        self.refresh()
+        return max((p["end_ms"] for p in self.partitions), default=None)
+
+    def open(self, name):
+        path = os.path.join(self.root, name)
+        return {
+            c: np.load(os.path.join(path, f"{c}.npy"), mmap_mode="r") for c in COLUMNS
+        }
+
+    def write(self, name, start_ms, end_ms, rows):
+        """Add (id, ts, raw, config_id, upload_id, ts_ms) rows to the partition
+        covering [start_ms, end_ms), merging with what it already holds.
+
+        The partition is written to a new directory and swapped in, so a
+        reader or a crash never sees it half written. Rows already archived
+        under the same id are kept once.
+        """
+        ids, ts, raw, config_id, upload_id, ts_ms = zip(*rows)
+        columns = {
+            "id": np.array(ids, dtype="<i8"),
+            "ts_us": np.array(ts, dtype="datetime64[us]").astype("<i8"),
+            "ts_ms": np.array(ts_ms, dtype="<i8"),
+            "raw": column(raw),
+            "config_id": column(config_id),
+            "upload_id": column(upload_id),
+        }
+        self.refresh()
+        existing = [p for p in self.partitions if p["name"] == name]
+        if existing:
+            old = self.open(name)
+            columns = {c: np.concatenate([old[c], columns[c]]) for c in COLUMNS}
+            _, first = np.unique(columns["id"], return_index=True)
+            columns = {c: columns[c][first] for c in COLUMNS}
+        order = np.lexsort((columns["id"], columns["ts_ms"]))
+        columns = {c: columns[c][order] for c in COLUMNS}
+
+        path = os.path.join(self.root, name)
+        tmp = f"{path}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for c in COLUMNS:
+            np.save(os.path.join(tmp, f"{c}.npy"), columns[c])
+        if existing:
+            old = f"{path}.old"
+            os.replace(path, old)
+            os.replace(tmp, path)
+            shutil.rmtree(old)
+        else:
+            os.replace(tmp, path)
+
+        self.partitions = [p for p in self.partitions if p["name"] != name]
+        self.partitions.append(
+            {
+                "name": name,
+                "start_ms": start_ms,
+                "end_ms": end_ms,
+                "rows": len(columns["id"]),
+                "max_id": int(columns["id"].max()),
+            }
+        )
+        self.partitions.sort(key=lambda p: p["start_ms"])
+        self.save_index()
+
+    def read(self, start_ms=None, end_ms=None):
+        """Return archived rows with start_ms <= ts_ms <= end_ms as a
+        DataFrame shaped like SELECT * FROM measurements, except that ts is
+        datetime64 rather than text, or None when there are none."""
+        self.refresh()
+        frames = []
+        for p in self.partitions:
+            if start_ms is not None and p["end_ms"] <= start_ms:
+                continue
+            if end_ms is not None and p["start_ms"] > end_ms:
+                continue
+            columns = self.open(p["name"])
+            ts_ms = columns["ts_ms"]
+            i = 0 if start_ms is None else np.searchsorted(ts_ms, start_ms, "left")
+            j = (
+                len(ts_ms)
+                if end_ms is None
+                else np.searchsorted(ts_ms, end_ms, "right")
+            )
+            if i < j:
+                frames.append({c: np.asarray(columns[c][i:j]) for c in COLUMNS})
+        if not frames:
+            return None
+        columns = {c: np.concatenate([f[c] for f in frames]) for c in COLUMNS}
+        df = pd.DataFrame(
+            {"id": columns["id"], "ts": columns["ts_us"].astype("datetime64[us]")}
+        )
+        for c in ["raw", "config_id", "upload_id"]:
+            values = columns[c]
+            null = values == NULL_INT64
+            df[c] = np.where(null, np.nan, values) if null.any() else values
+        df["ts_ms"] = columns["ts_ms"]
+        return df
@@ -0,0 +1,336 @@
+"""Benchmarks for consumer hot paths on synthetic data.
+
+python bench.py [rows ...]
+python bench.py suite ROWS OUT.json    (see benchmarks/run.py)
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../common"))
+import wire
+from consumer import SQLiteStore, TS_MS_SQL
+
+
+def generate(path, rows, start=datetime(2024, 1, 1), hz=10, chunk=1_000_000):
+    """Write a measurements DB of `rows` samples at `hz` with two configs."""
+    store = SQLiteStore(
+        os.path.dirname(path), os.path.basename(path), "measurements", None
+    )
+    store.con.executemany(
+        "INSERT INTO configs (id, g_factor, raw_offset) VALUES (?, ?, ?)",
+        [(1, -10.97, -35800), (2, -11.02, -35650)],
+    )
+    rng = np.random.default_rng(0)
+    start_us = int((start - datetime(1970, 1, 1)).total_seconds() * 1_000_000)
+    for first in range(0, rows, chunk):
+        n = min(chunk, rows - first)
+        ids = np.arange(first + 1, first + n + 1)
+        ts_us = start_us + ids * (1_000_000 // hz)
+        raw = rng.normal(-35800, 200, n).astype(np.int64)
+        config_id = np.where(ids < rows // 2, 1, 2)
+        store.con.executemany(
+            f"INSERT INTO measurements (id, ts, raw, config_id, ts_ms) VALUES (?1, ?2, ?3, ?4, {TS_MS_SQL.format('?2')})",
+            zip(
+                ids.tolist(),
+                wire.timestamps(ts_us).tolist(),
+                raw.tolist(),
+                config_id.tolist(),
+            ),
+        )
+        store.con.commit()
+    store.rebuild_rollups()
+    return store
+
+
+def derive_rowwise(store, df):
+    """The per-element derivation todf used before vectorization."""
+    df["g"] = df["raw"].map(lambda y: int((y - store.offset) / store.scale_factor))
+    df["kg"] = df["g"].map(lambda y: y / 1000)
+    df["lb"] = df["g"].map(lambda y: y / 453.592)
+    df["x"] = df["ts"].map(lambda x: datetime.fromisoformat(x))
+    return df
+
+
+def derive_vectorized(store, df):
+    store.calibrate(df)
+    df["x"] = df["ts"].to_numpy().astype("datetime64[ns]")
+    return df
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def bench_todf(rows):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    store = generate(path, rows)
+    df = pd.read_sql_query("SELECT * FROM measurements", store.con)
+    rowwise = timed(derive_rowwise, store, df.copy())
+    vectorized = timed(derive_vectorized, store, df.copy())
+    print(
+        f"todf derivation {rows:>12,} rows: row-wise {rowwise:8.2f}s,"
+        f" vectorized {vectorized:8.2f}s, {rowwise / vectorized:6.1f}x"
+    )
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def bench_ingest(clients=16, batches=50, rows=20, compare=True):
+    """Fire `clients` concurrent uploaders at /ingest, each posting `batches`
+    batches of `rows` rows, and compare with every request calling
+    writeall() on its own. Returns the /ingest latency percentiles."""
+    import configparser
+    import threading
+
+    import requests
+    from flask import Flask, request
+    from werkzeug.serving import make_server
+
+    from consumer import server
+
+    def payloads(client):
+        start = datetime(2024, 1, 1)
+        for batch in range(batches):
+            first = (client * batches + batch) * rows + 1
+            yield {
+                "batch_time": str(start),
+                "data": [
+                    [i, str(start + timedelta(seconds=i / 10)), -35800 + i % 100, 1]
+                    for i in range(first, first + rows)
+                ],
+            }
+
+    def run(post):
+        latencies = []
+
+        def client(i):
+            for payload in payloads(i):
+                start = time.perf_counter()
+                post(payload)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, percentiles(latencies)
+
+    def serve(app):
+        http = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=http.serve_forever, daemon=True).start()
+        session = threading.local()
+
+        def post(payload):
+            if not hasattr(session, "requests"):
+                session.requests = requests.Session()
+            response = session.requests.post(
+                f"http://127.0.0.1:{http.server_port}/ingest/0", json=payload
+            )
+            response.raise_for_status()
+
+        return http, post
+
+    # Baseline: the route as it was, each request committing on its own
+    store = SQLiteStore(tempfile.mkdtemp(), "bench.db", "measurements", None)
+    baseline = Flask(__name__)
+
+    @baseline.route("/ingest/<index>", methods=["post"])
+    def ingest(index):
+        payload = request.get_json()
+        store.writeall(
+            payload["data"], client_ts=payload["batch_time"], server_ts=datetime.now()
+        )
+        return f"Wrote {len(payload['data'])} rows"
+
+    if compare:
+        http, post = serve(baseline)
+        elapsed, (p50, p99) = run(post)
+        http.shutdown()
+        print(
+            f"ingest {clients} clients, writeall per request: {clients * batches / elapsed:8,.0f} batches/s,"
+            f" p50 {p50 * 1000:7.2f}ms, p99 {p99 * 1000:7.2f}ms"
+        )
+
+    store = SQLiteStore(tempfile.mkdtemp(), "bench.db", "measurements", None)
+    config = configparser.ConfigParser()
+    config["SERVER"] = {"debug": "false"}
+    app, _, _ = server([store], config["SERVER"])
+    http, post = serve(app)
+    elapsed, (p50, p99) = run(post)
+    http.shutdown()
+    (count,) = store.con.execute("SELECT count(*) FROM measurements").fetchone()
+    assert count == clients * batches * rows
+    print(
+        f"ingest {clients} clients, /ingest single writer: {clients * batches / elapsed:8,.0f} batches/s,"
+        f" p50 {p50 * 1000:7.2f}ms, p99 {p99 * 1000:7.2f}ms"
+    )
+    return {"p50": p50, "p99": p99}
+
+
+def bench_broadcast(client_counts=(1, 10, 50, 200), rounds=200, rows=20, stores=2):
+    """CPU time to push `rounds` ingests of `rows` rows per store to clients
+    split evenly across the stores, emitting every batch to everyone as
+    server() used to, against per-store rooms flushed every 4 rounds. Test
+    clients decode what they receive in-process, so this includes their
+    share of the work too."""
+    import configparser
+
+    from consumer import server
+
+    config = configparser.ConfigParser()
+    config["SERVER"] = {"debug": "false", "broadcast_window_s": "3600"}
+    app, socketio, _ = server(
+        [
+            SQLiteStore(tempfile.mkdtemp(), "bench.db", "measurements", None)
+            for _ in range(stores)
+        ],
+        config["SERVER"],
+    )
+    broadcaster = app.broadcaster
+    batch = [
+        [i, str(datetime(2024, 1, 1) + timedelta(seconds=i / 10)), -35800 + i, 1]
+        for i in range(rows)
+    ]
+    for count in client_counts:
+        clients = [socketio.test_client(app) for _ in range(count)]
+        for i, client in enumerate(clients):
+            client.emit("subscribe", {"store": i % stores})
+            client.get_received()
+
+        start = time.process_time()
+        for _ in range(rounds):
+            for store in range(stores):
+                socketio.emit("batch", {"data": batch})
+        every_batch = time.process_time() - start
+        received = sum(len(client.get_received()) for client in clients)
+
+        start = time.process_time()
+        for round in range(rounds):
+            for store in range(stores):
+                broadcaster.publish(store, batch)
+            if round % 4 == 3:
+                broadcaster.flush()
+        broadcaster.flush()
+        rooms = time.process_time() - start
+        received_rooms = sum(len(client.get_received()) for client in clients)
+
+        print(
+            f"broadcast {count:4} clients: every batch to all {every_batch * 1000:8.1f}ms"
+            f" ({received} messages), coalesced rooms {rooms * 1000:8.1f}ms"
+            f" ({received_rooms} messages)"
+        )
+        for client in clients:
+            client.disconnect()
+    broadcaster.stop()
+
+
+def serve_provider(datadir, latency_s=0):
+    """Serve provider/provider.py over HTTP from `datadir`, answering each
+    request latency_s late to stand in for the network; return its URL and
+    the server to shut down."""
+    import threading
+
+    from werkzeug.serving import make_server
+
+    os.environ["DATA_DIR"] = datadir
+    sys.path.append(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "../provider")
+    )
+    import provider
+
+    def app(environ, start_response):
+        time.sleep(latency_s)
+        return provider.app(environ, start_response)
+
+    http = make_server(
+        "127.0.0.1", 0, app if latency_s else provider.app, threaded=True
+    )
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{http.server_port}/", http
+
+
+def bench_backfill(rows=1_000_000, latency_s=0.05, workers=4):
+    """Catch up an empty store on `rows` rows one page at a time, then with
+    `workers` concurrent backfill chunks, against a provider with latency_s
+    of simulated network latency."""
+    datadir = tempfile.mkdtemp()
+    generate(os.path.join(datadir, "weights.db"), rows)
+    host, http = serve_provider(datadir, latency_s)
+    times = {}
+    for name, kwargs in [
+        ("sequential", {"chunk_rows": rows}),
+        (f"{workers} workers", {"workers": workers, "chunk_rows": rows // 10}),
+    ]:
+        store = SQLiteStore(tempfile.mkdtemp(), "bench.db", "measurements", host)
+        times[name] = timed(lambda: store.catchup(**kwargs))
+    http.shutdown()
+    sequential, parallel = times.values()
+    print(
+        f"catchup {rows:>12,} rows, {latency_s * 1000:.0f}ms latency:"
+        f" sequential {sequential:8.2f}s, {workers} workers {parallel:8.2f}s,"
+        f" {sequential / parallel:6.1f}x"
+    )
+
+
+def suite(rows):
+    """Time the consumer's hot paths on a synthetic DB of `rows` rows and
+    return {metric: seconds}, lower being better."""
+    results = {}
+    # The provider's DB doubles as the source for catchup
+    datadir = tempfile.mkdtemp()
+    source = generate(os.path.join(datadir, "weights.db"), rows)
+    host, http = serve_provider(datadir)
+    store = SQLiteStore(tempfile.mkdtemp(), "bench.db", "measurements", host)
+    results["consumer.catchup"] = timed(store.catchup)
+    http.shutdown()
+
+    batch = source.con.execute(
+        "SELECT id, ts, raw, config_id FROM measurements ORDER BY id LIMIT 1000"
+    ).fetchall()
+    store = SQLiteStore(tempfile.mkdtemp(), "bench.db", "measurements", None)
+    writes = []
+    for i in range(20):
+        data = [
+            [id + i * len(batch), ts, raw, config_id]
+            for id, ts, raw, config_id in batch
+        ]
+        writes.append(timed(store.writeall, data, None, None))
+    results["consumer.writeall_1k_rows"] = sorted(writes)[len(writes) // 2]
+
+    df = source.todf(filter=False)
+    results["consumer.todf"] = min(timed(source.todf) for _ in range(3))
+    results["consumer.filter_df"] = min(timed(source.filter_df, df) for _ in range(3))
+
+    latencies = bench_ingest(compare=False)
+    results["consumer.ingest_p50"] = latencies["p50"]
+    results["consumer.ingest_p99"] = latencies["p99"]
+    return results
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["suite"]:
+        import json
+
+        with open(sys.argv[3], "w") as f:
+            json.dump(suite(int(sys.argv[2])), f, indent=1)
+        sys.exit()
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1_000_000, 10_000_000]
+    for rows in sizes:
+        bench_todf(rows)
+    bench_ingest()
+    bench_broadcast()
+    bench_backfill()
@@ -0,0 +1,144 @@
+from collections import defaultdict
+import math
+import threading
+import time
+
+
+class Broadcaster:
+    """Coalesces ingested rows and emits them to per-store Socket.IO rooms.
+
+    Clients send "subscribe" with a store index and optionally `every` (keep
+    every nth row) and `max_rate` (rows per second), and join the room for
+    that combination. Rows published in the meantime are flushed every
+    window_s: for each room the store's rows are decimated once and emitted
+    as a single "batch", which Socket.IO encodes once for all the room's
+    clients. Stores nobody subscribed to are never serialized.
+    """
+
+    def __init__(self, socketio, window_s=0.25):
+        self.socketio = socketio
+        self.window_s = window_s
+        self.pending = defaultdict(list)
+        self.lock = threading.Lock()
+        # room -> (store, every, max_rate), plus its members and the
+        # decimation state carried from one window to the next
+        self.rooms = {}
+        self.members = defaultdict(set)
+        self.phase = defaultdict(int)
+        self.credit = defaultdict(float)
+        self.sids = defaultdict(set)
+        self.stopped = False
+
+        self.published = 0
+        self.emitted = 0
+        self.emits = 0
+
+    def start(self):
+        self.socketio.start_background_task(self.run)
+        return self
+
+    def stop(self):
+        self.stopped = True
+
+    @staticmethod
+    def room(store, every=1, max_rate=None):
+        return f"store {store} every {every} max_rate {max_rate}"
+
+    def subscribe(self, sid, store, every=1, max_rate=None):
+        if every < 1 or not (
+            max_rate is None or (math.isfinite(max_rate) and max_rate > 0)
+        ):
+            raise ValueError("Expected every >= 1 and a finite max_rate > 0")
+        room = self.room(store, every, max_rate)
+        self.socketio.server.enter_room(sid, room, namespace="/")
+        with self.lock:
+            self.rooms[room] = (store, every, max_rate)
+            self.members[room].add(sid)
+            self.sids[sid].add(room)
+        return room
+
+    def unsubscribe(self, sid, store=None):
+        """Leave every room of `store`, or every room when store is None."""
+        with self.lock:
+            rooms = [
+                room
+                for room in self.sids[sid]
+                if store is None or self.rooms[room][0] == store
+            ]
+            for room in rooms:
+                self.sids[sid].discard(room)
+                self.members[room].discard(sid)
+                if not self.members[room]:
+                    for state in (self.rooms, self.members, self.phase, self.credit):
+                        state.pop(room, None)
+            if not self.sids[sid]:
+                del self.sids[sid]
+        for room in rooms:
+            self.socketio.server.leave_room(sid, room, namespace="/")
+
+    def publish(self, store, rows):
+        with self.lock:
+            if any(room[0] == store for room in self.rooms.values()):
+                self.pending[store].extend(rows)
+                self.published += len(rows)
+
+    def decimate(self, room, rows, elapsed_s):
+        _, every, max_rate = self.rooms[room]
+        if every > 1:
+            start = -self.phase[room] % every
+            self.phase[room] = (self.phase[room] + len(rows)) % every
+            rows = rows[start::every]
+        if max_rate is not None:
+            # Token bucket: a window's allowance is spread evenly over its
+            # rows, and at most one window's worth is saved up
+            allowance = max_rate * max(elapsed_s, self.window_s)
+            credit = min(self.credit[room] + max_rate * elapsed_s, allowance)
+            n = min(len(rows), int(credit))
+            self.credit[room] = credit - n
+            rows = [rows[i * len(rows) // n] for i in range(n)] if n else []
+        return rows
+
+    def flush(self, elapsed_s=None):
+        elapsed_s = self.window_s if elapsed_s is None else elapsed_s
+        with self.lock:
+            pending, self.pending = (self.pending, defaultdict(list))
+            batches = []
+            for room, (store, _, _) in self.rooms.items():
+                if pending.get(store):
+                    try:
+                        rows = self.decimate(room, pending[store], elapsed_s)
+                    except Exception as e:
+                        print(f"WARNING: Failed to decimate rows for {room}: {e}")
+                        continue
+                    if rows:
+                        batches.append((room, store, rows))
+        # One room failing must not hold back the others
+        for room, store, rows in batches:
+            try:
+                self.socketio.emit("batch", {"store": store, "data": rows}, to=room)
+            except Exception as e:
+                print(f"WARNING: Failed to emit batch to {room}: {e}")
+                continue
+            self.emitted += len(rows)
+            self.emits += 1
+
+    def run(self):
+        last = time.monotonic()
+        while not self.stopped:
+            self.socketio.sleep(self.window_s)
+            now = time.monotonic()
+            try:
+                self.flush(now - last)
+            except Exception as e:
+                print(f"WARNING: Broadcast flush failed: {e}")
+            last = now
+
+    def stats(self):
+        with self.lock:
+            return {
+                "rooms": len(self.rooms),
+                "clients": len(self.sids),
+                "published": self.published,
+                "emitted": self.emitted,
+                "emits": self.emits,
+            }
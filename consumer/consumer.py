@@ -5,14 +5,80 @@ from typing import Any
 import urllib.parse
 import re
 import math
+import json
+import gzip
+import itertools
 import configparser
+import sys
+import time
 
 import requests
+from archive import Archive
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../common"))
+import wire
+from metrics import DURATION_BUCKETS, REGISTRY
 import matplotlib
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from scipy import stats
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+EPOCH = datetime(1970, 1, 1)
+# ts is stored as wall-clock text; ts_ms is the same instant as integer
+# milliseconds so range and latest-row queries can use an index.
+TS_MS_SQL = "CAST(ROUND((julianday({}) - 2440587.5) * 86400000) AS INTEGER)"
+BACKFILL_CHUNK = 50_000
+CATCHUP_PAGE = 10_000
+# catchup backfills in parallel once this many ids behind
+SYNC_CHUNK_ROWS = 100_000
+SYNC_WORKERS = 4
+# (connect, read) seconds, so a dead provider fails the sync job
+# instead of hanging its worker
+REQUEST_TIMEOUT = (5, 60)
+CLIP_WORKERS = 4
+CLIP_MANIFEST_LIMIT = 100
+DOWNSAMPLE_CHUNK = 100_000
+UNITS = {"g": 1, "kg": 1000, "lb": 453.592}
+# Rollup tables and their bucket widths in ms
+ROLLUPS = {"minute": 60_000, "hour": 3_600_000}
+ROLLUP_REBUILD_CHUNK = 24 * 3_600_000
+DAY_MS = 24 * 3_600_000
+# Whole days older than this are moved to the archive
+ARCHIVE_KEEP_DAYS = 30
+
+CATCHUP_ROWS = REGISTRY.counter(
+    "pitl_catchup_rows_total", "Rows copied from the provider by catchup", ["store"]
+)
+COMMIT_SECONDS = REGISTRY.histogram(
+    "pitl_sqlite_commit_seconds", "Time to COMMIT a write transaction", ["store"]
+)
+CLIP_DOWNLOAD_SECONDS = REGISTRY.histogram(
+    "pitl_clip_download_seconds",
+    "Time to download one clip",
+    ["store"],
+    DURATION_BUCKETS,
+)
+CLIP_DOWNLOAD_BYTES = REGISTRY.counter(
+    "pitl_clip_download_bytes_total", "Clip bytes downloaded", ["store"]
+)
+
+
+def epoch_ms(ts):
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    # Round seconds the same way SQLite's julianday() does so ts_ms values
+    # computed here and in TS_MS_SQL agree to the millisecond.
+    minute = ts.replace(second=0, microsecond=0)
+    seconds = ts.second + ts.microsecond / 1_000_000
+    return (minute - EPOCH) // timedelta(milliseconds=1) + int(seconds * 1000 + 0.5)
+
+
+def page_size(data):
+    """Rows in a page: a list of rows, or the columns of a wire page."""
+    return len(data["id"]) if isinstance(data, dict) else len(data)
 
 
 def walk(path):
@@ -35,6 +101,7 @@ class SQLiteStore(Provider):
         self.file = file
         self.table = table
         self.ts_col = "ts"
+        self.ts_ms_col = "ts_ms"
         self.ts_strfmt = "%Y-%m-%d %X"
 
         if math.isnan(scale_factor) or scale_factor == 0:
@@ -48,6 +115,15 @@ class SQLiteStore(Provider):
 
         self.plotcolor = plotcolor
 
+        # Pooled keep-alive connections for parallel clip downloads
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=CLIP_WORKERS)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.archive = Archive(
+            os.path.join(datadir, "archive", os.path.splitext(file)[0], table)
+        )
         self.con = self.connection()
         self.migrate()
 
@@ -59,11 +135,11 @@ class SQLiteStore(Provider):
         conditions = []
         conditions_data = []
         if from_ts is not None:
-            conditions.append(f"{self.ts_col} >= ?")
-            conditions_data.append(from_ts)
+            conditions.append(f"{self.ts_ms_col} >= ?")
+            conditions_data.append(epoch_ms(from_ts))
         if to_ts is not None:
-            conditions.append(f"{self.ts_col} < {to_ts}")
-            conditions_data.append(to_ts)
+            conditions.append(f"{self.ts_ms_col} < ?")
+            conditions_data.append(epoch_ms(to_ts))
         conditions_str = f" WHERE {' AND '.join(conditions)}" if len(conditions) else ""
         query = f"SELECT * FROM {self.table}{conditions_str};"
         cur = self.cursor
@@ -72,17 +148,267 @@ class SQLiteStore(Provider):
 
     def writeall(self, data, client_ts=None, server_ts=None):
         con = self.connection(timeout=20)
-        cur = con.cursor()
+        self.insert_batch(con.cursor(), data, client_ts, server_ts)
+        with COMMIT_SECONDS.time(store=self.file):
+            con.commit()
+        con.close()
+
+    def insert_batch(self, cur, data, client_ts=None, server_ts=None):
+        """Insert one upload's rows with cur, leaving the commit to the caller.
+
+        data is a list of (id, ts, raw, config_id) rows, or the columns of a
+        decoded wire page, which are bound column by column without building
+        a list of rows first.
+        """
+        rows = page_size(data)
         cur.execute(
             "INSERT INTO uploads (client_ts, server_ts, rows) VALUES (?, ?, ?);",
-            (client_ts, server_ts, len(data)),
+            (client_ts, server_ts, rows),
         )
-        upload_id = cur.lastrowid
-        data = [x + [upload_id] for x in data]
-        query = f"INSERT INTO {self.table} VALUES ({','.join('?'*len(data[0]))})"
-        con.cursor().executemany(query, data)
-        con.commit()
-        con.close()
+        # The upload's own id, so the rows need no extra column
+        upload_id = int(cur.lastrowid)
+        query = (
+            f"INSERT OR IGNORE INTO {self.table} (id, ts, raw, config_id, upload_id, {self.ts_ms_col})"
+            f" VALUES (?1, ?2, ?3, ?4, {upload_id}, {TS_MS_SQL.format('?2')})"
+        )
+        if not rows:
+            return
+        if isinstance(data, dict):
+            cur.executemany(query, wire.rows(data))
+            ts_us = data["ts_us"]
+            # Rounded to the millisecond like TS_MS_SQL
+            start_ms = (int(ts_us.min()) + 500) // 1000
+            end_ms = (int(ts_us.max()) + 500) // 1000
+        else:
+            cur.executemany(query, data)
+            start_ms = epoch_ms(min(x[1] for x in data))
+            end_ms = epoch_ms(max(x[1] for x in data))
+        self.update_rollups(cur, start_ms, end_ms)
+
+    def advance_sync(self, cur, data):
+        """Move the sync watermark over pushed rows that continue it without
+        a gap, so catchup does not fetch them from the provider again."""
+        ids = [x[0] for x in data]
+        if not ids or max(ids) - min(ids) + 1 != len(ids):
+            return
+        cur.execute(
+            "UPDATE sync_state SET after_id = ?, updated_at = ?"
+            " WHERE after_id >= ? AND after_id < ?",
+            (max(ids), datetime.now(), min(ids) - 1, max(ids)),
+        )
+
+    def update_rollups(self, cur, start_ms, end_ms):
+        """Recompute the rollup buckets overlapping [start_ms, end_ms] from
+        measurements, leaving every other bucket untouched.
+
+        Buckets of archived days are left alone too: their rows are no
+        longer all in the table, so archive_days recomputes them from the
+        partition instead, late rows included.
+        """
+        horizon = self.archive.horizon()
+        if horizon is not None:
+            start_ms = max(start_ms, horizon)
+            if start_ms > end_ms:
+                return
+        params = {"offset": self.offset, "scale_factor": self.scale_factor}
+        minute = ROLLUPS["minute"]
+        params["start"] = start_ms // minute * minute
+        params["end"] = end_ms // minute * minute + minute
+        params["width"] = minute
+        cur.execute(
+            "INSERT OR REPLACE INTO rollup_minute (bucket, count, raw_min, raw_max, raw_sum, g_min, g_max, g_sum)"
+            " SELECT ts_ms / :width * :width AS bucket, count(*), min(raw), max(raw), sum(raw), min(g), max(g), sum(g)"
+            f" FROM ({self.calibrated_rows_sql()}) GROUP BY bucket",
+            params,
+        )
+        self.update_hour_rollups(cur, start_ms, end_ms)
+
+    def update_hour_rollups(self, cur, start_ms, end_ms):
+        """Recompute the hour buckets overlapping [start_ms, end_ms] from
+        their minute buckets."""
+        hour = ROLLUPS["hour"]
+        params = {
+            "start": start_ms // hour * hour,
+            "end": end_ms // hour * hour + hour,
+            "width": hour,
+        }
+        cur.execute(
+            "INSERT OR REPLACE INTO rollup_hour (bucket, count, raw_min, raw_max, raw_sum, g_min, g_max, g_sum)"
+            " SELECT bucket / :width * :width AS hour, sum(count), min(raw_min), max(raw_max), sum(raw_sum), min(g_min), max(g_max), sum(g_sum)"
+            " FROM rollup_minute WHERE bucket >= :start AND bucket < :end GROUP BY hour",
+            params,
+        )
+
+    def rebuild_rollups(self, chunk_ms=ROLLUP_REBUILD_CHUNK):
+        """Recompute every rollup bucket after the archived days, committing
+        one chunk at a time. Buckets of archived days are kept as
+        archive_days computed them from their partitions."""
+        cur = self.cursor
+        archived = self.archive.horizon()
+        start, end = cur.execute(
+            f"SELECT min({self.ts_ms_col}), max({self.ts_ms_col}) FROM {self.table} WHERE {self.ts_ms_col} >= coalesce(?, {self.ts_ms_col})",
+            (archived,),
+        ).fetchone()
+        cur.execute("DELETE FROM rollup_minute WHERE bucket >= ?", (archived or 0,))
+        cur.execute("DELETE FROM rollup_hour WHERE bucket >= ?", (archived or 0,))
+        self.con.commit()
+        while start is not None and start <= end:
+            # Chunks are whole hours, so no hour bucket straddles two chunks
+            chunk_end = min(end, start // chunk_ms * chunk_ms + chunk_ms - 1)
+            self.update_rollups(cur, start, chunk_end)
+            self.con.commit()
+            start = chunk_end + 1
+        cur.close()
+        print(f"Rebuilt rollups for {self.table}")
+
+    def newest_ms(self):
+        con = self.connection()
+        try:
+            (newest,) = con.execute(
+                # The condition lets max() use the partial ts_ms index
+                f"SELECT max({self.ts_ms_col}) FROM {self.table} WHERE {self.ts_ms_col} IS NOT NULL"
+            ).fetchone()
+        finally:
+            con.close()
+        return newest
+
+    def event_horizon(self, cur):
+        """ts_ms of the oldest row event extraction has yet to read, or None
+        once it has read every row. Before extraction has run at all, that
+        is the oldest row."""
+        (after_id,) = cur.execute("SELECT min(after_id) FROM event_state").fetchone()
+        (oldest,) = cur.execute(
+            f"SELECT min({self.ts_ms_col}) FROM {self.table} WHERE id > ? AND {self.ts_ms_col} IS NOT NULL",
+            (after_id or 0,),
+        ).fetchone()
+        return oldest
+
+    def archive_days(self, keep_days=ARCHIVE_KEEP_DAYS, now=None):
+        """Move each whole day older than keep_days from the table into the
+        archive, oldest first.
+
+        Days are only archived once event extraction has read all of their
+        rows, since it only reads the table. A day is read, written to its
+        archive partition, rolled up from the whole partition and deleted
+        from the table while holding the write lock, so rows ingested
+        meanwhile wait instead of being deleted unarchived. The freed pages
+        are reused by later inserts rather than returned to the filesystem.
+        """
+        now = now or datetime.now()
+        cutoff = epoch_ms(now.replace(hour=0, minute=0, second=0, microsecond=0))
+        cutoff -= keep_days * DAY_MS
+        con = self.connection(timeout=20)
+        con.isolation_level = None
+        cur = con.cursor()
+        try:
+            horizon = self.event_horizon(cur)
+            if horizon is not None and horizon < cutoff:
+                cutoff = horizon // DAY_MS * DAY_MS
+                print(f"Archiving {self.table} up to where event extraction got")
+            (start,) = cur.execute(
+                f"SELECT min({self.ts_ms_col}) FROM {self.table} WHERE {self.ts_ms_col} IS NOT NULL"
+            ).fetchone()
+            while start is not None and start < cutoff:
+                day_start = start // DAY_MS * DAY_MS
+                day_end = day_start + DAY_MS
+                name = (EPOCH + timedelta(milliseconds=day_start)).date().isoformat()
+                cur.execute("BEGIN IMMEDIATE")
+                try:
+                    rows = cur.execute(
+                        f"SELECT id, ts, raw, config_id, upload_id, {self.ts_ms_col} FROM {self.table}"
+                        f" WHERE {self.ts_ms_col} >= ? AND {self.ts_ms_col} < ?",
+                        (day_start, day_end),
+                    ).fetchall()
+                    self.archive.write(name, day_start, day_end, rows)
+                    self.rollup_archived(cur, con, day_start, day_end)
+                    cur.execute(
+                        f"DELETE FROM {self.table} WHERE {self.ts_ms_col} >= ? AND {self.ts_ms_col} < ?",
+                        (day_start, day_end),
+                    )
+                    cur.execute("COMMIT")
+                except BaseException:
+                    cur.execute("ROLLBACK")
+                    raise
+                print(f"Archived {len(rows)} rows of {self.table} for {name}")
+                (start,) = cur.execute(
+                    f"SELECT min({self.ts_ms_col}) FROM {self.table} WHERE {self.ts_ms_col} >= ?",
+                    (day_end,),
+                ).fetchone()
+        finally:
+            con.close()
+
+    def rollup_archived(self, cur, con, start_ms, end_ms):
+        """Recompute the rollup buckets of [start_ms, end_ms) from the
+        archive, as update_rollups would from the table."""
+        df = self.archive.read(start_ms, end_ms - 1)
+        if df is None:
+            return
+        df = df[df["raw"].notna() & (df["raw"] != 0)].copy()
+        df["raw"] = df["raw"].astype("int64")
+        self.calibrate(df, con)
+        minute = ROLLUPS["minute"]
+        df["bucket"] = df["ts_ms"] // minute * minute
+        buckets = df.groupby("bucket").agg(
+            count=("raw", "size"),
+            raw_min=("raw", "min"),
+            raw_max=("raw", "max"),
+            raw_sum=("raw", "sum"),
+            g_min=("g", "min"),
+            g_max=("g", "max"),
+            g_sum=("g", "sum"),
+        )
+        cur.executemany(
+            "INSERT OR REPLACE INTO rollup_minute (bucket, count, raw_min, raw_max, raw_sum, g_min, g_max, g_sum)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            buckets.reset_index().to_numpy().tolist(),
+        )
+        self.update_hour_rollups(cur, start_ms, end_ms - 1)
+
+    def rollup_for(self, xmin, xmax, points):
+        """Return the coarsest rollup whose buckets are no wider than one of
+        `points` pixels across [xmin, xmax], or None for raw rows."""
+        resolution_ms = (xmax - xmin) / timedelta(milliseconds=1) / points
+        for name, width in sorted(ROLLUPS.items(), key=lambda t: -t[1]):
+            if width <= resolution_ms:
+                return name
+        return None
+
+    def summary_df(self, xmin=None, xmax=None, xrange=None, points=1000):
+        """Per-bucket aggregates of [xmin, xmax] from the coarsest rollup that
+        still has a bucket per point, or per minute for shorter ranges.
+
+        Unlike todf, rows are buckets: x is the bucket start, g/kg/lb their
+        mean, lb_min/lb_max their extremes and count how many readings each
+        aggregates. Rollups aggregate unfiltered non-zero readings, so
+        there is no filter_df median and no lbmed5k, lbmed100 or catlb.
+        """
+        if xrange is not None:
+            if xmin is None and xmax is not None:
+                xmin = xmax - xrange
+            elif xmax is None and xmin is not None:
+                xmax = xmin + xrange
+        if xmin is None or xmax is None:
+            raise ValueError("summary_df: Expected a bounded range")
+        if points < 1:
+            raise ValueError(f"summary_df: Expected points >= 1, got {points}")
+        rollup = self.rollup_for(xmin, xmax, points) or "minute"
+        return self.rollup_df(rollup, xmin, xmax)
+
+    def rollup_df(self, rollup, xmin, xmax):
+        width = ROLLUPS[rollup]
+        df = pd.read_sql_query(
+            f"SELECT bucket, count, raw_min, raw_max, raw_sum * 1.0 / count AS raw,"
+            f" g_min, g_max, g_sum * 1.0 / count AS g FROM rollup_{rollup}"
+            f" WHERE bucket >= ? AND bucket <= ? ORDER BY bucket",
+            self.con,
+            params=[epoch_ms(xmin) // width * width, epoch_ms(xmax)],
+        )
+        df["x"] = pd.to_datetime(df["bucket"], unit="ms")
+        df["kg"] = df["g"] / 1000
+        df["lb"] = df["g"] / 453.592
+        df["lb_min"] = df["g_min"] / 453.592
+        df["lb_max"] = df["g_max"] / 453.592
+        return df
 
     def getremote(self, url, from_ts=None, to_ts=None):
         data = None
@@ -93,58 +419,601 @@ class SQLiteStore(Provider):
         return dt.strftime("%Y-%m-%d %X")
 
     def todf(self, xmin=None, xmax=None, xrange=None, query=None, filter=True):
+        """Load measurements into a DataFrame with derived weight columns.
+
+        Rows of archived days are read from the memory-mapped archive and
+        combined with the table's, unless a custom query is given. ts is then
+        datetime64 for every row instead of the stored text.
+        """
         query_conditions = []
+        query_data = []
         if xrange is not None:
             if xmin is None and xmax is not None:
                 xmin = xmax - xrange
             elif xmax is None and xmin is not None:
                 xmax = xmin + xrange
         if xmin is not None:
-            query_conditions.append(
-                f'{self.ts_col} >= "{xmin.strftime(self.ts_strfmt)}"'
-            )
+            query_conditions.append(f"{self.ts_ms_col} >= ?")
+            query_data.append(epoch_ms(xmin))
         if xmax is not None:
-            query_conditions.append(
-                f'{self.ts_col} <= "{xmax.strftime(self.ts_strfmt)}"'
-            )
+            query_conditions.append(f"{self.ts_ms_col} <= ?")
+            query_data.append(epoch_ms(xmax))
         if query is None:
             conditions_str = (
                 f' WHERE {" AND ".join(query_conditions)}'
                 if len(query_conditions)
                 else ""
             )
-            query = f"SELECT * FROM {self.table}{conditions_str}"
-        df = pd.read_sql_query(query, self.con)
+            query = (
+                f"SELECT * FROM {self.table}{conditions_str} ORDER BY {self.ts_ms_col}"
+            )
+            archived = self.archive.read(
+                None if xmin is None else epoch_ms(xmin),
+                None if xmax is None else epoch_ms(xmax),
+            )
+        else:
+            query_data = None
+            archived = None
+        df = pd.read_sql_query(query, self.con, params=query_data)
+        if archived is not None and df.empty:
+            df = archived
+        elif archived is not None:
+            df["ts"] = df["ts"].to_numpy().astype("datetime64[us]")
+            # Rows archived while also still in the table are kept once
+            df = pd.concat([archived, df], ignore_index=True)
+            df = df.drop_duplicates("id", keep="last")
+            df = df.sort_values(self.ts_ms_col, kind="stable", ignore_index=True)
         if filter:
             df = self.filter_df(df)
-        df["g"] = df["raw"].map(lambda y: int((y - self.offset) / self.scale_factor))
-        df["kg"] = df["g"].map(lambda y: y / 1000)
-        df["lb"] = df["g"].map(lambda y: y / 453.592)
-        df["x"] = df["ts"].map(lambda x: datetime.fromisoformat(x))
+        self.calibrate(df)
+        df["x"] = df["ts"].to_numpy().astype("datetime64[ns]")
         df["lbmed5k"] = df["lb"].rolling(window=5000).median()
         df["lbmed100"] = df["lb"].rolling(window=100).median()
         df["catlb"] = df["lbmed100"] - df["lbmed5k"]
         return df
 
-    def catchup(self, limit=None):
-        cur = self.cursor
-        (ts,) = cur.execute(
-            f"SELECT {self.ts_col} FROM {self.table} ORDER BY {self.ts_col} DESC"
-        ).fetchone()
-        cur.close()
-        print(f"Updating {self.table} from {ts}")
-        params = {"from_ts": ts}
+    def events(self, xmin=None, xmax=None):
+        """Visits found by events.EventExtractor that started in [xmin, xmax]."""
+        conditions = []
+        params = []
+        if xmin is not None:
+            conditions.append("start_ms >= ?")
+            params.append(epoch_ms(xmin))
+        if xmax is not None:
+            conditions.append("start_ms <= ?")
+            params.append(epoch_ms(xmax))
+        conditions_str = f' WHERE {" AND ".join(conditions)}' if conditions else ""
+        df = pd.read_sql_query(
+            f"SELECT start_ms, end_ms, duration_s, peak_lb FROM events{conditions_str} ORDER BY start_ms",
+            self.con,
+            params=params,
+        )
+        df["start"] = pd.to_datetime(df["start_ms"], unit="ms")
+        df["end"] = pd.to_datetime(df["end_ms"], unit="ms")
+        return df
+
+    def calibrations(self, con=None):
+        return pd.read_sql_query(
+            "SELECT id, g_factor, raw_offset FROM configs",
+            con or self.con,
+            index_col="id",
+        )
+
+    def calibrate(self, df, con=None):
+        """Add g, kg and lb columns, converting each row with the calibration
+        of its config_id and falling back to the store's scale_factor/offset
+        for rows whose config is unknown. Configs are read with con if
+        given, for callers on another thread than self.con's."""
+        scale_factor = pd.Series(self.scale_factor, index=df.index, dtype="float64")
+        offset = pd.Series(self.offset, index=df.index, dtype="float64")
+        if "config_id" in df:
+            configs = self.calibrations(con)
+            g_factor = configs["g_factor"].replace(0, np.nan)
+            scale_factor = df["config_id"].map(g_factor).fillna(scale_factor)
+            offset = df["config_id"].map(configs["raw_offset"]).fillna(offset)
+        # Truncate toward zero like int() did
+        df["g"] = np.trunc((df["raw"] - offset) / scale_factor).astype("int64")
+        df["kg"] = df["g"] / 1000
+        df["lb"] = df["g"] / 453.592
+        return df
+
+    def g_sql(self):
+        """SQL for a row's calibrated grams, truncated like calibrate()."""
+        return (
+            "CAST((m.raw - coalesce(c.raw_offset, :offset))"
+            " / coalesce(nullif(c.g_factor, 0), :scale_factor) AS INTEGER)"
+        )
+
+    def downsample(self, xmin, xmax, points=1000, method="buckets", unit="lb"):
+        """Summarize [xmin, xmax) into at most `points` time buckets.
+
+        method="buckets" returns count/min/max/mean/median per bucket.
+        method="lttb" returns one representative row per bucket, picked with
+        Largest-Triangle-Three-Buckets against the next bucket's mean.
+        Rows are streamed in time order by downsample_rows, from the archive
+        for archived days, and aggregated one bucket at a time, so the
+        full-resolution DataFrame is never built. Zero readings are dropped
+        as filter_df does.
+
+        When a bucket would span at least one rollup bucket (see rollup_for),
+        buckets are built from the coarsest such rollup table instead of raw
+        rows: the range starts on a rollup bucket and buckets are whole
+        rollup buckets wide. count, min, max and mean are then unchanged,
+        median is the count-weighted median of the rollup buckets' means,
+        and LTTB picks among those means.
+        """
+        if method not in ["buckets", "lttb"]:
+            raise ValueError(f"downsample: Unknown method {method}")
+        if points < 1:
+            raise ValueError(f"downsample: Expected points >= 1, got {points}")
+        start = epoch_ms(xmin)
+        end = epoch_ms(xmax)
+        rollup = self.rollup_for(xmin, xmax, points)
+        if rollup is None:
+            width = max(1, -(-(end - start) // points))
+        else:
+            rollup_width = ROLLUPS[rollup]
+            start = start // rollup_width * rollup_width
+            width = -(-(end - start) // (points * rollup_width)) * rollup_width
+        params = {
+            "start": start,
+            "end": end,
+            "width": width,
+            "offset": self.offset,
+            "scale_factor": self.scale_factor,
+        }
+        divisor = UNITS[unit]
+        con = self.connection()
+        try:
+            if rollup is None:
+                rows = self.downsample_rows(con, params)
+            else:
+                rows = self.rollup_rows(con, rollup, params)
+            buckets = self.bucket_rows(rows, params)
+            if method == "buckets":
+                summarize = self.row_stats if rollup is None else self.rollup_stats
+                stats = np.array(
+                    [(bucket, *summarize(rows)) for bucket, rows in buckets],
+                    dtype=np.float64,
+                ).reshape(-1, 6)
+                bucket = stats[:, 0].astype(np.int64)
+                df = pd.DataFrame(
+                    {
+                        "x": pd.to_datetime(start + bucket * width, unit="ms"),
+                        "count": stats[:, 1].astype(np.int64),
+                        "min": stats[:, 2] / divisor,
+                        "max": stats[:, 3] / divisor,
+                        "mean": stats[:, 4] / divisor,
+                        "median": stats[:, 5] / divisor,
+                    }
+                )
+            else:
+                # Rollup rows are picked by their mean, in their last column
+                ts, g = self.lttb(
+                    (bucket, rows[:, 0], rows[:, -1]) for bucket, rows in buckets
+                )
+                df = pd.DataFrame(
+                    {"x": pd.to_datetime(ts, unit="ms"), unit: g / divisor}
+                )
+        finally:
+            con.close()
+        return df
+
+    @staticmethod
+    def row_stats(rows):
+        """count, min, max, mean and median of (ts_ms, g) rows."""
+        g = rows[:, 1]
+        return len(g), g.min(), g.max(), g.mean(), np.median(g)
+
+    @staticmethod
+    def rollup_stats(rows):
+        """count, min, max, mean and median of the rows behind (bucket,
+        count, g_min, g_max, g_sum, g_mean) rollup rows, the median being
+        the count-weighted median of the rollup means."""
+        count = rows[:, 1]
+        total = count.sum()
+        order = np.argsort(rows[:, 5], kind="stable")
+        middle = np.searchsorted(np.cumsum(count[order]), total / 2)
+        return (
+            total,
+            rows[:, 2].min(),
+            rows[:, 3].max(),
+            rows[:, 4].sum() / total,
+            rows[order[middle], 5],
+        )
+
+    def calibrated_rows_sql(self):
+        return (
+            f"SELECT m.ts_ms AS ts_ms, m.raw AS raw, {self.g_sql()} AS g FROM {self.table} m"
+            f" LEFT JOIN configs c ON c.id = m.config_id"
+            f" WHERE m.ts_ms >= :start AND m.ts_ms < :end AND m.raw != 0"
+        )
+
+    def downsample_rows(self, con, params, chunk=DOWNSAMPLE_CHUNK):
+        """Yield (ts_ms, g) arrays of the nonzero rows in [start, end) in
+        time order, at most `chunk` rows at a time: archived days one day at
+        a time, then the table's rows over the ts_ms index."""
+        start = params["start"]
+        horizon = self.archive.horizon()
+        if horizon is not None and start < horizon:
+            end = min(params["end"], horizon)
+            for day_start in range(start // DAY_MS * DAY_MS, end, DAY_MS):
+                rows = self.archived_rows(
+                    con, max(start, day_start), min(end, day_start + DAY_MS)
+                )
+                for i in range(0, len(rows), chunk):
+                    yield rows[i : i + chunk]
+            start = horizon
+        cur = con.execute(
+            f"SELECT ts_ms, g FROM ({self.calibrated_rows_sql()}) ORDER BY ts_ms",
+            dict(params, start=start),
+        )
+        while True:
+            fetched = cur.fetchmany(chunk)
+            if not fetched:
+                return
+            yield np.array(fetched, dtype=np.float64).reshape(-1, 2)
+
+    def archived_rows(self, con, start_ms, end_ms):
+        """Return the nonzero rows in [start_ms, end_ms), below the archive
+        horizon, as a (ts_ms, g) array in time order. Besides the archived
+        rows, that includes any that arrived after their day was archived
+        and wait in the table for the next archive_days."""
+        frames = [
+            self.archive.read(start_ms, end_ms - 1),
+            pd.read_sql_query(
+                f"SELECT id, raw, config_id, {self.ts_ms_col} AS ts_ms FROM {self.table}"
+                f" WHERE {self.ts_ms_col} >= ? AND {self.ts_ms_col} < ?",
+                con,
+                params=[start_ms, end_ms],
+            ),
+        ]
+        frames = [
+            f[["id", "raw", "config_id", "ts_ms"]]
+            for f in frames
+            if f is not None and len(f)
+        ]
+        if not frames:
+            return np.empty((0, 2))
+        df = pd.concat(frames, ignore_index=True).drop_duplicates("id", keep="last")
+        df = df[df["raw"].notna() & (df["raw"] != 0)].copy()
+        df = df.sort_values("ts_ms", kind="stable")
+        self.calibrate(df, con)
+        return np.column_stack(
+            [df["ts_ms"].to_numpy(np.float64), df["g"].to_numpy(np.float64)]
+        )
+
+    def rollup_rows(self, con, rollup, params, chunk=DOWNSAMPLE_CHUNK):
+        """Yield (bucket, count, g_min, g_max, g_sum, g_mean) arrays of the
+        `rollup` buckets starting in [start, end), in time order, at most
+        `chunk` rows at a time."""
+        cur = con.execute(
+            f"SELECT bucket, count, g_min, g_max, g_sum, g_sum * 1.0 / count"
+            f" FROM rollup_{rollup} WHERE bucket >= :start AND bucket < :end"
+            f" AND count > 0 ORDER BY bucket",
+            params,
+        )
+        while True:
+            fetched = cur.fetchmany(chunk)
+            if not fetched:
+                return
+            yield np.array(fetched, dtype=np.float64).reshape(-1, 6)
+
+    def bucket_rows(self, chunks, params):
+        """Group chunks of rows in time order, ts_ms first, into one
+        (bucket, rows) per bucket, so only one chunk plus the bucket being
+        assembled is ever in memory."""
+        chunks = iter(chunks)
+        carry = None
+        while True:
+            fetched = next(chunks, None)
+            done = fetched is None
+            if carry is None:
+                if done:
+                    return
+                carry = fetched[:0]
+            rows = carry if done else np.concatenate([carry, fetched])
+            if not len(rows):
+                if done:
+                    return
+                continue
+            buckets = (rows[:, 0].astype(np.int64) - params["start"]) // params["width"]
+            # The last bucket may continue in the next chunk
+            complete = buckets < buckets[-1] if not done else buckets == buckets
+            carry = rows[~complete]
+            rows, buckets = rows[complete], buckets[complete]
+            bounds = np.flatnonzero(np.diff(buckets)) + 1
+            for part in np.split(np.arange(len(rows)), bounds):
+                if len(part):
+                    yield buckets[part[0]], rows[part]
+            if done:
+                return
+
+    def lttb(self, buckets):
+        """Pick, per bucket, the row forming the largest triangle with the
+        previously picked point and the next bucket's mean point. Each
+        bucket waits for the next one to be read; the last is measured
+        against its own mean."""
+        picked_ts = []
+        picked_g = []
+        previous = None
+        for current in itertools.chain(buckets, [None]):
+            if previous is not None:
+                _, ts, g = previous
+                _, next_ts, next_g = previous if current is None else current
+                if not len(picked_ts):
+                    # The first point is kept as-is, as in standard LTTB
+                    i = 0
+                else:
+                    ax, ay = picked_ts[-1], picked_g[-1]
+                    cx, cy = next_ts.mean(), next_g.mean()
+                    i = np.argmax(np.abs((ax - cx) * (g - ay) - (ax - ts) * (cy - ay)))
+                picked_ts.append(ts[i])
+                picked_g.append(g[i])
+            previous = current
+        return np.array(picked_ts), np.array(picked_g)
+
+    def catchup(
+        self,
+        limit=CATCHUP_PAGE,
+        columnar=True,
+        workers=SYNC_WORKERS,
+        chunk_rows=SYNC_CHUNK_ROWS,
+    ):
+        """Follow the provider's keyset cursor from the sync watermark until
+        it reports no more rows.
+
+        When more than chunk_rows behind, or when an interrupted backfill
+        left chunks behind, backfill() closes most of the gap first with
+        `workers` concurrent fetches. Each page is written as soon as it
+        arrives, together with the watermark it reached, so memory stays
+        bounded by the page size and a restart resumes where the last page
+        ended. Pages are requested in the compressed columnar format when
+        columnar is set; providers that do not offer it answer with NDJSON
+        instead. The provider's calibration configs are synced first.
+        """
+        self.sync_configs()
+        after_id = self.sync_after_id()
+        if self.backfill_chunks():
+            self.backfill(None, workers, chunk_rows, limit, columnar)
+        else:
+            remote_max_id = self.remote_max_id()
+            if remote_max_id is not None and remote_max_id - after_id > chunk_rows:
+                self.backfill(remote_max_id, workers, chunk_rows, limit, columnar)
+        after_id = self.sync_after_id()
+        print(f"Updating {self.table} from id {after_id}")
+
+        added = 0
+        while after_id is not None:
+            newdata, next = self.fetch_page(after_id, limit, columnar=columnar)
+            reached = next
+            if reached is None:
+                # The last page: the watermark still moves past its rows
+                reached = self.last_id(newdata, after_id)
+            self.write_page(newdata, reached)
+            added += page_size(newdata)
+            after_id = next
+
+        if added == 0:
+            print("Received no data")
+            return
+        print(f"Added {added} rows")
+
+    def fetch_page(self, after_id, limit=CATCHUP_PAGE, to_id=None, columnar=True):
+        """Request the provider's rows after after_id, up to to_id when given.
+        Returns (data, next), next being the after_id of the following page
+        or None once there are no more. data is the decoded columns of a
+        columnar page (see insert_batch), or a list of rows from NDJSON."""
+        params = {"after_id": after_id}
         if limit is not None:
             params["limit"] = limit
-
-        response = requests.get(f"{self.host}?{urllib.parse.urlencode(params)}")
+        if to_id is not None:
+            params["to_id"] = to_id
+        headers = {}
+        if columnar:
+            params["compress"] = "zlib"
+            headers["Accept"] = f"{wire.MIMETYPE}, application/x-ndjson;q=0.5"
+        response = self.session.get(
+            f"{self.host}?{urllib.parse.urlencode(params)}",
+            headers=headers,
+            stream=True,
+            timeout=REQUEST_TIMEOUT,
+        )
         response.raise_for_status()
-        newdata = response.json()
-        if len(newdata) == 0:
-            print("Received no data")
+        if response.headers.get("Content-Type") == wire.MIMETYPE:
+            return wire.decode(response.content)
+        rows = []
+        next = None
+        for line in response.iter_lines():
+            item = json.loads(line)
+            if isinstance(item, dict):
+                next = item["next"]
+            else:
+                rows.append(item)
+        return rows, next
+
+    def write_page(self, data, after_id, chunk=None):
+        """Insert a fetched page and record the after_id it reached, for the
+        sync watermark or for backfill chunk `chunk`, in one transaction."""
+        con = self.connection(timeout=20)
+        try:
+            cur = con.cursor()
+            if page_size(data):
+                self.insert_batch(cur, data)
+            if chunk is None:
+                cur.execute(
+                    "UPDATE sync_state SET after_id = max(after_id, ?), updated_at = ?",
+                    (after_id, datetime.now()),
+                )
+            else:
+                cur.execute(
+                    "UPDATE backfill_chunks SET after_id = ? WHERE lo = ?",
+                    (after_id, chunk),
+                )
+            with COMMIT_SECONDS.time(store=self.file):
+                con.commit()
+        finally:
+            con.close()
+        CATCHUP_ROWS.inc(page_size(data), store=self.file)
+
+    @staticmethod
+    def last_id(data, default):
+        """The id of a page's last row, or default when it is empty."""
+        if not page_size(data):
+            return default
+        return int(data["id"][-1] if isinstance(data, dict) else data[-1][0])
+
+    def sync_after_id(self):
+        con = self.connection()
+        try:
+            (after_id,) = con.execute("SELECT after_id FROM sync_state").fetchone()
+        finally:
+            con.close()
+        return after_id
+
+    def backfill_chunks(self):
+        """Return the (lo, hi, after_id) id ranges of the backfill in
+        progress; each chunk is done once after_id reaches hi."""
+        con = self.connection()
+        try:
+            return con.execute(
+                "SELECT lo, hi, after_id FROM backfill_chunks ORDER BY lo"
+            ).fetchall()
+        finally:
+            con.close()
+
+    def sync_configs(self):
+        """Copy the provider's calibration configs, which rows refer to by
+        config_id, and recompute the rollups of rows whose config was new or
+        changed, as those were calibrated with the store's defaults."""
+        try:
+            response = self.session.get(
+                f"{self.host.rstrip('/')}/configs", timeout=REQUEST_TIMEOUT
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"WARNING: Could not read the provider's configs: {e}")
             return
-        self.writeall(newdata)
-        print(f"Added {len(newdata)} rows")
+        con = self.connection(timeout=20)
+        try:
+            cur = con.cursor()
+            known = {
+                row[0]: tuple(row)
+                for row in cur.execute(
+                    "SELECT id, created_at, g_factor, raw_offset FROM configs"
+                )
+            }
+            changed = [
+                tuple(row) for row in response.json() if known.get(row[0]) != tuple(row)
+            ]
+            if not changed:
+                return
+            cur.executemany(
+                "INSERT OR REPLACE INTO configs (id, created_at, g_factor, raw_offset) VALUES (?, ?, ?, ?)",
+                changed,
+            )
+            ids = ", ".join(str(int(row[0])) for row in changed)
+            start_ms, end_ms = cur.execute(
+                f"SELECT min({self.ts_ms_col}), max({self.ts_ms_col}) FROM {self.table} WHERE config_id IN ({ids})"
+            ).fetchone()
+            if start_ms is not None:
+                self.update_rollups(cur, start_ms, end_ms)
+            con.commit()
+        finally:
+            con.close()
+        print(f"Synced {len(changed)} configs")
+
+    def remote_max_id(self):
+        """Ask the provider for its largest id, or None if it can't say."""
+        try:
+            response = self.session.get(
+                f"{self.host.rstrip('/')}/range", timeout=REQUEST_TIMEOUT
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            print(f"WARNING: Could not read the provider's id range: {e}")
+            return None
+        return response.json()["max_id"]
+
+    def backfill(
+        self,
+        remote_max_id=None,
+        workers=SYNC_WORKERS,
+        chunk_rows=SYNC_CHUNK_ROWS,
+        limit=CATCHUP_PAGE,
+        columnar=True,
+    ):
+        """Fetch the ids from the sync watermark to remote_max_id as
+        chunk_rows-wide id ranges, `workers` at a time.
+
+        The chunks are recorded in backfill_chunks before any is fetched,
+        and each page advances its chunk's after_id in the transaction that
+        inserts it, so a restart resumes every chunk where it stopped; with
+        remote_max_id None only those recorded chunks are resumed. Inserts
+        ignore ids already present, so re-fetching a page is harmless. Once
+        chunks complete from the bottom up, the sync watermark moves past
+        them.
+        """
+        if remote_max_id is not None and not self.backfill_chunks():
+            start = self.sync_after_id()
+            con = self.connection()
+            con.executemany(
+                "INSERT INTO backfill_chunks (lo, hi, after_id) VALUES (?1, ?2, ?1)",
+                [
+                    (lo, min(lo + chunk_rows, remote_max_id))
+                    for lo in range(start, remote_max_id, chunk_rows)
+                ],
+            )
+            con.commit()
+            con.close()
+        chunks = [chunk for chunk in self.backfill_chunks() if chunk[2] < chunk[1]]
+        print(f"Backfilling {self.table}: {len(chunks)} chunks of {chunk_rows} ids")
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(self.fetch_chunk, lo, hi, after_id, limit, columnar)
+                    for lo, hi, after_id in chunks
+                ]
+                for future in as_completed(futures):
+                    future.result()
+        finally:
+            self.advance_watermark()
+        print(f"Backfilled {self.table} in {time.perf_counter() - start:.1f}s")
+
+    def fetch_chunk(self, lo, hi, after_id, limit=CATCHUP_PAGE, columnar=True):
+        while after_id < hi:
+            rows, next = self.fetch_page(after_id, limit, hi, columnar)
+            # No next page means nothing else exists up to hi
+            after_id = next if next is not None else hi
+            self.write_page(rows, after_id, chunk=lo)
+
+    def advance_watermark(self):
+        """Move the sync watermark to the end of the lowest unbroken run of
+        completed chunks, and forget those chunks."""
+        con = self.connection(timeout=20)
+        try:
+            cur = con.cursor()
+            (pending,) = cur.execute(
+                "SELECT min(after_id) FROM backfill_chunks WHERE after_id < hi"
+            ).fetchone()
+            if pending is None:
+                (watermark,) = cur.execute(
+                    "SELECT max(hi) FROM backfill_chunks"
+                ).fetchone()
+            else:
+                (watermark,) = cur.execute(
+                    "SELECT max(hi) FROM backfill_chunks WHERE hi <= ?", (pending,)
+                ).fetchone()
+            if watermark is not None:
+                cur.execute(
+                    "UPDATE sync_state SET after_id = max(after_id, ?), updated_at = ?",
+                    (watermark, datetime.now()),
+                )
+                cur.execute("DELETE FROM backfill_chunks WHERE hi <= ?", (watermark,))
+            con.commit()
+        finally:
+            con.close()
 
     #     @app.route('/clips')
     # def get_file():
@@ -174,16 +1043,192 @@ class SQLiteStore(Provider):
     #     return send_file(filepath, as_attachment=True)
 
     def convert_file(self, filepath, fps=3):
+        """Convert an .h264 clip to .mp4 next to it.
+
+        ffmpeg writes to a temporary name that is only renamed into place once
+        it succeeds, so an existing .mp4 is always a complete conversion.
+        """
+        outfile = filepath.replace(".h264", ".mp4")
+        partfile = f"{outfile}.part"
         subprocess.run(
             [
                 "ffmpeg",
+                "-y",
+                "-loglevel",
+                "error",
                 "-i",
                 filepath,
                 "-vf",
                 f"setpts={30/fps}*PTS",
-                filepath.replace(".h264", ".mp4"),
-            ]
+                "-f",
+                "mp4",
+                partfile,
+            ],
+            stdin=subprocess.DEVNULL,
+            check=True,
         )
+        os.replace(partfile, outfile)
+        return outfile
+
+    def enqueue_transcode(self, filepath, fps):
+        con = self.connection(timeout=20)
+        con.execute(
+            # A clip fetched again after a truncated download is queued again
+            "INSERT INTO transcodes (path, fps, queued_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (path) DO UPDATE SET status = 'queued', queued_at = excluded.queued_at"
+            " WHERE status != 'queued'",
+            (filepath, fps, datetime.now()),
+        )
+        con.commit()
+        con.close()
+
+    def claim_transcode(self):
+        """Mark the oldest queued transcode as running and return
+        (id, path, fps), or None if the queue is empty."""
+        con = self.connection(timeout=20)
+        job = con.execute(
+            "UPDATE transcodes SET status = 'running', started_at = ?"
+            " WHERE id = (SELECT id FROM transcodes WHERE status = 'queued' ORDER BY id LIMIT 1)"
+            " RETURNING id, path, fps",
+            (datetime.now(),),
+        ).fetchone()
+        con.commit()
+        con.close()
+        return job
+
+    def finish_transcode(self, job_id, status, duration_s=None, error=None):
+        con = self.connection(timeout=20)
+        con.execute(
+            "UPDATE transcodes SET status = ?, finished_at = ?, duration_s = ?, error = ? WHERE id = ?",
+            (status, datetime.now(), duration_s, error, job_id),
+        )
+        con.commit()
+        con.close()
+
+    def requeue_transcodes(self):
+        """Return transcodes left running by a previous process to the queue."""
+        con = self.connection(timeout=20)
+        con.execute(
+            "UPDATE transcodes SET status = 'queued', started_at = NULL WHERE status = 'running'"
+        )
+        con.commit()
+        con.close()
+
+    def transcode_depth(self):
+        con = self.connection(timeout=20)
+        (depth,) = con.execute(
+            "SELECT count(*) FROM transcodes WHERE status = 'queued'"
+        ).fetchone()
+        con.close()
+        return depth
+
+    def catchup_clips(
+        self, host, dirpath, fps=30, workers=CLIP_WORKERS, limit=CLIP_MANIFEST_LIMIT
+    ):
+        """Download every clip the provider lists after our newest one.
+
+        Clips are fetched `workers` at a time over the pooled session. Each
+        downloads into a .part file that is only renamed once it has the
+        size the manifest lists, and every clip in the manifest gets its
+        .part file before any download starts, so an interrupted run resumes
+        all of them with Range requests next time instead of skipping the
+        ones that had not started. The manifest is listed from before the
+        oldest .part file, and a listed clip we already have is fetched again
+        when its size differs, so a truncated clip is never taken as done.
+        """
+        names = [name for _, name in walk(dirpath)]
+        pending = sorted(
+            name[: -len(".part")] for name in names if name.endswith(".part")
+        )
+        pending = [name for name in pending if not name.endswith(".mp4")]
+        complete = sorted(name for name in names if not name.endswith(".part"))
+        if pending:
+            complete = [name for name in complete if name < pending[0]]
+        after = complete[-1] if complete else None
+
+        fetched = 0
+        while True:
+            params = {"limit": limit}
+            if after is not None:
+                params["from"] = after
+            response = self.session.get(
+                f"{host}/manifest?{urllib.parse.urlencode(params)}",
+                timeout=REQUEST_TIMEOUT,
+            )
+            response.raise_for_status()
+            manifest = response.json()
+            batch = {}
+            for clip in manifest:
+                name = clip["name"]
+                path = os.path.join(dirpath, name)
+                if os.path.exists(path):
+                    if os.path.getsize(path) == clip["size"]:
+                        continue
+                    print(
+                        f"WARNING: {name} is not {clip['size']} bytes, fetching again"
+                    )
+                    mp4 = path.replace(".h264", ".mp4")
+                    if mp4 != path and os.path.exists(mp4):
+                        os.remove(mp4)
+                    os.replace(path, f"{path}.part")
+                else:
+                    open(f"{path}.part", "ab").close()
+                batch[name] = clip["size"]
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(self.download_clip, host, dirpath, name, size): name
+                    for name, size in sorted(batch.items())
+                }
+                for future in as_completed(futures):
+                    name = futures[future]
+                    try:
+                        future.result()
+                    except (OSError, requests.RequestException) as e:
+                        print(f"ERROR: Failed to download {name}: {e}")
+                        continue
+                    self.enqueue_transcode(os.path.join(dirpath, name), fps)
+                    fetched += 1
+                    print(f"Received file {name}")
+            if len(manifest) < limit:
+                if not fetched:
+                    print("No new files")
+                return
+            after = manifest[-1]["name"]
+
+    def download_clip(self, host, dirpath, name, size=None):
+        """Download one clip into name.part, resuming from its current size,
+        and rename it to name once it is `size` bytes. A shorter .part is
+        kept to resume next time and a longer one, which no range can
+        repair, is discarded; either way OSError is raised."""
+        partpath = os.path.join(dirpath, f"{name}.part")
+        offset = os.path.getsize(partpath) if os.path.exists(partpath) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        start = time.perf_counter()
+        with self.session.get(
+            f"{host}/{urllib.parse.quote(name)}",
+            headers=headers,
+            stream=True,
+            timeout=REQUEST_TIMEOUT,
+        ) as response:
+            if response.status_code == 416:
+                # Range starts at the end: the previous run got every byte
+                pass
+            else:
+                response.raise_for_status()
+                # A 200 means the provider ignored the range; start over
+                mode = "ab" if response.status_code == 206 else "wb"
+                with open(partpath, mode) as destination:
+                    for chunk in response.iter_content(chunk_size=1 << 16):
+                        destination.write(chunk)
+                        CLIP_DOWNLOAD_BYTES.inc(len(chunk), store=self.file)
+        received = os.path.getsize(partpath)
+        if size is not None and received != size:
+            if received > size:
+                os.remove(partpath)
+            raise OSError(f"Received {received} of {size} bytes")
+        os.replace(partpath, os.path.join(dirpath, name))
+        CLIP_DOWNLOAD_SECONDS.observe(time.perf_counter() - start, store=self.file)
 
     def catchup_files(self, host, dirpath, recursion_max=None, fps=30):
         filenames = list(walk(dirpath))
@@ -192,7 +1237,11 @@ class SQLiteStore(Provider):
         if len(sorted_files):
             params["from"] = sorted_files[-1][1]
 
-        response = requests.get(f"{host}?{urllib.parse.urlencode(params)}", stream=True)
+        response = requests.get(
+            f"{host}?{urllib.parse.urlencode(params)}",
+            stream=True,
+            timeout=REQUEST_TIMEOUT,
+        )
         response.raise_for_status()
         if response.status_code == 204:
             print("No new files")
@@ -208,7 +1257,7 @@ class SQLiteStore(Provider):
             with open(os.path.join(dirpath, filename), "xb") as destination:
                 for chunk in response.iter_content():
                     destination.write(chunk)
-            self.convert_file(os.path.join(dirpath, filename), fps)
+            self.enqueue_transcode(os.path.join(dirpath, filename), fps)
         except FileExistsError:
             print(f"Warning: Skipping existing file {filename}")
             return
@@ -219,6 +1268,7 @@ class SQLiteStore(Provider):
                 host,
                 dirpath,
                 recursion_max=recursion_max - 1 if recursion_max is not None else None,
+                fps=fps,
             )
 
     def connection(self, timeout=None):
@@ -229,15 +1279,96 @@ class SQLiteStore(Provider):
         print(f"Will connect to {path_to_db}")
         return sqlite3.connect(path_to_db, **connection_args)
 
+    def columns(self, table):
+        cur = self.cursor
+        columns = [row[1] for row in cur.execute(f"PRAGMA table_info({table})")]
+        cur.close()
+        return columns
+
     def migrate(self):
         cur = self.cursor
+        # Lets todf and catchup read while the ingest writer commits
+        cur.execute("PRAGMA journal_mode=WAL")
         cur.execute(
-            "CREATE TABLE IF NOT EXISTS measurements (id INTEGER PRIMARY KEY AUTOINCREMENT, ts, raw, config_id)"
+            "CREATE TABLE IF NOT EXISTS measurements (id INTEGER PRIMARY KEY AUTOINCREMENT, ts, raw, config_id, upload_id, ts_ms INTEGER)"
         )
         cur.execute(
             "CREATE TABLE IF NOT EXISTS configs (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, g_factor, raw_offset)"
         )
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS uploads (id INTEGER PRIMARY KEY AUTOINCREMENT, client_ts, server_ts, rows)"
+        )
+        (rollups,) = cur.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name LIKE 'rollup_%'"
+        ).fetchone()
+        for rollup in ROLLUPS:
+            cur.execute(
+                f"CREATE TABLE IF NOT EXISTS rollup_{rollup} (bucket INTEGER PRIMARY KEY, count, raw_min, raw_max, raw_sum, g_min, g_max, g_sum)"
+            )
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, start_ms INTEGER, end_ms INTEGER, duration_s, peak_lb, start_id, end_id)"
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS events_start_ms ON events (start_ms)")
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS event_state (name PRIMARY KEY, after_id, state)"
+        )
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state (id INTEGER PRIMARY KEY CHECK (id = 1), after_id, updated_at)"
+        )
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS backfill_chunks (lo INTEGER PRIMARY KEY, hi, after_id)"
+        )
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS transcodes (id INTEGER PRIMARY KEY AUTOINCREMENT, path UNIQUE, fps, status DEFAULT 'queued', queued_at, started_at, finished_at, duration_s, error)"
+        )
+        columns = self.columns(self.table)
+        if "upload_id" not in columns:
+            cur.execute(f"ALTER TABLE {self.table} ADD COLUMN upload_id")
+        if self.ts_ms_col not in columns:
+            cur.execute(f"ALTER TABLE {self.table} ADD COLUMN {self.ts_ms_col} INTEGER")
+        # Partial index: building it skips the not-yet-backfilled rows, and
+        # every range condition on ts_ms implies ts_ms IS NOT NULL.
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS {self.table}_{self.ts_ms_col} ON {self.table} ({self.ts_ms_col}) WHERE {self.ts_ms_col} IS NOT NULL"
+        )
+        if cur.execute("SELECT 1 FROM sync_state").fetchone() is None:
+            (after_id,) = cur.execute(f"SELECT max(id) FROM {self.table}").fetchone()
+            cur.execute(
+                "INSERT INTO sync_state (id, after_id, updated_at) VALUES (1, ?, ?)",
+                (max(after_id or 0, self.archive.max_id() or 0), datetime.now()),
+            )
+        self.con.commit()
+        cur.close()
+        self.backfill_ts()
+        if rollups < len(ROLLUPS):
+            self.rebuild_rollups()
+
+    def backfill_ts(self, chunk=BACKFILL_CHUNK):
+        """Fill ts_ms for rows written before the column existed.
+
+        Walks the table by id in chunks and commits after each one, so the
+        write lock is only held for a single chunk at a time.
+        """
+        cur = self.cursor
+        (start,) = cur.execute(
+            f"SELECT min(id) FROM {self.table} WHERE {self.ts_ms_col} IS NULL"
+        ).fetchone()
+        filled = 0
+        while start is not None:
+            (end,) = cur.execute(f"SELECT max(id) FROM {self.table}").fetchone()
+            if start > end:
+                break
+            cur.execute(
+                f"UPDATE {self.table} SET {self.ts_ms_col} = {TS_MS_SQL.format(self.ts_col)}"
+                f" WHERE id >= ? AND id < ? AND {self.ts_ms_col} IS NULL",
+                (start, start + chunk),
+            )
+            filled += cur.rowcount
+            self.con.commit()
+            start += chunk
         cur.close()
+        if filled:
+            print(f"Backfilled {self.ts_ms_col} for {filled} rows in {self.table}")
 
     def filter_df(self, df):
         filtered = df[~df.index.isin(df.index[df["raw"] == 0])].copy()
@@ -255,13 +1386,18 @@ class SQLiteStore(Provider):
         yfilter=None,
         xseries="x",
         df=None,
+        points=None,
         **plot_args,
     ):
         if x0 is not None:
             if xrange is not None:
                 plot_args["xlim"] = (x0, x0 + xrange)
 
-        df = df if df is not None else self.todf(xmin=x0, xrange=xrange)
+        if df is None and points is not None:
+            # Bucket aggregates have lb, lb_min and lb_max but no lbmed columns
+            df = self.summary_df(xmin=x0, xrange=xrange, points=points)
+        elif df is None:
+            df = self.todf(xmin=x0, xrange=xrange)
 
         if yfilter is not None:
             if yfilter is True and y0 is not None and yrange is not None:
@@ -279,32 +1415,134 @@ class SQLiteStore(Provider):
         matplotlib.pyplot.show()
 
 
+def store_metrics(stores):
+    """Register the gauges read from the stores' databases at scrape time."""
+
+    cache = {"at": None, "newest": None}
+
+    def newest():
+        # Both gauges below read this, so query once per scrape
+        now = time.monotonic()
+        if cache["at"] is None or now - cache["at"] > 1:
+            cache["newest"] = {(store.file,): store.newest_ms() for store in stores}
+            cache["at"] = now
+        return cache["newest"]
+
+    REGISTRY.gauge(
+        "pitl_newest_measurement_timestamp_seconds",
+        "ts of the newest measurement, as naive wall-clock epoch seconds",
+        ["store"],
+        fn=lambda: {k: (v or 0) / 1000 for k, v in newest().items()},
+    )
+    # The providers write in real time, so how far the newest local row is
+    # behind the local clock is how far catchup is behind them
+    REGISTRY.gauge(
+        "pitl_catchup_lag_seconds",
+        "Seconds between now and the newest measurement",
+        ["store"],
+        fn=lambda: {
+            k: (epoch_ms(datetime.now()) - v) / 1000
+            for k, v in newest().items()
+            if v is not None
+        },
+    )
+    REGISTRY.gauge(
+        "pitl_clip_backlog",
+        "Clips queued for transcoding",
+        ["store"],
+        fn=lambda: {(store.file,): store.transcode_depth() for store in stores},
+    )
+
+
 def server(stores, config):
     from flask import Flask, request
     from flask_socketio import SocketIO
+    from broadcast import Broadcaster
+    from ingest import IngestWriter, valid_batch
+    from metrics import instrument
+    from concurrent.futures import TimeoutError
+    import queue
 
     import random
 
     DEBUG = config.getboolean("debug")
     app = Flask(__name__)
+    instrument(app)
+    store_metrics(stores)
     socketio = SocketIO(app)
+    writers = [IngestWriter(store) for store in stores]
+    broadcaster = Broadcaster(
+        socketio, window_s=config.getfloat("broadcast_window_s", fallback=0.25)
+    ).start()
 
     @app.route("/ingest/<store>", methods=["post"])
     def ingest(store):
         ts = datetime.now()
-        payload = request.get_json()
+        body = request.get_data()
+        try:
+            if request.headers.get("Content-Encoding") == "gzip":
+                body = gzip.decompress(body)
+            payload = json.loads(body)
+        except (OSError, EOFError, ValueError) as e:
+            return f"Invalid body: {e}", 400
 
-        data = payload["data"] if isinstance(payload, dict) else payload
-        client_ts = (
-            payload.get("batch_time") if isinstance(payload, dict) else data[-1][0]
-        )
+        if isinstance(payload, dict):
+            data = payload.get("data")
+            client_ts = payload.get("batch_time")
+        else:
+            data = payload
+            client_ts = data[-1][0] if valid_batch(data) and data else None
+        if not valid_batch(data):
+            return "Expected data as a list of [id, ts, raw, config_id] rows", 400
 
         if DEBUG:
             print(f"Received data {data}")
-        stores[int(store)].writeall(data, client_ts=client_ts, server_ts=ts)
-        emit_batch(data)
+        try:
+            writers[int(store)].write(data, client_ts=client_ts, server_ts=ts)
+        except (queue.Full, TimeoutError):
+            return "Ingest queue full, retry later", 503
+        except (TypeError, ValueError) as e:
+            return f"Invalid batch: {e}", 400
+        except sqlite3.Error as e:
+            return f"Failed to write batch: {e}", 500
+        emit_batch(int(store), data)
         return f"Wrote {len(data)} rows"
 
+    @app.route("/downsample/<store>")
+    def downsample(store):
+        try:
+            xmin = datetime.fromisoformat(request.args["from"])
+            xmax = datetime.fromisoformat(request.args["to"])
+        except (KeyError, ValueError):
+            return "Expected from and to as YYYY-MM-DD HH:MM:SS", 400
+        try:
+            points = int(request.args.get("points", 1000))
+        except ValueError:
+            return "Invalid points: expected integer", 400
+        if points < 1:
+            return "Invalid points: expected at least 1", 400
+        method = request.args.get("method", "buckets")
+        unit = request.args.get("unit", "lb")
+        if method not in ["buckets", "lttb"] or unit not in UNITS:
+            return "Expected method buckets or lttb and unit g, kg or lb", 400
+        df = stores[int(store)].downsample(xmin, xmax, points, method, unit)
+        df["x"] = df["x"].astype(str)
+        return df.to_json(orient="records")
+
+    @app.route("/events/<store>")
+    def events(store):
+        try:
+            xmin = request.args.get("from")
+            xmax = request.args.get("to")
+            xmin = datetime.fromisoformat(xmin) if xmin else None
+            xmax = datetime.fromisoformat(xmax) if xmax else None
+        except ValueError:
+            return "Expected from and to as YYYY-MM-DD HH:MM:SS", 400
+        df = stores[int(store)].events(xmin, xmax)
+        df["start"] = df["start"].astype(str)
+        df["end"] = df["end"].astype(str)
+        return df.to_json(orient="records")
+
     @app.route("/")
     def index():
         return "Hello, world"
@@ -325,6 +1563,12 @@ def server(stores, config):
  <script type="text/javascript" charset="utf-8">
     var socket = io();
     var logSize = 10;
+    const params = new URLSearchParams(window.location.search);
+    const subscription = {
+        store: Number(params.get('store') || 0),
+        every: Number(params.get('every') || 1),
+        max_rate: params.has('max_rate') ? Number(params.get('max_rate')) : null,
+    };
     const log = document.getElementById('log');
 
     const buildPoint = (data) => {
@@ -344,6 +1588,7 @@ def server(stores, config):
 
     socket.on('connect', function() {
         socket.emit('my event', {data: "I'm connected!"});
+        socket.emit('subscribe', subscription);
         const el = document.createElement('div');
         el.innerHTML = 'Connected'
         log.prepend(el)
@@ -366,10 +1611,10 @@ def server(stores, config):
             print(f"Sending data {data}")
         socketio.emit("data", {"data": data})
 
-    def emit_batch(data):
+    def emit_batch(store, data):
         if DEBUG:
-            print(f"Sending batch of size {len(data)}")
-        socketio.emit("batch", {"data": data})
+            print(f"Queueing batch of size {len(data)} for store {store}")
+        broadcaster.publish(store, data)
 
     def rand():
         return (datetime.now().isoformat(), random.randint(0, 1000))
@@ -380,6 +1625,29 @@ def server(stores, config):
             print("Received connection request")
         emit("my response", {"data": "Connected"})
 
+    @socketio.on("subscribe")
+    def subscribe(options):
+        try:
+            store = int(options["store"])
+            every = int(options.get("every") or 1)
+            max_rate = options.get("max_rate")
+            max_rate = float(max_rate) if max_rate is not None else None
+        except (KeyError, TypeError, ValueError):
+            return "Expected store, and optionally every and max_rate as numbers"
+        valid_rate = max_rate is None or (math.isfinite(max_rate) and max_rate > 0)
+        if not 0 <= store < len(stores) or every < 1 or not valid_rate:
+            return "Expected a valid store, every >= 1 and a finite max_rate > 0"
+        broadcaster.subscribe(request.sid, store, every, max_rate)
+
+    @socketio.on("unsubscribe")
+    def unsubscribe(options=None):
+        store = options.get("store") if isinstance(options, dict) else None
+        broadcaster.unsubscribe(request.sid, None if store is None else int(store))
+
+    @socketio.on("disconnect")
+    def disconnect():
+        broadcaster.unsubscribe(request.sid)
+
     def setup_mock_stream():
         from apscheduler.schedulers.background import BackgroundScheduler
         import atexit
@@ -389,6 +1657,8 @@ def server(stores, config):
         scheduler.start()
         atexit.register(lambda: scheduler.shutdown)
 
+    app.broadcaster = broadcaster
+    app.writers = writers
     return app, socketio, setup_mock_stream
 
 
@@ -411,6 +1681,15 @@ if __name__ == "__main__":
         print(f"Initializing store {datadir} {dbfile} {dbtable}")
         stores.append(SQLiteStore(datadir, dbfile, dbtable, None))
 
+    if sys.argv[1:] == ["rebuild-rollups"]:
+        for store in stores:
+            store.rebuild_rollups()
+        sys.exit()
+    if sys.argv[1:2] == ["archive"]:
+        for store in stores:
+            store.archive_days(*[int(arg) for arg in sys.argv[2:3]])
+        sys.exit()
+
     if config.has_section("SERVER"):
         server_config = config["SERVER"]
         app, socketio, setup_mock_stream = server(stores, server_config)
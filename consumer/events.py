@@ -0,0 +1,170 @@
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../common"))
+from rolling import Rolling
+
+EVENT_PAGE = 50_000
+# Rows past a backfill chunk still being fetched may have gaps before them
+BACKFILLED_SQL = (
+    "coalesce((SELECT min(after_id) FROM backfill_chunks), 9223372036854775807)"
+)
+# So may rows past the sync watermark, pushed to /ingest ahead of catchup
+SYNCED_SQL = f"min(coalesce((SELECT after_id FROM sync_state), 0), {BACKFILLED_SQL})"
+
+
+class EventExtractor:
+    """Finds visits in a store's measurements, one page of new rows at a time.
+
+    Mirrors todf: zero readings are dropped, raw is median-filtered over 3
+    samples and calibrated with its row's config, and catlb is the 100-sample
+    rolling median of lb minus the 5000-sample one. A visit starts when catlb
+    enters (min_lb, max_lb) and ends once it has stayed outside for hold_off_s.
+
+    Rows are consumed in id order after a watermark, and only up to where
+    the store has every row. For a store that catches up from a provider,
+    that is the sync watermark, below which catchup has filled any gaps
+    that pushed rows left. The watermark, the tail of each rolling window
+    and any visit still in progress are saved in event_state in the same
+    transaction as the events they produced, so stopping between runs gives
+    the same events as one full replay.
+    """
+
+    def __init__(
+        self,
+        store,
+        name="visits",
+        min_lb=12,
+        max_lb=100,
+        hold_off_s=15,
+        baseline_window=5000,
+        recent_window=100,
+        page=EVENT_PAGE,
+    ):
+        self.store = store
+        self.name = name
+        self.min_lb = min_lb
+        self.max_lb = max_lb
+        self.hold_off_ms = hold_off_s * 1000
+        self.baseline_window = baseline_window
+        self.recent_window = recent_window
+        self.page = page
+
+    def load(self, cur):
+        row = cur.execute(
+            "SELECT after_id, state FROM event_state WHERE name = ?", (self.name,)
+        ).fetchone()
+        after_id, state = row if row is not None else (0, None)
+        state = json.loads(state) if state else {"raw": [], "lb": [], "event": None}
+        self.after_id = after_id
+        self.raw = Rolling(3)
+        self.baseline = Rolling(self.baseline_window)
+        self.recent = Rolling(self.recent_window)
+        for raw in state["raw"]:
+            self.raw.append(raw)
+        for lb in state["lb"]:
+            self.baseline.append(lb)
+            self.recent.append(lb)
+        self.event = state["event"]
+
+    def save(self, cur):
+        state = {
+            "raw": list(self.raw.data),
+            "lb": list(self.baseline.data),
+            "event": self.event,
+        }
+        cur.execute(
+            "INSERT OR REPLACE INTO event_state (name, after_id, state) VALUES (?, ?, ?)",
+            (self.name, self.after_id, json.dumps(state)),
+        )
+
+    def calibrations(self, cur):
+        """Map config id to (scale_factor, offset), as calibrate() resolves them."""
+        return {
+            id: (g_factor or self.store.scale_factor, raw_offset)
+            for id, g_factor, raw_offset in cur.execute(
+                "SELECT id, g_factor, raw_offset FROM configs"
+            )
+        }
+
+    def step(self, id, ts_ms, raw, scale_factor, offset):
+        """Feed one row; return a finished event or None."""
+        self.raw.append(raw)
+        if len(self.raw) < 3:
+            return None
+        lb = int((self.raw.median() - offset) / scale_factor) / 453.592
+        self.baseline.append(lb)
+        self.recent.append(lb)
+        if len(self.baseline) < self.baseline_window:
+            return None
+        catlb = self.recent.median() - self.baseline.median()
+        if self.min_lb < catlb < self.max_lb:
+            if self.event is None:
+                self.event = {
+                    "start_ms": ts_ms,
+                    "start_id": id,
+                    "peak_lb": catlb,
+                }
+            self.event["end_ms"] = ts_ms
+            self.event["end_id"] = id
+            self.event["peak_lb"] = max(self.event["peak_lb"], catlb)
+        elif self.event is not None and ts_ms - self.event["end_ms"] > self.hold_off_ms:
+            event, self.event = (self.event, None)
+            return event
+        return None
+
+    def run(self, limit=None):
+        """Process the rows after the watermark, at most `limit` of them if
+        given; return the events found."""
+        con = self.store.connection(timeout=20)
+        cur = con.cursor()
+        found = []
+        try:
+            self.load(cur)
+            configs = self.calibrations(cur)
+            default = (self.store.scale_factor, self.store.offset)
+            # Without a provider nothing would ever fill a gap
+            complete = SYNCED_SQL if self.store.host else BACKFILLED_SQL
+            while limit is None or limit > 0:
+                page = self.page if limit is None else min(self.page, limit)
+                rows = cur.execute(
+                    f"SELECT id, {self.store.ts_ms_col}, raw, config_id FROM {self.store.table}"
+                    f" WHERE id > ? AND raw != 0 AND id <= {complete} ORDER BY id LIMIT ?",
+                    (self.after_id, page),
+                ).fetchall()
+                if not rows:
+                    break
+                events = []
+                for id, ts_ms, raw, config_id in rows:
+                    scale_factor, offset = configs.get(config_id, default)
+                    if offset is None:
+                        offset = self.store.offset
+                    event = self.step(id, ts_ms, raw, scale_factor, offset)
+                    if event is not None:
+                        events.append(event)
+                self.after_id = rows[-1][0]
+                cur.executemany(
+                    "INSERT INTO events (start_ms, end_ms, duration_s, peak_lb, start_id, end_id)"
+                    " VALUES (:start_ms, :end_ms, (:end_ms - :start_ms) / 1000.0, :peak_lb, :start_id, :end_id)",
+                    events,
+                )
+                self.save(cur)
+                con.commit()
+                found += events
+                if limit is not None:
+                    limit -= len(rows)
+        finally:
+            con.close()
+        return found
+
+    def reset(self):
+        """Forget every event and the watermark, so the next run replays."""
+        con = self.store.connection(timeout=20)
+        try:
+            con.execute("DELETE FROM events")
+            con.execute("DELETE FROM event_state WHERE name = ?", (self.name,))
+            con.commit()
+        finally:
+            con.close()
@@ -0,0 +1,134 @@
+from concurrent.futures import Future
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../common"))
+from metrics import REGISTRY
+
+ROWS_INGESTED = REGISTRY.counter(
+    "pitl_rows_ingested_total", "Rows committed through /ingest", ["store"]
+)
+LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    "pitl_sqlite_lock_wait_seconds",
+    "Time BEGIN IMMEDIATE waited for the write lock",
+    ["store"],
+)
+COMMIT_SECONDS = REGISTRY.histogram(
+    "pitl_sqlite_commit_seconds", "Time to COMMIT a write transaction", ["store"]
+)
+
+
+def valid_batch(data):
+    """Whether data is a list of [id, ts, raw, config_id] rows with integer
+    ids and string timestamps, as insert_batch expects."""
+    return isinstance(data, list) and all(
+        isinstance(row, (list, tuple))
+        and len(row) == 4
+        and isinstance(row[0], int)
+        and isinstance(row[1], str)
+        for row in data
+    )
+
+
+class IngestWriter:
+    """Single writer for one store, fed by a bounded in-process queue.
+
+    Request threads call write(), which blocks until the batch is committed.
+    The writer thread drains whatever has queued up meanwhile, up to
+    max_rows, into one transaction; each batch gets its own savepoint so a
+    bad batch only fails its own request, whatever it raises. When
+    max_pending batches are already waiting, write() raises queue.Full after
+    put_timeout_s, and when its batch is not committed within
+    result_timeout_s it raises TimeoutError, so the caller can push back on
+    the client either way. A timed out batch may still be committed later;
+    rows are inserted by id, so the client can safely send it again.
+    """
+
+    def __init__(
+        self,
+        store,
+        max_pending=256,
+        max_rows=50_000,
+        put_timeout_s=5,
+        result_timeout_s=30,
+    ):
+        self.store = store
+        self.max_rows = max_rows
+        self.put_timeout_s = put_timeout_s
+        self.result_timeout_s = result_timeout_s
+        self.pending = queue.Queue(maxsize=max_pending)
+
+        self.transactions = 0
+        self.batches = 0
+        self.last_commit_s = None
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, data, client_ts=None, server_ts=None):
+        future = Future()
+        self.pending.put(
+            (data, client_ts, server_ts, future), timeout=self.put_timeout_s
+        )
+        return future.result(timeout=self.result_timeout_s)
+
+    def take(self):
+        """Block for one batch, then coalesce any that are already queued."""
+        batches = [self.pending.get()]
+        rows = len(batches[0][0])
+        while rows < self.max_rows:
+            try:
+                batch = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            batches.append(batch)
+            rows += len(batch[0])
+        return batches
+
+    def run(self):
+        con = self.store.connection(timeout=20)
+        # Transactions and savepoints are managed explicitly below
+        con.isolation_level = None
+        cur = con.cursor()
+        while True:
+            batches = self.take()
+            written = []
+            rows = 0
+            try:
+                start = time.monotonic()
+                cur.execute("BEGIN IMMEDIATE")
+                LOCK_WAIT_SECONDS.observe(
+                    time.monotonic() - start, store=self.store.file
+                )
+                for data, client_ts, server_ts, future in batches:
+                    cur.execute("SAVEPOINT batch")
+                    try:
+                        self.store.insert_batch(cur, data, client_ts, server_ts)
+                        self.store.advance_sync(cur, data)
+                    except Exception as e:
+                        cur.execute("ROLLBACK TO batch")
+                        future.set_exception(e)
+                    else:
+                        written.append(future)
+                        rows += len(data)
+                    cur.execute("RELEASE batch")
+                start = time.monotonic()
+                cur.execute("COMMIT")
+                self.last_commit_s = time.monotonic() - start
+                COMMIT_SECONDS.observe(self.last_commit_s, store=self.store.file)
+            except Exception as e:
+                print(f"WARNING: Ingest transaction for {self.store.file} failed: {e}")
+                if con.in_transaction:
+                    cur.execute("ROLLBACK")
+                for _, _, _, future in batches:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.transactions += 1
+            self.batches += len(written)
+            ROWS_INGESTED.inc(rows, store=self.store.file)
+            for future in written:
+                future.set_result(None)
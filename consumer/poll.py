@@ -1,5 +1,12 @@
-from consumer import SQLiteStore
-import sched, time
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../common"))
+import metrics
+from consumer import SQLiteStore, store_metrics
+from events import EventExtractor
+from scheduler import Scheduler
+from transcode import TranscodePool
 
 if __name__ == "__main__":
     stores = [
@@ -17,47 +24,60 @@ if __name__ == "__main__":
         ),
     ]
     period_s = 15
+    metrics_port = 9101
+    transcode_workers = 2
 
-    def sync(store_index, scheduler):
-        # schedule next
-        scheduler.enter(
-            period_s,
-            1,
-            sync,
-            (
-                store_index,
-                scheduler,
-            ),
-        )
-        # execute
-        store = stores[store_index]
-        try:
-            store.catchup()
-        except Exception as e:
-            print(f"ERROR: catchup encountered exception {e}")
+    def sync(store_index):
+        return stores[store_index].catchup
 
-    def sync_clips(store_index, path, fps, scheduler):
+    def sync_clips(store_index, path, fps):
         store = stores[store_index]
-        try:
-            store.catchup_files(f"{store.host}/clips", path, recursion_max=5, fps=fps)
-        except Exception as e:
-            print(f"ERROR: catchup_files encountered exception {e}")
+        return lambda: store.catchup_clips(f"{store.host}/clips", path, fps=fps)
 
-        scheduler.enter(
-            period_s,
-            1,
-            sync_clips,
-            (
-                store_index,
-                path,
-                fps,
-                scheduler,
-            ),
-        )
+    def extract_events(store_index):
+        return EventExtractor(stores[store_index]).run
 
-    s = sched.scheduler(time.time, time.sleep)
-    sync(0, s)
-    sync(1, s)
-    sync_clips(0, "/Users/casey/data/cats/clips", 3, s)
-    sync_clips(1, "/Users/casey/data/cats/clips2", 30, s)
-    s.run()
+    scheduler = Scheduler()
+    scheduler.add("sync 0", sync(0), period_s, timeout_s=120)
+    scheduler.add("sync 1", sync(1), period_s, timeout_s=120)
+    scheduler.add(
+        "sync_clips 0",
+        sync_clips(0, "/Users/casey/data/cats/clips", 3),
+        period_s,
+        timeout_s=600,
+    )
+    scheduler.add(
+        "sync_clips 1",
+        sync_clips(1, "/Users/casey/data/cats/clips2", 30),
+        period_s,
+        timeout_s=600,
+    )
+    scheduler.add("events 0", extract_events(0), 60, timeout_s=600)
+    scheduler.add("events 1", extract_events(1), 60, timeout_s=600)
+    scheduler.add("archive 0", stores[0].archive_days, 24 * 3600, timeout_s=3600)
+    scheduler.add("archive 1", stores[1].archive_days, 24 * 3600, timeout_s=3600)
+    store_metrics(stores)
+    metrics.REGISTRY.gauge(
+        "pitl_job_last_duration_seconds",
+        "Duration of each scheduled job's last run",
+        ["job"],
+        fn=lambda: {
+            (name,): stats["last_duration_s"] or 0
+            for name, stats in scheduler.stats().items()
+        },
+    )
+    metrics.REGISTRY.gauge(
+        "pitl_job_failures",
+        "Consecutive failed runs of each scheduled job",
+        ["job"],
+        fn=lambda: {
+            (name,): stats["failures"] for name, stats in scheduler.stats().items()
+        },
+    )
+    metrics.serve(metrics_port)
+    transcodes = TranscodePool(stores, workers=transcode_workers).start()
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop(wait=False)
+        transcodes.stop()
@@ -0,0 +1,141 @@
+from concurrent.futures import ThreadPoolExecutor
+from heapq import heappop, heappush
+import itertools
+import random
+import threading
+import time
+
+
+class Job:
+    def __init__(
+        self, name, fn, period_s, timeout_s=None, jitter=0.1, max_backoff_s=None
+    ):
+        self.name = name
+        self.fn = fn
+        self.period_s = period_s
+        self.timeout_s = timeout_s
+        self.jitter = jitter
+        self.max_backoff_s = (
+            max_backoff_s if max_backoff_s is not None else period_s * 16
+        )
+
+        self.running = False
+        self.started = None
+        self.timed_out = False
+        self.failures = 0
+        self.runs = 0
+        self.last_run = None
+        self.last_duration = None
+        self.next_run = None
+
+    def delay(self):
+        """Seconds until the next run: the jittered period, stretched
+        exponentially after consecutive failures."""
+        delay = self.period_s * random.uniform(1 - self.jitter, 1 + self.jitter)
+        if self.failures:
+            delay = min(delay * 2**self.failures, self.max_backoff_s)
+        return delay
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_run": self.last_run,
+            "last_duration_s": self.last_duration,
+            "next_run": self.next_run,
+        }
+
+
+class Scheduler:
+    """Runs periodic jobs concurrently on a thread pool.
+
+    A job is only rescheduled once its previous run has finished, so runs of
+    the same job never overlap, while a slow job never delays the others. A
+    run exceeding its timeout is counted as a failure straight away; Python
+    threads cannot be cancelled, so the next run still waits for it to end.
+    """
+
+    def __init__(self, workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.jobs = {}
+        self.queue = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.stopped = False
+
+    def add(self, name, fn, period_s, **job_args):
+        job = Job(name, fn, period_s, **job_args)
+        with self.cond:
+            self.jobs[name] = job
+            self.schedule(job, 0)
+        return job
+
+    def schedule(self, job, delay):
+        job.next_run = time.time() + delay
+        heappush(self.queue, (time.monotonic() + delay, next(self.seq), job))
+        self.cond.notify()
+
+    def run(self):
+        with self.cond:
+            while not self.stopped:
+                self.check_timeouts()
+                now = time.monotonic()
+                if self.queue and self.queue[0][0] <= now:
+                    _, _, job = heappop(self.queue)
+                    self.submit(job)
+                    continue
+                self.cond.wait(self.wait_time(now))
+
+    def wait_time(self, now):
+        deadlines = [due for due, _, _ in self.queue[:1]]
+        deadlines += [
+            job.started + job.timeout_s
+            for job in self.jobs.values()
+            if job.running and not job.timed_out and job.timeout_s is not None
+        ]
+        return max(0, min(deadlines) - now) if deadlines else None
+
+    def check_timeouts(self):
+        now = time.monotonic()
+        for job in self.jobs.values():
+            if job.running and not job.timed_out and job.timeout_s is not None:
+                if now - job.started > job.timeout_s:
+                    job.timed_out = True
+                    job.failures += 1
+                    print(f"ERROR: {job.name} exceeded timeout of {job.timeout_s}s")
+
+    def submit(self, job):
+        job.running = True
+        job.timed_out = False
+        job.started = time.monotonic()
+        job.last_run = time.time()
+        job.next_run = None
+        future = self.executor.submit(job.fn)
+        future.add_done_callback(lambda f: self.finished(job, f))
+
+    def finished(self, job, future):
+        with self.cond:
+            job.running = False
+            job.runs += 1
+            job.last_duration = time.monotonic() - job.started
+            try:
+                future.result()
+                if not job.timed_out:
+                    job.failures = 0
+            except Exception as e:
+                if not job.timed_out:
+                    job.failures += 1
+                print(f"ERROR: {job.name} encountered exception {e}")
+            if not self.stopped:
+                self.schedule(job, job.delay())
+
+    def stop(self, wait=True):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.executor.shutdown(wait=wait)
+
+    def stats(self):
+        with self.cond:
+            return {name: job.stats() for name, job in self.jobs.items()}
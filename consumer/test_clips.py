@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+
+import pytest
+from flask import Flask, request, send_file
+from werkzeug.serving import make_server
+
+from consumer import SQLiteStore
+
+CLIPS = {f"visit-{i:05d}.h264": os.urandom(100_000 + i) for i in range(4)}
+
+
+@pytest.fixture
+def provider(tmp_path):
+    """Serve CLIPS like the provider's /clips routes; yield the clips URL
+    and a dict of bodies to send instead of a clip's real bytes."""
+    clipdir = tmp_path / "provider"
+    clipdir.mkdir()
+    for name, body in CLIPS.items():
+        (clipdir / name).write_bytes(body)
+    short = {}
+    app = Flask(__name__)
+
+    @app.route("/clips/manifest")
+    def manifest():
+        after = request.args.get("from", "")
+        limit = int(request.args.get("limit", 100))
+        names = [name for name in sorted(CLIPS) if name > after][:limit]
+        return json.dumps([{"name": n, "size": len(CLIPS[n])} for n in names])
+
+    @app.route("/clips/<name>")
+    def clip(name):
+        if name in short:
+            return short[name]
+        return send_file(clipdir / name, as_attachment=True)
+
+    http = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{http.server_port}/clips", short
+    http.shutdown()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStore(str(tmp_path), "clips.db", "measurements", None)
+
+
+def local(dirpath):
+    return {name: (dirpath / name).read_bytes() for name in os.listdir(dirpath)}
+
+
+def test_truncated_clips_are_fetched_again(provider, store, tmp_path):
+    host, _ = provider
+    dirpath = tmp_path / "clips"
+    dirpath.mkdir()
+    first, partial, truncated, _ = sorted(CLIPS)
+    (dirpath / first).write_bytes(CLIPS[first])
+    (dirpath / truncated).write_bytes(CLIPS[truncated][:1000])
+    (dirpath / f"{partial}.part").write_bytes(CLIPS[partial][:5000])
+
+    store.catchup_clips(host, str(dirpath), limit=2)
+
+    assert local(dirpath) == CLIPS
+    (queued,) = store.con.execute("SELECT count(*) FROM transcodes").fetchone()
+    assert queued == len(CLIPS) - 1
+
+
+def test_short_download_is_not_taken_as_done(provider, store, tmp_path):
+    host, short = provider
+    dirpath = tmp_path / "clips"
+    dirpath.mkdir()
+    name = sorted(CLIPS)[1]
+    short[name] = CLIPS[name][:1000]
+
+    store.catchup_clips(host, str(dirpath))
+    assert name not in local(dirpath)
+    assert local(dirpath)[f"{name}.part"] == CLIPS[name][:1000]
+
+    del short[name]
+    store.catchup_clips(host, str(dirpath))
+    assert local(dirpath) == CLIPS
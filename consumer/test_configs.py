@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from bench import generate, serve_provider
+from consumer import SQLiteStore
+
+ROWS = 20_000
+SYNCED = [
+    "SELECT * FROM configs ORDER BY id",
+    "SELECT * FROM rollup_minute ORDER BY bucket",
+    "SELECT * FROM rollup_hour ORDER BY bucket",
+]
+
+
+@pytest.fixture(scope="module")
+def provider(tmp_path_factory):
+    """Serve a synthetic provider DB with two configs; yield its URL and
+    the source store."""
+    datadir = str(tmp_path_factory.mktemp("provider"))
+    source = generate(os.path.join(datadir, "weights.db"), ROWS, hz=7)
+    host, http = serve_provider(datadir)
+    yield host, source
+    http.shutdown()
+
+
+def dump(store):
+    return [store.con.execute(query).fetchall() for query in SYNCED]
+
+
+def test_catchup_syncs_configs_before_rows(provider, tmp_path):
+    host, source = provider
+    store = SQLiteStore(str(tmp_path), "consumer.db", "measurements", host)
+    store.catchup()
+    assert dump(store) == dump(source)
+
+
+def test_configs_arriving_late_recalibrate_rollups(provider, tmp_path):
+    host, source = provider
+    store = SQLiteStore(str(tmp_path), "consumer.db", "measurements", None)
+    # Pushed rows can arrive before the configs they refer to
+    store.writeall(
+        source.con.execute("SELECT id, ts, raw, config_id FROM measurements").fetchall()
+    )
+    # and leave catchup no rows to fetch, only the configs
+    store.con.execute("UPDATE sync_state SET after_id = ?", (ROWS,))
+    store.con.commit()
+    assert dump(store) != dump(source)
+    store.host = host
+    store.catchup()
+    assert dump(store) == dump(source)
@@ -0,0 +1,90 @@
+import configparser
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from consumer import SQLiteStore, server
+
+CLIENTS = 8
+BATCHES = 25
+ROWS = 20
+
+
+@pytest.fixture
+def app(tmp_path):
+    """The consumer's app over one empty store; yield it and the store."""
+    store = SQLiteStore(str(tmp_path), "ingest.db", "measurements", None)
+    config = configparser.ConfigParser()
+    config["SERVER"] = {"debug": "false"}
+    app, _, _ = server([store], config["SERVER"])
+    yield app, store
+    app.broadcaster.stop()
+
+
+def batch(first, rows=ROWS):
+    start = datetime(2024, 1, 1)
+    return {
+        "batch_time": str(start),
+        "data": [
+            [i, str(start + timedelta(seconds=i / 10)), -35800 + i % 100, 1]
+            for i in range(first, first + rows)
+        ],
+    }
+
+
+def count(store):
+    return store.con.execute(
+        "SELECT count(*), count(DISTINCT id) FROM measurements"
+    ).fetchone()
+
+
+def test_concurrent_posts_write_every_row_once(app):
+    app, store = app
+
+    def client(i):
+        statuses = []
+        http = app.test_client()
+        for b in range(BATCHES):
+            payload = batch((i * BATCHES + b) * ROWS + 1)
+            statuses.append(http.post("/ingest/0", json=payload).status_code)
+            # A resent batch must not be written twice
+            if b % 5 == 0:
+                statuses.append(http.post("/ingest/0", json=payload).status_code)
+        return statuses
+
+    with ThreadPoolExecutor(CLIENTS) as pool:
+        statuses = [s for result in pool.map(client, range(CLIENTS)) for s in result]
+
+    assert set(statuses) == {200}
+    total = CLIENTS * BATCHES * ROWS
+    assert count(store) == (total, total)
+    low, high = store.con.execute(
+        "SELECT min(id), max(id) FROM measurements"
+    ).fetchone()
+    assert (low, high) == (1, total)
+
+
+def test_uncommitted_batch_answers_503(app):
+    app, store = app
+    app.writers[0].result_timeout_s = 0.2
+    http = app.test_client()
+
+    # Holding the write lock stalls the writer at BEGIN IMMEDIATE
+    lock = sqlite3.connect(os.path.join(store.datadir, store.file))
+    lock.execute("BEGIN IMMEDIATE")
+    response = http.post("/ingest/0", json=batch(1))
+    assert response.status_code == 503
+    lock.rollback()
+    lock.close()
+
+    # The timed out batch is still committed, and sending it again is safe
+    deadline = time.monotonic() + 5
+    while count(store) != (ROWS, ROWS) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert count(store) == (ROWS, ROWS)
+    assert http.post("/ingest/0", json=batch(1)).status_code == 200
+    assert count(store) == (ROWS, ROWS)
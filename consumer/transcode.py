@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../common"))
+from metrics import DURATION_BUCKETS, REGISTRY
+
+TRANSCODE_SECONDS = REGISTRY.histogram(
+    "pitl_transcode_seconds",
+    "Time to transcode one clip, by outcome",
+    ["store", "status"],
+    DURATION_BUCKETS,
+)
+
+
+class TranscodePool:
+    """Drains the stores' transcode queues with a bounded set of workers.
+
+    Each worker runs one ffmpeg process at a time, so `workers` caps how many
+    conversions compete for CPU across all stores. Jobs live in each store's
+    transcodes table: they survive restarts, and clips whose .mp4 already
+    exists are marked done without converting again.
+    """
+
+    def __init__(self, stores, workers=1, idle_s=5):
+        self.stores = stores
+        self.workers = workers
+        self.idle_s = idle_s
+        self.wake = threading.Event()
+        self.stopped = False
+        self.threads = []
+
+    def start(self):
+        for store in self.stores:
+            store.requeue_transcodes()
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self.work, name=f"transcode {i}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def claim(self):
+        for store in self.stores:
+            job = store.claim_transcode()
+            if job is not None:
+                return store, job
+        return None, None
+
+    def work(self):
+        while not self.stopped:
+            store, job = self.claim()
+            if job is None:
+                self.wake.wait(self.idle_s)
+                self.wake.clear()
+                continue
+            self.run(store, *job)
+
+    def run(self, store, job_id, path, fps):
+        if os.path.exists(path.replace(".h264", ".mp4")):
+            print(f"Transcode: {path} already converted")
+            store.finish_transcode(job_id, "done", duration_s=0)
+            return
+        start = time.monotonic()
+        try:
+            store.convert_file(path, fps)
+        except (OSError, subprocess.CalledProcessError) as e:
+            duration = time.monotonic() - start
+            print(f"ERROR: Transcode of {path} failed after {duration:.1f}s: {e}")
+            TRANSCODE_SECONDS.observe(duration, store=store.file, status="failed")
+            store.finish_transcode(job_id, "failed", duration_s=duration, error=str(e))
+            return
+        duration = time.monotonic() - start
+        TRANSCODE_SECONDS.observe(duration, store=store.file, status="done")
+        store.finish_transcode(job_id, "done", duration_s=duration)
+        print(f"Transcode: {path} in {duration:.1f}s, {self.depth()} queued")
+
+    def depth(self):
+        return sum(store.transcode_depth() for store in self.stores)
+
+    def stop(self):
+        self.stopped = True
+        self.wake.set()
+        for thread in self.threads:
+            thread.join()
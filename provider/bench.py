@@ -0,0 +1,217 @@
+"""Benchmarks for provider hot paths on synthetic data.
+
+python bench.py
+python bench.py suite ROWS OUT.json    (see benchmarks/run.py)
+"""
+
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+import numpy as np
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp())
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../common"))
+import wire
+from clips import ClipIndex, walk
+from provider import SQLiteStore, epoch_ms
+
+
+def generate_db(path, rows, start=datetime(2024, 1, 1), hz=10, chunk=1_000_000):
+    """Write a sensor-schema measurements DB of `rows` samples at `hz`,
+    `chunk` rows per transaction."""
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute(
+        "CREATE TABLE measurements (id INTEGER PRIMARY KEY AUTOINCREMENT, ts, raw, config_id, ts_ms INTEGER)"
+    )
+    con.execute(
+        "CREATE INDEX measurements_ts_ms ON measurements (ts_ms) WHERE ts_ms IS NOT NULL"
+    )
+    start_us = (start - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+    for first in range(0, rows, chunk):
+        i = np.arange(first, min(rows, first + chunk))
+        ts_us = start_us + i * (1_000_000 // hz)
+        con.executemany(
+            "INSERT INTO measurements (ts, raw, config_id, ts_ms) VALUES (?, ?, 1, ?)",
+            zip(
+                wire.timestamps(ts_us).tolist(),
+                (-35800 + i % 100).tolist(),
+                ((ts_us + 500) // 1000).tolist(),
+            ),
+        )
+        con.commit()
+    return con
+
+
+def generate_clips(root, count, start=datetime(2024, 1, 1), days=None):
+    """Create `count` empty clips named like camera.gen_filename(), spread
+    over per-day subdirectories when `days` is given."""
+    for i in range(count):
+        ts = start + timedelta(minutes=i)
+        dirpath = os.path.join(root, ts.strftime("%Y-%m-%d")) if days else root
+        os.makedirs(dirpath, exist_ok=True)
+        open(
+            os.path.join(dirpath, f"{ts.strftime('%Y-%m-%dT%H%M%S')}.h264"), "w"
+        ).close()
+    return root
+
+
+def lookup_walk(root, from_name):
+    """The directory walk, sort and linear scan get_file used to do."""
+    sorted_files = sorted(walk(root), key=lambda t: t[1])
+    from_index = len(sorted_files)
+    for i in range(len(sorted_files)):
+        if sorted_files[i][1] > from_name:
+            from_index = i
+            break
+    sorted_files = sorted_files[from_index:]
+    return os.path.join(*sorted_files[0]) if sorted_files else None
+
+
+def bench_clips(count, lookups=200):
+    root = generate_clips(tempfile.mkdtemp(), count, days=True)
+    names = sorted(name for _, name in walk(root))
+    targets = [names[i * len(names) // lookups] for i in range(lookups)]
+
+    start = time.perf_counter()
+    index = ClipIndex(root).start()
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for name in targets[:10]:
+        lookup_walk(root, name)
+    walked = (time.perf_counter() - start) / 10
+
+    start = time.perf_counter()
+    for name in targets:
+        index.after(name)
+    indexed = (time.perf_counter() - start) / lookups
+    assert index.after(targets[0])[0] == lookup_walk(root, targets[0])
+    index.stop()
+
+    print(
+        f"/clips lookup {count:>9,} clips: walk {walked * 1000:9.2f}ms,"
+        f" index {indexed * 1_000_000:7.2f}us (built in {build:.2f}s)"
+    )
+
+
+def get_connect_per_request(store, from_ts, limit):
+    """The connect-per-call, string-built query get() used to run."""
+    con = sqlite3.connect(store.pool.path, check_same_thread=False)
+    query = f"SELECT {store.columns} FROM {store.table} WHERE ts_ms > ? ORDER BY ts_ms LIMIT {int(limit)};"
+    data = con.execute(query, [epoch_ms(from_ts)]).fetchall()
+    con.close()
+    return data
+
+
+def get_pooled(store, from_ts, limit):
+    return store.get(from_ts=from_ts, limit=limit)
+
+
+def bench_get(rows=1_000_000, clients=8, polls=200, limit=100):
+    path = os.path.join(tempfile.mkdtemp(), "weights.db")
+    writer = generate_db(path, rows)
+    store = SQLiteStore(os.path.dirname(path), os.path.basename(path), "measurements")
+    # Consumers polling near the head of the table, as catchup does
+    (latest,) = writer.execute("SELECT max(ts) FROM measurements").fetchone()
+    from_ts = datetime.fromisoformat(latest) - timedelta(seconds=limit / 10)
+
+    def run(get):
+        latencies = []
+
+        def client():
+            for _ in range(polls):
+                start = time.perf_counter()
+                get(store, from_ts, limit)
+                latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latencies.sort()
+        return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+    for name, get in [
+        ("connect per request", get_connect_per_request),
+        ("pooled read-only", get_pooled),
+    ]:
+        p50, p99 = run(get)
+        print(
+            f"get() {clients} clients, {rows:,} rows, {name:>20}:"
+            f" p50 {p50 * 1000:6.2f}ms, p99 {p99 * 1000:6.2f}ms"
+        )
+
+
+def median_time(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def suite(rows, clip_count=10_000, repeat=50):
+    """Time the provider's endpoints on `rows` measurements and `clip_count`
+    clips under DATA_DIR; return {metric: seconds}, lower being better."""
+    import provider
+
+    generate_db(os.path.join(provider.datadir, provider.file), rows).close()
+    generate_clips(provider.clipdir, clip_count, days=True)
+    provider.clips.start()
+    client = provider.app.test_client()
+    latest = datetime(2024, 1, 1) + timedelta(seconds=rows / 10)
+    names = sorted(name for _, name in walk(provider.clipdir))
+    middle = names[len(names) // 2]
+
+    def get(*args, **kwargs):
+        response = client.get(*args, **kwargs)
+        assert response.status_code == 200, response.status_code
+        response.get_data()
+
+    requests = {
+        "provider.get_data_head_100": lambda: get(
+            "/", query_string={"from_ts": str(latest - timedelta(seconds=10))}
+        ),
+        "provider.get_data_page_10k_ndjson": lambda: get(
+            "/", query_string={"after_id": max(0, rows - 10_000)}
+        ),
+        "provider.get_data_page_10k_columnar": lambda: get(
+            "/",
+            query_string={"after_id": max(0, rows - 10_000), "compress": "zlib"},
+            headers={"Accept": wire.MIMETYPE},
+        ),
+        "provider.clips_after": lambda: get("/clips", query_string={"from": middle}),
+        "provider.clips_manifest_100": lambda: get(
+            "/clips/manifest", query_string={"from": middle}
+        ),
+    }
+    results = {}
+    # The routes print on every request
+    with redirect_stdout(io.StringIO()):
+        for name, request in requests.items():
+            results[name] = median_time(request, repeat)
+    provider.clips.stop()
+    return results
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["suite"]:
+        with open(sys.argv[3], "w") as f:
+            json.dump(suite(int(sys.argv[2])), f, indent=1)
+        sys.exit()
+
+    for count in [1_000, 10_000, 100_000]:
+        bench_clips(count)
+    bench_get()
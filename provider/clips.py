@@ -0,0 +1,138 @@
+from bisect import bisect_left, bisect_right
+import os
+import threading
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+# Segmented recordings keep an index beside their segments (see
+# camera/segments.py); it is not a clip, and segments are served as clips
+INDEX_SUFFIX = ".index.json"
+
+
+def walk(path):
+    for dirpath, dirs, filenames in os.walk(path):
+        for f in filenames:
+            yield dirpath, f
+
+
+class ClipIndex(FileSystemEventHandler):
+    """Clip filenames under a directory, kept sorted by name.
+
+    The tree is walked once on start(); after that a watchdog observer
+    applies creates, moves and deletes incrementally, so lookups never touch
+    the filesystem. Recording indexes are skipped.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.names = []
+        self.dirpaths = []
+        self.lock = threading.Lock()
+        self.observer = None
+
+    def start(self):
+        self.rebuild()
+        if os.path.isdir(self.root):
+            self.observer = Observer()
+            self.observer.schedule(self, self.root, recursive=True)
+            self.observer.start()
+        return self
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+    def rebuild(self):
+        entries = sorted(walk(self.root), key=lambda t: t[1])
+        entries = [e for e in entries if not e[1].endswith(INDEX_SUFFIX)]
+        with self.lock:
+            self.names = [name for _, name in entries]
+            self.dirpaths = [dirpath for dirpath, _ in entries]
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, path):
+        dirpath, name = os.path.split(path)
+        if name.endswith(INDEX_SUFFIX):
+            return
+        with self.lock:
+            i = bisect_left(self.names, name)
+            while i < len(self.names) and self.names[i] == name:
+                if self.dirpaths[i] == dirpath:
+                    return
+                i += 1
+            self.names.insert(i, name)
+            self.dirpaths.insert(i, dirpath)
+
+    def remove(self, path):
+        dirpath, name = os.path.split(path)
+        if name.endswith(INDEX_SUFFIX):
+            return
+        with self.lock:
+            i = bisect_left(self.names, name)
+            while i < len(self.names) and self.names[i] == name:
+                if self.dirpaths[i] == dirpath:
+                    del self.names[i]
+                    del self.dirpaths[i]
+                    return
+                i += 1
+
+    def after(self, from_name=None):
+        """Return (path, remaining) for the first clip named after from_name,
+        where remaining counts it and every later clip, or (None, 0)."""
+        with self.lock:
+            i = bisect_right(self.names, from_name) if from_name else 0
+            if i == len(self.names):
+                return None, 0
+            return os.path.join(self.dirpaths[i], self.names[i]), len(self.names) - i
+
+    def find(self, name):
+        """Return the path of the clip called name, or None."""
+        with self.lock:
+            i = bisect_left(self.names, name)
+            if i < len(self.names) and self.names[i] == name:
+                return os.path.join(self.dirpaths[i], name)
+        return None
+
+    def manifest(self, from_name=None, limit=None):
+        """List name and size of the clips named after from_name, oldest first."""
+        with self.lock:
+            i = bisect_right(self.names, from_name) if from_name else 0
+            j = len(self.names) if limit is None else i + limit
+            entries = list(zip(self.names[i:j], self.dirpaths[i:j]))
+        manifest = []
+        for name, dirpath in entries:
+            try:
+                size = os.path.getsize(os.path.join(dirpath, name))
+            except FileNotFoundError:
+                continue
+            manifest.append({"name": name, "size": size})
+        return manifest
+
+    # Directory events can carry a whole subtree we were not told about
+    # file by file, so they fall back to a full rebuild.
+
+    def on_created(self, event):
+        if event.is_directory:
+            self.rebuild()
+        else:
+            self.add(event.src_path)
+
+    def on_deleted(self, event):
+        if event.is_directory:
+            self.rebuild()
+        else:
+            self.remove(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self.rebuild()
+            return
+        self.remove(event.src_path)
+        if os.path.commonpath([self.root, event.dest_path]) == os.path.normpath(
+            self.root
+        ):
+            self.add(event.dest_path)
@@ -1,15 +1,37 @@
 from abc import abstractmethod
 import sqlite3
 import os
-from flask import Flask, request, send_file
+import sys
+from flask import Flask, Response, request, send_file, stream_with_context
 from datetime import datetime, timedelta
 import json
+import queue
+from contextlib import contextmanager
+
+from clips import ClipIndex
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../common"))
+import wire
+from metrics import REGISTRY, instrument
 
 datadir = os.environ.get("DATA_DIR", "/home/casey/data/")
 file = "weights.db"
 table = "measurements"
 clipdir = os.path.join(datadir, "clips")
 
+EPOCH = datetime(1970, 1, 1)
+MAX_ID = 2**63 - 1
+
+
+def epoch_ms(ts):
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    # Round seconds the same way SQLite's julianday() does so ts_ms values
+    # computed here and in TS_MS_SQL agree to the millisecond.
+    minute = ts.replace(second=0, microsecond=0)
+    seconds = ts.second + ts.microsecond / 1_000_000
+    return (minute - EPOCH) // timedelta(milliseconds=1) + int(seconds * 1000 + 0.5)
+
 
 class Provider:
     @abstractmethod
@@ -17,33 +39,139 @@ class Provider:
         pass
 
 
+class ConnectionPool:
+    """Idle read-only connections to one DB, reused across requests.
+
+    Connections are opened in URI read-only mode with the given pragmas, so
+    with the sensor writing in WAL mode a reader never blocks it. At most
+    `size` idle connections are kept; extras are closed on release.
+    """
+
+    def __init__(self, path, size=8, mmap_size=256 << 20, cache_kib=16_384):
+        self.path = path
+        self.size = size
+        self.mmap_size = mmap_size
+        self.cache_kib = cache_kib
+        self.idle = queue.LifoQueue()
+
+    def connect(self):
+        con = sqlite3.connect(
+            f"file:{self.path}?mode=ro", uri=True, check_same_thread=False
+        )
+        con.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        con.execute(f"PRAGMA cache_size = -{int(self.cache_kib)}")
+        return con
+
+    @contextmanager
+    def connection(self):
+        try:
+            con = self.idle.get_nowait()
+        except queue.Empty:
+            con = self.connect()
+        try:
+            yield con
+        finally:
+            if self.idle.qsize() < self.size:
+                self.idle.put(con)
+            else:
+                con.close()
+
+
 class SQLiteStore(Provider):
     def __init__(self, datadir, file, table):
         self.table = table
         self.ts_col = "ts"
+        self.ts_ms_col = "ts_ms"
+        self.columns = "id, ts, raw, config_id"
+        self.pool = ConnectionPool(os.path.join(datadir, file))
+
+        # Fixed, fully parameterized statements, so sqlite3's per-connection
+        # statement cache prepares each of them once per pooled connection
+        self.queries = {}
+        for has_from in (False, True):
+            for has_to in (False, True):
+                conditions = []
+                if has_from:
+                    conditions.append(f"{self.ts_ms_col} > ?")
+                if has_to:
+                    conditions.append(f"{self.ts_ms_col} <= ?")
+                conditions_str = (
+                    f" WHERE {' AND '.join(conditions)}" if len(conditions) else ""
+                )
+                order_str = f" ORDER BY {self.ts_ms_col}" if len(conditions) else ""
+                self.queries[(has_from, has_to)] = (
+                    f"SELECT {self.columns} FROM {self.table}{conditions_str}{order_str} LIMIT ?;"
+                )
+        self.page_query = f"SELECT {self.columns} FROM {self.table} WHERE id > ? AND id <= ? ORDER BY id LIMIT ?;"
+        self.range_query = f"SELECT min(id), max(id) FROM {self.table};"
 
     def get(self, from_ts=None, to_ts=None, limit=None):
-        con = sqlite3.connect(os.path.join(datadir, file), check_same_thread=False)
-        cur = con.cursor()
-        conditions = []
         conditions_data = []
         if from_ts is not None:
-            conditions.append(f"ts > ?")
-            conditions_data.append(from_ts)
+            conditions_data.append(epoch_ms(from_ts))
         if to_ts is not None:
-            conditions.append(f"ts <= {to_ts}")
-            conditions_data.append(to_ts)
-        limit_str = f" LIMIT {limit}" if limit is not None else ""
-        conditions_str = f" WHERE {' AND '.join(conditions)}" if len(conditions) else ""
-        query = f"SELECT * FROM {self.table}{conditions_str}{limit_str};"
-        data = cur.execute(query, conditions_data).fetchall()
-        con.close()
-        return data
+            conditions_data.append(epoch_ms(to_ts))
+        # A negative LIMIT means no limit
+        conditions_data.append(-1 if limit is None else limit)
+        query = self.queries[(from_ts is not None, to_ts is not None)]
+        with self.pool.connection() as con:
+            return con.execute(query, conditions_data).fetchall()
+
+    def id_range(self):
+        """Return the smallest and largest id, or (None, None) when empty."""
+        with self.pool.connection() as con:
+            return con.execute(self.range_query).fetchone()
+
+    def newest_ms(self):
+        with self.pool.connection() as con:
+            (newest,) = con.execute(
+                # The condition lets max() use the partial ts_ms index
+                f"SELECT max({self.ts_ms_col}) FROM {self.table} WHERE {self.ts_ms_col} IS NOT NULL"
+            ).fetchone()
+        return newest
+
+    def configs(self):
+        """Every calibration config, oldest first."""
+        with self.pool.connection() as con:
+            return con.execute(
+                "SELECT id, created_at, g_factor, raw_offset FROM configs ORDER BY id"
+            ).fetchall()
+
+    def page(self, after_id=0, limit=None, to_id=None):
+        """Yield rows with after_id < id <= to_id in id order, straight off
+        the cursor."""
+        with self.pool.connection() as con:
+            cur = con.execute(
+                self.page_query,
+                (
+                    after_id,
+                    MAX_ID if to_id is None else to_id,
+                    -1 if limit is None else limit,
+                ),
+            )
+            try:
+                yield from cur
+            finally:
+                cur.close()
 
 
 app = Flask(__name__)
+instrument(app)
 
 provider = SQLiteStore(datadir, file, table)
+clips = ClipIndex(clipdir).start()
+
+ROWS_SERVED = REGISTRY.counter(
+    "pitl_rows_served_total", "Measurement rows sent to consumers", ["format"]
+)
+REGISTRY.gauge(
+    "pitl_clips_indexed", "Clips available for download", fn=lambda: len(clips)
+)
+REGISTRY.gauge(
+    "pitl_newest_measurement_timestamp_seconds",
+    "ts of the newest measurement, as naive wall-clock epoch seconds",
+    fn=lambda: (provider.newest_ms() or 0) / 1000,
+)
 
 
 @app.route("/")
@@ -59,7 +187,9 @@ def get_data():
         return "Invalid from_ts: Expected YYYY-MM-DD HH:MM:SS+", 400
 
     try:
-        to_ts = request.args.get("to_ts")
+        to_str = request.args.get("to_ts")
+        if to_str is not None:
+            to_ts = datetime.fromisoformat(to_str)
     except ValueError:
         return "Invalid to_ts: Expected YYYY-MM-DD HH:MM:SS+", 400
 
@@ -70,40 +200,104 @@ def get_data():
     except ValueError:
         return "Invalid limit: expected integer", 400
 
+    try:
+        after_str = request.args.get("after_id")
+        to_str = request.args.get("to_id")
+        if after_str is not None:
+            return stream_page(
+                int(after_str), limit, None if to_str is None else int(to_str)
+            )
+    except ValueError:
+        return "Invalid after_id or to_id: expected integer", 400
+
     print(f"from_ts {from_ts}, to_ts {to_ts}, limit {limit}")
 
-    return json.dumps(provider.get(from_ts=from_ts, to_ts=to_ts, limit=limit))
+    data = provider.get(from_ts=from_ts, to_ts=to_ts, limit=limit)
+    if wants_columnar():
+        ROWS_SERVED.inc(len(data), format="columnar")
+        return columnar(data)
+    ROWS_SERVED.inc(len(data), format="json")
+    return json.dumps(data)
 
 
-def walk(path):
-    for dirpath, dirs, filenames in os.walk(path):
-        for f in filenames:
-            yield dirpath, f
+def wants_columnar():
+    return request.accept_mimetypes.best == wire.MIMETYPE
+
+
+def columnar(rows, next=None):
+    compress = request.args.get("compress") == "zlib"
+    return Response(
+        wire.encode(rows, next=next, compress=compress), mimetype=wire.MIMETYPE
+    )
+
+
+def stream_page(after_id, limit, to_id=None):
+    """Stream one keyset page as NDJSON: one row per line, then a trailer line
+    {"next": <after_id for the next page, or null once caught up>}. Pages
+    stop at to_id when given."""
+    print(f"after_id {after_id}, to_id {to_id}, limit {limit}")
+
+    if wants_columnar():
+        rows = list(provider.page(after_id=after_id, limit=limit, to_id=to_id))
+        ROWS_SERVED.inc(len(rows), format="columnar")
+        return columnar(rows, next=rows[-1][0] if rows and len(rows) == limit else None)
+
+    def generate():
+        rows = 0
+        last_id = after_id
+        for row in provider.page(after_id=after_id, limit=limit, to_id=to_id):
+            rows += 1
+            last_id = row[0]
+            yield json.dumps(row) + "\n"
+        ROWS_SERVED.inc(rows, format="ndjson")
+        yield json.dumps({"next": last_id if rows and rows == limit else None}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@app.route("/range")
+def get_range():
+    """The id range a consumer can page through, for planning a backfill."""
+    min_id, max_id = provider.id_range()
+    return json.dumps({"min_id": min_id, "max_id": max_id})
+
+
+@app.route("/configs")
+def get_configs():
+    """The calibration configs rows refer to by config_id."""
+    return json.dumps(provider.configs())
 
 
 @app.route("/clips")
 def get_file():
     from_name = request.args.get("from")
 
-    # filename = (dirpath, filename)
-    filenames = list(walk(clipdir))
+    filepath, remaining = clips.after(from_name)
+    print(f"get_file: from_ts {from_name}, num_files {remaining}")
 
-    sorted_files = sorted(filenames, key=lambda t: t[1])
-    print(f"sorted files {sorted_files}")
-    if from_name:
-        # Scan through sorted files and trim to the index of the first file newer than the filter
-        # If no files are newer, create empty list by trimming to len(files)
-        from_index = len(sorted_files)
-        for i in range(len(sorted_files)):
-            if sorted_files[i][1] > from_name:
-                from_index = i
-                break
-        sorted_files = sorted_files[from_index:]
+    if filepath is None:
+        return "No matching files", 204
+    print(f"Sending file {filepath}")
+    return send_file(filepath, as_attachment=True)
 
-    print(f"get_file: from_ts {from_name}, num_files {len(sorted_files)}")
 
-    if len(sorted_files) == 0:
-        return "No matching files", 204
-    filepath = os.path.join(*sorted_files[0])
-    print(f"Sending file {filepath} {sorted_files[0]}")
+@app.route("/clips/manifest")
+def get_manifest():
+    from_name = request.args.get("from")
+    try:
+        limit = int(request.args.get("limit", 100))
+    except ValueError:
+        return "Invalid limit: expected integer", 400
+    manifest = clips.manifest(from_name, limit)
+    print(f"get_manifest: from {from_name}, num_files {len(manifest)}")
+    return json.dumps(manifest)
+
+
+@app.route("/clips/<name>")
+def get_named_file(name):
+    # Only names in the index are served, so name cannot escape clipdir.
+    # send_file answers Range requests, which lets downloads resume.
+    filepath = clips.find(name)
+    if filepath is None:
+        return "No such file", 404
     return send_file(filepath, as_attachment=True)
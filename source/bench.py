@@ -0,0 +1,65 @@
+"""Benchmarks for the sensor loop's hot paths.
+
+python bench.py suite ROWS OUT.json    (see benchmarks/run.py)
+"""
+
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from buffer import WriteBuffer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../common"))
+from rolling import Rolling
+
+
+def per_sample(fn, samples):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) / samples
+
+
+def suite(rows, samples=200_000):
+    """Time Rolling and WriteBuffer per sample; return {metric: seconds},
+    lower being better. `rows` only caps the samples fed."""
+    samples = min(rows, samples)
+    values = [random.gauss(0, 1) for _ in range(samples)]
+    results = {}
+    for window in [3, 100, 5000]:
+
+        def feed():
+            rolling = Rolling(window)
+            for value in values:
+                rolling.append(value)
+                rolling.median()
+
+        results[f"source.rolling_{window}"] = per_sample(feed, samples)
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+
+    def connect():
+        con = sqlite3.connect(path)
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    connect().execute("CREATE TABLE measurements (ts, raw)")
+
+    def write():
+        buffer = WriteBuffer(connect, "INSERT INTO measurements (ts, raw) VALUES (?,?)")
+        for value in values:
+            buffer.append((datetime.now(), value))
+        buffer.close()
+
+    results["source.write_buffer"] = per_sample(write, samples)
+    return results
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["suite"]:
+        with open(sys.argv[3], "w") as f:
+            json.dump(suite(int(sys.argv[2])), f, indent=1)
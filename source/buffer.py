@@ -0,0 +1,220 @@
+import sqlite3
+import threading
+import time
+
+
+class WriterDied(RuntimeError):
+    """Raised by append() once the writer thread has stopped for good."""
+
+
+class WriteBuffer:
+    """Write-behind buffer that group-commits rows from a background thread.
+
+    Pending rows are written in one transaction when max_rows are queued, when
+    the oldest pending row is max_age_s old, or on close(). A crash loses
+    every row not yet committed: while writes succeed that is about max_rows
+    rows or max_age_s of data, plus the batch being written, but while they
+    fail it is everything queued since the last commit, up to max_pending
+    rows plus a batch.
+
+    A batch that fails with OperationalError (locked, disk full, I/O error)
+    is retried after backoff_s, doubling up to max_backoff_s, while new rows
+    queue up behind it; past max_pending rows the oldest are then dropped. A batch
+    that fails with any other sqlite3.Error would fail the same way again,
+    so it is dropped. If the writer thread dies anyway, append() raises
+    WriterDied instead of queueing rows nothing will write.
+    """
+
+    def __init__(
+        self,
+        connect,
+        query,
+        max_rows=500,
+        max_age_s=1.0,
+        max_pending=100_000,
+        backoff_s=0.5,
+        max_backoff_s=30,
+    ):
+        self.connect = connect
+        self.query = query
+        self.max_rows = max_rows
+        self.max_age_s = max_age_s
+        self.max_pending = max_pending
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+
+        self.pending = []
+        self.oldest = None
+        self.closed = False
+        self.error = None
+        self.retry_at = 0
+        self.backoff = backoff_s
+        self.cond = threading.Condition()
+
+        self.started = time.monotonic()
+        self.appended = 0
+        self.written = 0
+        self.commits = 0
+        self.failures = 0
+        self.dropped = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def append(self, row):
+        with self.cond:
+            if self.closed:
+                raise ValueError("WriteBuffer: append after close")
+            if self.error is not None:
+                raise WriterDied(f"WriteBuffer: writer thread died: {self.error}")
+            if not self.pending:
+                # Wake the writer so it starts the max_age_s countdown
+                self.oldest = time.monotonic()
+                self.cond.notify()
+            self.pending.append(row)
+            self.appended += 1
+            # Only while writes are failing: a writer merely behind catches up
+            if len(self.pending) > self.max_pending and self.backoff > self.backoff_s:
+                # Dropped a batch at a time, so this stays cheap per append
+                drop = max(len(self.pending) - self.max_pending, self.max_rows)
+                del self.pending[:drop]
+                if self.dropped == 0:
+                    print("WARNING: Writes are failing; dropping the oldest rows")
+                self.dropped += drop
+            if len(self.pending) >= self.max_rows:
+                self.cond.notify()
+
+    def due(self):
+        if not self.pending:
+            return False
+        if time.monotonic() < self.retry_at:
+            return False
+        if len(self.pending) >= self.max_rows:
+            return True
+        return time.monotonic() - self.oldest >= self.max_age_s
+
+    def wait_time(self):
+        if not self.pending:
+            return None
+        deadline = self.oldest + self.max_age_s
+        if len(self.pending) >= self.max_rows:
+            deadline = 0
+        return max(0, max(deadline, self.retry_at) - time.monotonic())
+
+    def run(self):
+        con = None
+        try:
+            con = self.connect()
+            while True:
+                with self.cond:
+                    while not self.closed and not self.due():
+                        self.cond.wait(self.wait_time())
+                    batch, oldest = self.pending, self.oldest
+                    self.pending, self.oldest = [], None
+                    closed = self.closed
+                if batch and not self.write(con, batch):
+                    if closed:
+                        print(f"WARNING: Gave up on {len(batch)} rows at close")
+                        return
+                    self.requeue(batch, oldest)
+                if closed:
+                    return
+        except Exception as e:
+            print(f"ERROR: WriteBuffer writer thread died: {e}")
+            with self.cond:
+                self.error = e
+        finally:
+            if con is not None:
+                con.close()
+
+    def write(self, con, batch):
+        """Commit batch; return False if it should be retried."""
+        try:
+            con.executemany(self.query, batch)
+            con.commit()
+        except sqlite3.OperationalError as e:
+            con.rollback()
+            self.failures += 1
+            print(
+                f"WARNING: Failed to write batch of {len(batch)} rows,"
+                f" retrying in {self.backoff:g}s: {e}"
+            )
+            return False
+        except sqlite3.Error as e:
+            con.rollback()
+            self.failures += 1
+            self.dropped += len(batch)
+            print(f"WARNING: Dropped batch of {len(batch)} rows: {e}")
+            return True
+        self.written += len(batch)
+        self.commits += 1
+        self.backoff = self.backoff_s
+        return True
+
+    def requeue(self, batch, oldest):
+        with self.cond:
+            self.pending = batch + self.pending
+            self.oldest = oldest
+            self.retry_at = time.monotonic() + self.backoff
+            self.backoff = min(self.backoff * 2, self.max_backoff_s)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            "appended": self.appended,
+            "written": self.written,
+            "commits": self.commits,
+            "pending": len(self.pending),
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "samples_per_s": self.appended / elapsed if elapsed else 0,
+        }
+
+
+def measure(stream, buffer, samples):
+    """Feed `samples` readings from a readstream()-style generator into the
+    buffer and return the achieved samples/sec, including the final flush."""
+    start = time.monotonic()
+    for _, row in zip(range(samples), stream):
+        buffer.append(row)
+    buffer.close()
+    return samples / (time.monotonic() - start)
+
+
+if __name__ == "__main__":
+    import os
+    import random
+    import tempfile
+    from datetime import datetime
+
+    def readstream():
+        while True:
+            yield (datetime.now(), random.randint(-40_000, -30_000))
+
+    def connect():
+        con = sqlite3.connect(path)
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    con = connect()
+    con.execute("CREATE TABLE measurements (ts, raw)")
+    query = "INSERT INTO measurements (ts, raw) VALUES (?,?)"
+
+    samples = 2_000
+    start = time.monotonic()
+    for _, row in zip(range(samples), readstream()):
+        con.execute(query, row)
+        con.commit()
+    print(f"commit per sample: {samples / (time.monotonic() - start):10,.0f} samples/s")
+
+    samples = 200_000
+    buffer = WriteBuffer(connect, query)
+    rate = measure(readstream(), buffer, samples)
+    print(f"write-behind:      {rate:10,.0f} samples/s {buffer.stats()}")
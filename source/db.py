@@ -3,17 +3,140 @@ import os
 
 datadir = os.environ.get("DATA_DIR", "/home/casey/data/")
 
-con = sqlite3.connect(os.path.join(datadir, "weights.db"))
+path = os.path.join(datadir, "weights.db")
+
+
+def connect():
+    con = sqlite3.connect(path)
+    # WAL lets the provider read while the sensor loop writes, and makes each
+    # group commit a single append to the log.
+    con.execute("PRAGMA journal_mode=WAL")
+    return con
+
+
+con = connect()
 cur = con.cursor()
 
+# ts is stored as wall-clock text; ts_ms is the same instant as integer
+# milliseconds so range and latest-row queries can use an index.
+TS_MS_SQL = "CAST(ROUND((julianday({}) - 2440587.5) * 86400000) AS INTEGER)"
+INSERT_MEASUREMENT = f"INSERT INTO measurements (id, ts, raw, config_id, ts_ms) VALUES (?1,?2,?3,?4,{TS_MS_SQL.format('?2')})"
+BACKFILL_CHUNK = 50_000
+ID_BLOCK = 100_000
+
+
+class Ids:
+    """Assigns measurement ids as samples are read, so a sample can be
+    pushed before its group commit.
+
+    Ids are reserved `block` at a time by moving the table's AUTOINCREMENT
+    counter past the block, one small commit per block. After a crash the
+    unused rest of a block is skipped rather than handed out again, so an id
+    pushed before its row was committed is never reused; close() returns
+    the rest after a clean shutdown.
+
+    A crash therefore leaves a gap of up to `block` ids (100k by default)
+    that no row ever fills. Rows pushed after the restart start past it, and
+    the consumer's watermark only steps over it on its next catchup.
+    """
+
+    def __init__(self, connect, block=ID_BLOCK):
+        self.connect = connect
+        self.block = block
+        self.last = None
+        self.end = None
+
+    def next(self):
+        if self.last is None or self.last == self.end:
+            self.reserve()
+        self.last += 1
+        return self.last
+
+    def set_seq(self, con, seq):
+        updated = con.execute(
+            "UPDATE sqlite_sequence SET seq = ? WHERE name = 'measurements'", (seq,)
+        ).rowcount
+        if not updated:
+            con.execute(
+                "INSERT INTO sqlite_sequence (name, seq) VALUES ('measurements', ?)",
+                (seq,),
+            )
+
+    def reserve(self):
+        con = self.connect()
+        try:
+            (start,) = con.execute(
+                "SELECT max(coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'measurements'), 0),"
+                " coalesce((SELECT max(id) FROM measurements), 0))"
+            ).fetchone()
+            self.set_seq(con, start + self.block)
+            con.commit()
+        finally:
+            con.close()
+        self.last, self.end = start, start + self.block
+
+    def close(self):
+        if self.last is None:
+            return
+        con = self.connect()
+        try:
+            # Only if nothing else reserved past this block meanwhile
+            con.execute(
+                "UPDATE sqlite_sequence SET seq = ? WHERE name = 'measurements' AND seq = ?",
+                (self.last, self.end),
+            )
+            con.commit()
+        finally:
+            con.close()
+        self.end = self.last
+
+
+def columns(table):
+    return [row[1] for row in cur.execute(f"PRAGMA table_info({table})")]
+
 
 def migrate():
     cur.execute(
-        "CREATE TABLE IF NOT EXISTS measurements (id INTEGER PRIMARY KEY AUTOINCREMENT, ts, raw, config_id)"
+        "CREATE TABLE IF NOT EXISTS measurements (id INTEGER PRIMARY KEY AUTOINCREMENT, ts, raw, config_id, ts_ms INTEGER)"
     )
     cur.execute(
         "CREATE TABLE IF NOT EXISTS configs (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, g_factor, raw_offset)"
     )
+    if "ts_ms" not in columns("measurements"):
+        cur.execute("ALTER TABLE measurements ADD COLUMN ts_ms INTEGER")
+    # Partial index: building it skips the not-yet-backfilled rows, and every
+    # range condition on ts_ms implies ts_ms IS NOT NULL so it stays usable.
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS measurements_ts_ms ON measurements (ts_ms) WHERE ts_ms IS NOT NULL"
+    )
+    con.commit()
+    backfill_ts()
+
+
+def backfill_ts(chunk=BACKFILL_CHUNK):
+    """Fill ts_ms for rows written before the column existed.
+
+    Walks the table by id in chunks and commits after each one, so the write
+    lock is only held for a single chunk at a time.
+    """
+    (start,) = cur.execute(
+        "SELECT min(id) FROM measurements WHERE ts_ms IS NULL"
+    ).fetchone()
+    if start is None:
+        return
+    filled = 0
+    while True:
+        (end,) = cur.execute("SELECT max(id) FROM measurements").fetchone()
+        if start > end:
+            break
+        cur.execute(
+            f"UPDATE measurements SET ts_ms = {TS_MS_SQL.format('ts')} WHERE id >= ? AND id < ? AND ts_ms IS NULL",
+            (start, start + chunk),
+        )
+        filled += cur.rowcount
+        con.commit()
+        start += chunk
+    print(f"Backfilled ts_ms for {filled} rows")
 
 
 def count():
@@ -2,14 +2,15 @@
 from hx711 import HX711
 from RPi import GPIO
 import logging
-from datetime import datetime, timedelta
-from sqlite3 import OperationalError
-import requests
+from datetime import datetime
 import os
 
-from rolling import Rolling
+from buffer import WriteBuffer
+from sampler import Sampler, current_config
+from trigger import TriggerDispatcher
+from uploader import Uploader
 print('Measure: Initializing...')
-from db import con, cur
+from db import con, connect, datadir, Ids, INSERT_MEASUREMENT
 
 logger = logging.getLogger(__name__)
 
@@ -22,22 +23,21 @@ class HX(HX711):
             except Exception as e:
                 logger.error(f'Failed to read: {e}')    
 
-g_factor = -10.97
-g_lb = 454
-offset = -35800
 DEBUG = os.environ.get('DEBUG', False)
+# Push samples to the consumer as they are read, e.g. http://consumer:8000/ingest/0
+INGEST_URL = os.environ.get('INGEST_URL')
+# Samples are group-committed; FLUSH_SECONDS is the most a crash can lose.
+FLUSH_ROWS = int(os.environ.get('FLUSH_ROWS', 500))
+FLUSH_SECONDS = float(os.environ.get('FLUSH_SECONDS', 1))
+CAMERA_URL = os.environ.get('CAMERA_URL', 'http://localhost:9000')
 
-config = cur.execute("SELECT id, g_factor, raw_offset FROM configs ORDER BY created_at DESC LIMIT 1").fetchone()
-if config is None or config[1] != g_factor or config[2] != offset:
-    cur.execute("INSERT INTO configs (g_factor, raw_offset) VALUES (?,?)",(g_factor, offset))
-    con.commit()
-    config =cur.execute("SELECT id FROM configs ORDER BY created_at DESC LIMIT 1").fetchone()
-config_id = config[0]
+config_id = current_config(con)
 
-
-recording=False
-threshold_time=datetime.now()
-rolling_pounds = Rolling(window=3)
+uploader = Uploader(INGEST_URL, os.path.join(datadir, 'spool')) if INGEST_URL else None
+buffer = WriteBuffer(connect, INSERT_MEASUREMENT, max_rows=FLUSH_ROWS, max_age_s=FLUSH_SECONDS)
+ids = Ids(connect)
+trigger = TriggerDispatcher(CAMERA_URL)
+sampler = Sampler(buffer, trigger, config_id, ids, uploader=uploader, debug=DEBUG)
 try:
     hx711 = HX(
         dout_pin=22,
@@ -48,38 +48,21 @@ try:
 
     hx711.reset()   # Before we start, reset the HX711 (not obligate)
     print('Measure: Collecting data...')
-    for ts, data in hx711.readstream():
-        try:
-            g=int((data-offset)/g_factor)
-            p=float(int(g*100/454)/100)
-            if DEBUG:
-                print(f"{ts} {data:12,} long; {g:12,}g; {p:3} pounds")
-            cur.execute(f"INSERT INTO measurements (ts, raw, config_id) VALUES (?,?,?)", (ts, data, config_id))
-            con.commit()
-            rolling_pounds.append(p)
-            rpmed = rolling_pounds.median()
-            if rpmed > 12 and rpmed < 100:
-                if not recording:
-                    if DEBUG:
-                        print(f'{datetime.now()} Starting recording: {p} lbs')
-                    recording = True
-                    requests.get('http://localhost:9000/start')
-                threshold_time=datetime.now()
-            elif recording:
-                if (datetime.now()-threshold_time)>timedelta(seconds=15):
-                    if DEBUG:
-                        print(f'{datetime.now()} Stopping recording: {p} lbs')
-                    requests.get('http://localhost:9000/stop')
-                    recording = False
-
-        except OperationalError as e:
-            print(f"WARNING: Failed to insert datapoint {ts}, {data}: {e}")
-        except Exception as e:
-            print(f"ERROR: Unknown exception for datapoint {ts}, {data}: {e}")
+    sampler.run(hx711.readstream())
 except KeyboardInterrupt:
     pass
 finally:
     print('Measure: Shutting down...')
     GPIO.cleanup()  # always do a GPIO cleanup in your scripts!
+    buffer.close()
+    ids.close()
+    if uploader:
+        uploader.close()
+    trigger.close()
+    if DEBUG:
+        print(f'Measure: {buffer.stats()}')
+        print(f'Measure: {trigger.stats()}')
+        if uploader:
+            print(f'Measure: {uploader.stats()}')
     con.close()
     print('Measure: Stopped.')
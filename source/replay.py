@@ -0,0 +1,152 @@
+"""Replay recorded or synthetic readings through the sensor loop, without an
+HX711.
+
+python replay.py synthetic [--hz 80] [--seconds 60] [--speed 1] [--ingest URL]
+python replay.py recorded SOURCE.db [--speed 1] [--limit N] [--ingest URL]
+
+Readings go through the same Sampler and WriteBuffer as hx711_sensors.py,
+into the weights.db under DATA_DIR, at real time or --speed times real time
+(0 for as fast as possible). Replayed samples are timestamped as if read
+when they are emitted, so their ts also advances --speed times faster than
+the wall clock; unpaced runs keep the trace's own spacing. Camera triggers
+are counted rather than sent. With --ingest, samples are also pushed to
+that consumer /ingest URL as they are read, as hx711_sensors.py does with
+INGEST_URL. The run's stats are printed as JSON.
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from sampler import G_FACTOR, G_LB, OFFSET, VISIT_HOLD
+
+
+def synthetic(seconds, hz=80, visit_every_s=60, visit_s=20, lbs=15, noise=40, seed=0):
+    """Yield (offset_s, raw) readings of an empty box with a visit of `lbs`
+    starting every visit_every_s."""
+    rng = random.Random(seed)
+    for i in range(int(seconds * hz)):
+        offset_s = i / hz
+        grams = lbs * G_LB if offset_s % visit_every_s >= visit_every_s - visit_s else 0
+        yield offset_s, int(OFFSET + G_FACTOR * grams + rng.gauss(0, noise))
+
+
+def recorded(path, limit=None):
+    """Yield (offset_s, raw) readings from a measurements DB, oldest first."""
+    con = sqlite3.connect(path)
+    query = "SELECT ts, raw FROM measurements WHERE raw IS NOT NULL ORDER BY id"
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+    start = None
+    for ts, raw in con.execute(query):
+        ts = datetime.fromisoformat(ts)
+        start = ts if start is None else start
+        yield (ts - start).total_seconds(), raw
+    con.close()
+
+
+class Pacer:
+    """Turns (offset_s, raw) into (ts, raw) readings, emitted `speed` times
+    faster than the trace, and tracks how far behind schedule it fell."""
+
+    def __init__(self, speed=1):
+        self.speed = speed
+        self.max_lag_s = 0
+
+    def pace(self, trace):
+        start = time.monotonic()
+        started = datetime.now()
+        for offset_s, raw in trace:
+            if not self.speed:
+                yield started + timedelta(seconds=offset_s), raw
+                continue
+            due = start + offset_s / self.speed
+            lag = time.monotonic() - due
+            if lag < 0:
+                time.sleep(-lag)
+            else:
+                self.max_lag_s = max(self.max_lag_s, lag)
+            yield started + timedelta(seconds=offset_s / self.speed), raw
+
+
+class CountingTrigger:
+    """Stands in for TriggerDispatcher; counts what would have been sent."""
+
+    def __init__(self):
+        self.starts = 0
+        self.stops = 0
+
+    def start(self):
+        self.starts += 1
+
+    def stop(self):
+        self.stops += 1
+
+
+def replay(trace, speed=1, flush_rows=500, flush_seconds=1, ingest_url=None):
+    """Run `trace` through the sensor loop into DATA_DIR's weights.db,
+    pushing to ingest_url if given, and return the run's stats."""
+    from buffer import WriteBuffer
+    from db import con, connect, datadir, Ids, INSERT_MEASUREMENT
+    from sampler import Sampler, current_config
+    from uploader import Uploader
+
+    uploader = None
+    if ingest_url:
+        uploader = Uploader(ingest_url, os.path.join(datadir, "spool"))
+    buffer = WriteBuffer(
+        connect, INSERT_MEASUREMENT, max_rows=flush_rows, max_age_s=flush_seconds
+    )
+    ids = Ids(connect)
+    trigger = CountingTrigger()
+    hold = VISIT_HOLD / speed if speed else VISIT_HOLD
+    sampler = Sampler(
+        buffer, trigger, current_config(con), ids, uploader=uploader, hold=hold
+    )
+    pacer = Pacer(speed)
+    start = time.perf_counter()
+    sampler.run(pacer.pace(trace))
+    buffer.close()
+    ids.close()
+    if uploader:
+        uploader.close()
+    elapsed = time.perf_counter() - start
+    stats = {
+        "samples": sampler.samples,
+        "seconds": elapsed,
+        "rate": sampler.samples / elapsed,
+        "max_lag_s": pacer.max_lag_s,
+        "visits": trigger.starts,
+        "buffer": buffer.stats(),
+    }
+    if uploader:
+        stats["uploader"] = uploader.stats()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", choices=["synthetic", "recorded"])
+    parser.add_argument("source", nargs="?", help="measurements DB to replay")
+    parser.add_argument("--hz", type=float, default=80)
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--speed", type=float, default=1)
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--ingest", help="consumer /ingest/<store> URL to push to")
+    parser.add_argument("--flush-seconds", type=float, default=1)
+    args = parser.parse_args()
+
+    if args.trace == "synthetic":
+        trace = synthetic(args.seconds, args.hz)
+    elif args.source is None:
+        parser.error("recorded needs a SOURCE.db")
+    else:
+        trace = recorded(args.source, args.limit)
+    stats = replay(
+        trace, args.speed, flush_seconds=args.flush_seconds, ingest_url=args.ingest
+    )
+    print(json.dumps(stats))
@@ -0,0 +1,111 @@
+from datetime import timedelta
+import os
+from sqlite3 import OperationalError
+import sys
+
+from buffer import WriterDied
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../common"))
+from rolling import Rolling
+
+# Calibration of the HX711 under the litter box
+G_FACTOR = -10.97
+G_LB = 454
+OFFSET = -35800
+# A visit is a median weight in this range, ending this long after the last
+VISIT_LBS = (12, 100)
+VISIT_HOLD = timedelta(seconds=15)
+
+
+def current_config(con, g_factor=G_FACTOR, offset=OFFSET):
+    """Return the id of the newest config, adding one if the calibration
+    has changed since."""
+    cur = con.cursor()
+    config = cur.execute(
+        "SELECT id, g_factor, raw_offset FROM configs ORDER BY created_at DESC LIMIT 1"
+    ).fetchone()
+    if config is None or config[1] != g_factor or config[2] != offset:
+        cur.execute(
+            "INSERT INTO configs (g_factor, raw_offset) VALUES (?,?)",
+            (g_factor, offset),
+        )
+        con.commit()
+        config = cur.execute(
+            "SELECT id FROM configs ORDER BY created_at DESC LIMIT 1"
+        ).fetchone()
+    return config[0]
+
+
+class Sampler:
+    """The sensor loop: stores each (ts, raw) reading under an id from `ids`,
+    hands it to `uploader` if given, and triggers the camera at the start and
+    end of a visit.
+
+    Readings can come from anything iterable, the HX711 on the Pi or
+    replay.py's recorded and synthetic traces. Visits are timed by the
+    readings' ts rather than the wall clock, so a replay running N times
+    faster than real time sees the same visits with a hold of VISIT_HOLD/N.
+    """
+
+    def __init__(
+        self,
+        buffer,
+        trigger,
+        config_id,
+        ids,
+        uploader=None,
+        g_factor=G_FACTOR,
+        offset=OFFSET,
+        hold=VISIT_HOLD,
+        debug=False,
+    ):
+        self.buffer = buffer
+        self.trigger = trigger
+        self.config_id = config_id
+        self.ids = ids
+        self.uploader = uploader
+        self.g_factor = g_factor
+        self.offset = offset
+        self.hold = hold
+        self.debug = debug
+        self.recording = False
+        self.threshold_time = None
+        self.rolling_pounds = Rolling(window=3)
+        self.samples = 0
+
+    def process(self, ts, data):
+        g = int((data - self.offset) / self.g_factor)
+        p = float(int(g * 100 / G_LB) / 100)
+        if self.debug:
+            print(f"{ts} {data:12,} long; {g:12,}g; {p:3} pounds")
+        row = (self.ids.next(), ts, data, self.config_id)
+        self.buffer.append(row)
+        if self.uploader is not None:
+            self.uploader.add(row)
+        self.samples += 1
+        self.rolling_pounds.append(p)
+        rpmed = self.rolling_pounds.median()
+        if VISIT_LBS[0] < rpmed < VISIT_LBS[1]:
+            if not self.recording:
+                if self.debug:
+                    print(f"{ts} Starting recording: {p} lbs")
+                self.recording = True
+                self.trigger.start()
+            self.threshold_time = ts
+        elif self.recording and ts - self.threshold_time > self.hold:
+            if self.debug:
+                print(f"{ts} Stopping recording: {p} lbs")
+            self.trigger.stop()
+            self.recording = False
+
+    def run(self, readings):
+        for ts, data in readings:
+            try:
+                self.process(ts, data)
+            except OperationalError as e:
+                print(f"WARNING: Failed to insert datapoint {ts}, {data}: {e}")
+            except WriterDied:
+                # Nothing would store the readings; let the service restart
+                raise
+            except Exception as e:
+                print(f"ERROR: Unknown exception for datapoint {ts}, {data}: {e}")
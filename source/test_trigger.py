@@ -0,0 +1,83 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from trigger import TriggerDispatcher
+
+HANG_S = 1
+
+
+@pytest.fixture
+def camera():
+    """Serve a stub camera app whose /start and /stop take HANG_S to
+    answer; yield its URL and the paths it was sent."""
+    paths = []
+
+    class HangingCamera(BaseHTTPRequestHandler):
+        def do_GET(self):
+            paths.append(self.path)
+            time.sleep(HANG_S)
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), HangingCamera)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", paths
+    server.shutdown()
+    server.server_close()
+
+
+def sample(trigger, hz=80, samples=240, visit_every=60):
+    """Run a sampling loop at `hz` that triggers the camera at the start
+    and end of every visit; return the worst lateness of a sample in s."""
+    period = 1 / hz
+    due = time.monotonic()
+    worst = 0
+    for i in range(samples):
+        worst = max(worst, time.monotonic() - due)
+        if i % visit_every == 0:
+            trigger("start" if i // visit_every % 2 == 0 else "stop")
+        due += period
+        time.sleep(max(0, due - time.monotonic()))
+    return worst
+
+
+def test_hanging_camera_does_not_delay_sampling(camera):
+    url, paths = camera
+    dispatcher = TriggerDispatcher(url, timeout=(0.5, 2 * HANG_S))
+    worst = sample(dispatcher.request)
+    dispatcher.close()
+    # An inline request would hold a sample back by the whole hang
+    assert worst < HANG_S / 10
+    assert paths[0] == "/start"
+    assert dispatcher.failures == 0
+
+
+def test_unchanged_state_is_not_sent(camera):
+    url, paths = camera
+    dispatcher = TriggerDispatcher(url)
+    dispatcher.stop()
+    dispatcher.close()
+    assert paths == []
+    assert dispatcher.requested == 1
+
+
+def test_stop_during_inflight_start_is_sent(camera):
+    url, paths = camera
+    dispatcher = TriggerDispatcher(url, timeout=(0.5, 2 * HANG_S))
+    dispatcher.start()
+    time.sleep(HANG_S / 4)
+    assert dispatcher.inflight == "start"
+    dispatcher.stop()
+    deadline = time.monotonic() + 4 * HANG_S
+    while dispatcher.dispatched < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    dispatcher.close()
+    assert paths == ["/start", "/stop"]
+    assert dispatcher.sent == "stop"
@@ -0,0 +1,122 @@
+from collections import deque
+import threading
+import time
+
+import requests
+
+
+class TriggerDispatcher:
+    """Sends camera start/stop triggers from a background thread.
+
+    start() and stop() only record the wanted state and return at once, so a
+    slow or dead camera app never holds up sampling. The thread sends the
+    latest wanted state over a keep-alive session, retrying with backoff.
+    Triggers that would not change the state being sent, or else the
+    camera's last acknowledged one, are dropped, and a start followed by a
+    stop before either was sent cancel out. After `retries` failed attempts the camera's state counts as
+    unknown, so the next trigger is sent whatever it is.
+    """
+
+    def __init__(self, url, timeout=(0.5, 2), retries=3, backoff_s=0.5):
+        self.url = url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.session = requests.Session()
+
+        # The sampling loop starts out not recording
+        self.sent = "stop"
+        self.wanted = "stop"
+        self.inflight = None
+        self.pending = False
+        self.closed = False
+        self.cond = threading.Condition()
+
+        self.requested = 0
+        self.dispatched = 0
+        self.failures = 0
+        self.abandoned = 0
+        self.latencies = deque(maxlen=1000)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def start(self):
+        self.request("start")
+
+    def stop(self):
+        self.request("stop")
+
+    def request(self, state):
+        with self.cond:
+            self.requested += 1
+            self.wanted = state
+            current = self.sent if self.inflight is None else self.inflight
+            if state != current:
+                self.pending = True
+                self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.closed and not self.pending:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                self.pending = False
+                state = self.wanted
+                if state == self.sent:
+                    continue
+                self.inflight = state
+            self.dispatch(state)
+            with self.cond:
+                self.inflight = None
+
+    def dispatch(self, state):
+        for attempt in range(self.retries + 1):
+            start = time.monotonic()
+            try:
+                response = self.session.get(f"{self.url}/{state}", timeout=self.timeout)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                self.failures += 1
+                print(f"WARNING: Camera {state} trigger failed: {e}")
+            else:
+                self.latencies.append(time.monotonic() - start)
+                self.dispatched += 1
+                with self.cond:
+                    self.sent = state
+                return
+            with self.cond:
+                # Back off, unless closed or the trigger was superseded
+                self.cond.wait_for(
+                    lambda: self.closed or self.pending,
+                    self.backoff_s * 2**attempt,
+                )
+                if self.closed or self.pending:
+                    self.sent = None
+                    return
+        self.abandoned += 1
+        with self.cond:
+            self.sent = None
+        print(f"WARNING: Gave up on camera {state} trigger")
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        self.session.close()
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            "requested": self.requested,
+            "dispatched": self.dispatched,
+            "failures": self.failures,
+            "abandoned": self.abandoned,
+            "latency_p50_ms": (
+                latencies[len(latencies) // 2] * 1000 if latencies else None
+            ),
+            "latency_max_ms": latencies[-1] * 1000 if latencies else None,
+        }
@@ -0,0 +1,258 @@
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+SPOOL_SUFFIX = ".ndjson.gz"
+# Statuses that mean the consumer could take the batch later
+RETRY_STATUSES = (408, 429)
+
+
+def delivered(status):
+    """Whether a POST needs no retry: the consumer took the batch, or refused
+    it in a way that sending it again would not change."""
+    if status is None:
+        return False
+    return status < 400 or (status < 500 and status not in RETRY_STATUSES)
+
+
+def read_spool(path):
+    """Return the rows of a spool file. A torn last append, from a crash
+    while spooling, ends the file early; catchup still brings those rows."""
+    rows = []
+    try:
+        with gzip.open(path, "rt") as f:
+            for line in f:
+                rows.append(json.loads(line))
+    except (EOFError, OSError, ValueError) as e:
+        print(f"WARNING: Spool file {path} ends early after {len(rows)} rows: {e}")
+    return rows
+
+
+class Uploader:
+    """Pushes samples to the consumer's /ingest from a background thread.
+
+    The sensor loop hands over each sample as it is read, with the id it is
+    committed under, so pushing neither waits for the group commit nor reads
+    anything back from SQLite. Rows are coalesced until max_rows are pending
+    or the oldest is max_age_s old, then POSTed as gzipped JSON over a
+    keep-alive session.
+
+    Rows the consumer does not take are spooled to spool_dir as gzipped
+    NDJSON, appended to the newest spool file until it holds max_rows. While
+    anything is spooled, new rows are spooled behind it max_rows at a time,
+    so the consumer receives rows in id order and the SD card sees few
+    writes. Spool files are retried oldest first with backoff; one the
+    consumer answers with a server error max_attempts times in a row is
+    dropped, and rows past max_spool_rows are not spooled at all. The spool
+    survives restarts.
+
+    Rows reach the consumer ahead of their commit and can skip ones it never
+    gets, so it sees ids out of order with gaps. Those gaps are filled by
+    its next catchup, which pages the committed rows by id. Until then the
+    consumer holds its sync watermark, and so event extraction, just before
+    the first gap (see advance_sync and events.EventExtractor).
+    """
+
+    def __init__(
+        self,
+        url,
+        spool_dir,
+        max_rows=2000,
+        max_age_s=0.1,
+        timeout=(0.5, 5),
+        backoff_s=0.5,
+        max_backoff_s=30,
+        max_attempts=5,
+        max_spool_rows=1_000_000,
+    ):
+        self.url = url
+        self.spool_dir = spool_dir
+        self.max_rows = max_rows
+        self.max_age_s = max_age_s
+        self.timeout = timeout
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.max_attempts = max_attempts
+        self.max_spool_rows = max_spool_rows
+        self.session = requests.Session()
+        os.makedirs(spool_dir, exist_ok=True)
+
+        self.pending = []
+        self.oldest = None
+        self.closed = False
+        self.cond = threading.Condition()
+        # [name, rows] of each spool file, oldest first
+        self.spool = [
+            [name, len(read_spool(os.path.join(spool_dir, name)))]
+            for name in sorted(os.listdir(spool_dir))
+            if name.endswith(SPOOL_SUFFIX)
+        ]
+        self.retry_at = 0
+        self.backoff = backoff_s
+        self.attempts = 0
+
+        self.added = 0
+        self.uploaded = 0
+        self.requests = 0
+        self.failures = 0
+        self.spooled = 0
+        self.dropped = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def add(self, row):
+        """Queue an (id, ts, raw, config_id) sample; called from the sensor
+        loop."""
+        id, ts, raw, config_id = row
+        with self.cond:
+            if not self.pending:
+                self.oldest = time.monotonic()
+                self.cond.notify()
+            self.pending.append([id, str(ts), raw, config_id])
+            self.added += 1
+            if len(self.pending) >= self.max_rows:
+                self.cond.notify()
+
+    def due(self):
+        if self.spool and time.monotonic() >= self.retry_at:
+            return True
+        if not self.pending:
+            return False
+        if len(self.pending) >= self.max_rows:
+            return True
+        # While spooling, rows go to disk max_rows at a time
+        return not self.spool and time.monotonic() - self.oldest >= self.max_age_s
+
+    def wait_time(self):
+        deadlines = []
+        if self.spool:
+            deadlines.append(self.retry_at)
+        elif self.pending:
+            deadlines.append(self.oldest + self.max_age_s)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.closed and not self.due():
+                    self.cond.wait(self.wait_time())
+                rows = self.pending[: self.max_rows]
+                self.pending = self.pending[self.max_rows :]
+                self.oldest = time.monotonic() if self.pending else None
+                closed = self.closed and not self.pending
+            if rows and (self.spool or not delivered(self.post(rows))):
+                self.write_spool(rows)
+            if self.spool and (closed or time.monotonic() >= self.retry_at):
+                self.drain()
+            if closed:
+                return
+
+    def post(self, rows):
+        """POST rows; return the response status, or None without one."""
+        self.requests += 1
+        body = gzip.compress(
+            json.dumps({"batch_time": str(datetime.now()), "data": rows}).encode()
+        )
+        try:
+            response = self.session.post(
+                self.url,
+                data=body,
+                headers={
+                    "Content-Type": "application/json",
+                    "Content-Encoding": "gzip",
+                },
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            self.fail(e)
+            return None
+        status = response.status_code
+        if delivered(status) and status >= 400:
+            # Retrying would not help; catchup still brings these rows
+            print(f"WARNING: {self.url} rejected a batch: {response.text}")
+        elif status >= 400:
+            self.fail(f"{status} {response.text}")
+        else:
+            self.uploaded += len(rows)
+        return status
+
+    def fail(self, error):
+        self.failures += 1
+        if self.failures == 1 or self.failures % 100 == 0:
+            print(f"WARNING: Upload to {self.url} failed ({self.failures}): {error}")
+
+    def write_spool(self, rows):
+        """Append rows to the newest spool file, starting a new one every
+        max_rows rows, up to max_spool_rows in all."""
+        room = self.max_spool_rows - sum(count for _, count in self.spool)
+        if room < len(rows):
+            if self.dropped == 0:
+                print("WARNING: Spool is full; leaving rows to catchup")
+            self.dropped += len(rows) - max(room, 0)
+            rows = rows[: max(room, 0)]
+        while rows:
+            if not self.spool or self.spool[-1][1] >= self.max_rows:
+                self.spool.append([f"{rows[0][0]:020d}{SPOOL_SUFFIX}", 0])
+            name, count = self.spool[-1]
+            part, rows = rows[: self.max_rows - count], rows[self.max_rows - count :]
+            # Each append is a gzip member of its own; readers see them joined
+            with open(os.path.join(self.spool_dir, name), "ab") as f:
+                f.write(
+                    gzip.compress("".join(f"{json.dumps(r)}\n" for r in part).encode())
+                )
+            self.spool[-1][1] += len(part)
+            self.spooled += len(part)
+
+    def drain(self):
+        """POST spool files oldest first until one fails, then back off."""
+        while self.spool:
+            name, _ = self.spool[0]
+            path = os.path.join(self.spool_dir, name)
+            rows = read_spool(path)
+            status = self.post(rows) if rows else 200
+            if not delivered(status):
+                if status is not None and status >= 500:
+                    self.attempts += 1
+                if self.attempts < self.max_attempts:
+                    self.retry_at = time.monotonic() + self.backoff
+                    self.backoff = min(self.backoff * 2, self.max_backoff_s)
+                    return
+                print(
+                    f"WARNING: Dropping spooled {name} after {self.attempts}"
+                    " server errors; catchup still brings its rows"
+                )
+                self.dropped += len(rows)
+            os.remove(path)
+            self.spool.pop(0)
+            self.attempts = 0
+        self.backoff = self.backoff_s
+
+    def close(self):
+        """Send what is pending, or spool it; spool files get one more
+        attempt."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+
+    def stats(self):
+        with self.cond:
+            pending = len(self.pending)
+        return {
+            "added": self.added,
+            "uploaded": self.uploaded,
+            "pending": pending,
+            "requests": self.requests,
+            "failures": self.failures,
+            "spooled": self.spooled,
+            "spool": len(self.spool),
+            "dropped": self.dropped,
+        }